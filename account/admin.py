@@ -1,4 +1,5 @@
 from django.contrib import admin
-from .models import Account
+from .models import Account, ImportJob
 # Register your models here.
 admin.site.register(Account)
+admin.site.register(ImportJob)
@@ -0,0 +1,190 @@
+import csv
+import io
+import mmap
+import multiprocessing
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from account_transfer.db import atomic_immediate
+from transaction.models import run_with_retry
+
+from .csv_import import (
+    NO_DATA_ROWS,
+    READ_SIZE,
+    REQUIRED_FIELDS,
+    decimal_balances,
+    drop_duplicates,
+    offset_rows,
+    parse_block,
+    parse_file_range,
+    read_blocks,
+    split_columns,
+)
+from .models import Account, ImportJob
+
+PART_SIZE = 8 * READ_SIZE
+# A quote or a \r that does not start a \r\n line ending.
+SEQUENTIAL_ONLY = re.compile(rb'"|\r(?!\n)')
+
+
+def plan_ranges(path, part_size):
+    # Splits the data rows of the file into byte ranges of about part_size
+    # that end on line boundaries. Returns (header_line, ranges), or None
+    # when the file has quoted fields or bare \r line endings: a quoted
+    # field can span lines, so those files are read sequentially.
+    with open(path, "rb") as data_file:
+        with mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if SEQUENTIAL_ONLY.search(data):
+                return None
+            size = len(data)
+            start = data.find(b"\n") + 1 or size
+            header_line = data[:start].decode("utf-8")
+            ranges = []
+            while start < size:
+                end = data.find(b"\n", min(start + part_size, size) - 1) + 1 or size
+                ranges.append((start, end))
+                start = end
+    return header_line, ranges
+
+
+def iter_parallel_parts(path, header_line, ranges, workers, fields=REQUIRED_FIELDS):
+    # Yields (blocks, row_count) per range, in file order, while a process
+    # pool parses up to 2 * workers ranges ahead.
+    ranges = iter(ranges)
+    offset = 0
+    context = multiprocessing.get_context("spawn")
+    pool = ProcessPoolExecutor(workers, mp_context=context)
+
+    def submit(start, end):
+        future = pool.submit(
+            parse_file_range, path, header_line, start, end, fields, 1, True
+        )
+        return start, end, future
+
+    try:
+        pending = deque(submit(*part) for part in islice(ranges, 2 * workers))
+        while pending:
+            start, end, future = pending.popleft()
+            following = next(ranges, None)
+            if following:
+                pending.append(submit(*following))
+            try:
+                blocks, rows = future.result()
+            except Exception:
+                # Parse again in this process with the real first row, so
+                # the error names the same row the web import would.
+                parse_file_range(path, header_line, start, end, fields, offset + 1)
+                raise
+            blocks = [decimal_balances(block) for block in blocks]
+            yield [offset_rows(block, offset) for block in blocks], rows
+            offset += rows
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def iter_local_parts(path, header_line, ranges, fields=REQUIRED_FIELDS):
+    offset = 0
+    for start, end in ranges:
+        blocks, rows = parse_file_range(
+            path, header_line, start, end, fields, offset + 1
+        )
+        yield blocks, rows
+        offset += rows
+
+
+def iter_sequential_parts(path, part_size, fields=REQUIRED_FIELDS):
+    # The web import's reader, one block per part.
+    with open(path, "rb") as data_file:
+        text_file = io.TextIOWrapper(data_file, encoding="utf-8", newline="")
+        for first_row, block in read_blocks(text_file, fields, part_size):
+            yield [parse_block(first_row, block)], len(block[0])
+
+
+def create_file_import(path, size, part_size=PART_SIZE):
+    return ImportJob.objects.create(
+        source_path=path, source_size=size, part_size=part_size
+    )
+
+
+def run_file_import(job, workers, batch_size=500, on_progress=None):
+    # Applies the parts in order, each in one transaction together with the
+    # job's checkpoint. Parts already committed by an earlier run are parsed
+    # again only to rebuild the refs seen so far, so duplicates are still
+    # detected across the whole file.
+    ImportJob.objects.filter(pk=job.pk).update(status=ImportJob.RUNNING, errors=[])
+    try:
+        plan = plan_ranges(job.source_path, job.part_size)
+        if plan is None:
+            parts = iter_sequential_parts(job.source_path, job.part_size)
+        elif workers > 1:
+            parts = iter_parallel_parts(job.source_path, *plan, workers)
+        else:
+            parts = iter_local_parts(job.source_path, *plan)
+
+        rows_read = 0
+        seen_refs = set()
+        with closing(parts):
+            for index, (blocks, rows) in enumerate(parts):
+                rows_read += rows
+                blocks = [drop_duplicates(block, seen_refs) for block in blocks]
+                if index < job.parts_committed:
+                    continue
+                _save_part(job, index, blocks, batch_size)
+                if on_progress:
+                    on_progress(job)
+        if not rows_read:
+            raise ValidationError(NO_DATA_ROWS)
+    except Exception as e:
+        job.refresh_from_db()
+        job.status = ImportJob.FAILED
+        job.errors = [_error_message(e)]
+    else:
+        job.status = ImportJob.COMPLETED
+        job.errors = []
+    job.finished = timezone.now()
+    job.save(update_fields=["status", "errors", "finished"])
+    return job
+
+
+def _save_part(job, index, blocks, batch_size):
+    # The part's accounts and the job's checkpoint commit together. The
+    # counters are updated before the retried transaction, so a retry cannot
+    # count a part twice; a failed run reloads them from the database.
+    batches = [batch for block in blocks for batch in split_columns(block, batch_size)]
+    for batch in batches:
+        job.rows_processed += len(batch.refs)
+        job.add_skipped_rows(batch.skipped_rows, batch.duplicate_rows)
+    job.parts_committed = index + 1
+
+    def save():
+        with atomic_immediate():
+            for batch in batches:
+                if batch.refs:
+                    Account.import_batch(batch, batch_size)
+            job.save(
+                update_fields=[
+                    "rows_processed",
+                    "rows_skipped",
+                    "rows_duplicate",
+                    "skipped_rows",
+                    "duplicate_rows",
+                    "parts_committed",
+                ]
+            )
+
+    run_with_retry(save)
+
+
+def _error_message(error):
+    # The messages the web import reports for the same problems.
+    if isinstance(error, (csv.Error, UnicodeDecodeError)):
+        return f"Error reading CSV file: {error}"
+    if isinstance(error, ValidationError):
+        return error.message
+    return f"{error}"
@@ -0,0 +1,155 @@
+import threading
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import transaction
+
+from account_transfer.replica import replica_read_alias
+
+ACCOUNT_KEY = "account:ref:{}"
+LIST_GENERATION_KEY = "account-list:generation"
+LIST_PAGE_KEY = "account-list:page:{}:{}:{}"
+ACCOUNT_VERSION_KEY = "account:version:{}"
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def account_cache():
+    return caches[settings.ACCOUNT_CACHE_ALIAS]
+
+
+def _count(name, hits=0, misses=0):
+    with _stats_lock:
+        _stats[f"{name}_hits"] += hits
+        _stats[f"{name}_misses"] += misses
+
+
+def cache_stats():
+    with _stats_lock:
+        return dict(_stats)
+
+
+def reset_cache_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def _timeout():
+    # Entries read from a lagging replica can be stored after the primary's
+    # post-commit invalidation, so they live no longer than the window in
+    # which the writer is pinned to the primary anyway.
+    if replica_read_alias():
+        return settings.DATABASE_REPLICA_STICKY_SECONDS
+    return DEFAULT_TIMEOUT
+
+
+# Account lookups. Cached accounts are only used to resolve refs to rows;
+# balances are always checked by the conditional UPDATE in the database.
+
+def get_accounts_by_ref(refs, loader):
+    refs = [ref for ref in refs if ref]
+    cache = account_cache()
+    cached = cache.get_many([ACCOUNT_KEY.format(ref) for ref in refs])
+    accounts = {
+        ref: cached[ACCOUNT_KEY.format(ref)]
+        for ref in refs
+        if ACCOUNT_KEY.format(ref) in cached
+    }
+    missing = [ref for ref in refs if ref not in accounts]
+    _count("account", hits=len(accounts), misses=len(missing))
+    if missing:
+        loaded = loader(missing)
+        cache.set_many(
+            {ACCOUNT_KEY.format(ref): account for ref, account in loaded.items()},
+            timeout=_timeout(),
+        )
+        accounts.update(loaded)
+    return accounts
+
+
+# Rendered account-list fragments. Each cached page stores the version
+# tokens of the accounts it shows and is only served while they are all
+# unchanged, so a balance change drops exactly those pages. Invalidation
+# just writes new tokens, leaving nothing to read, modify and write back
+# between processes. New accounts can land on any page, so they bump a
+# generation that is part of every page key instead. Pages rendered from the
+# replica are keyed apart from those rendered from the primary: one stored
+# after the writer's invalidation may still show the lagging state, and a
+# request pinned to the primary must never be served it.
+
+def _list_generation(cache):
+    return cache.get_or_set(LIST_GENERATION_KEY, 1, timeout=None)
+
+
+def _new_version():
+    return uuid.uuid4().hex
+
+
+def _account_versions(cache, account_ids):
+    keys = [ACCOUNT_VERSION_KEY.format(account_id) for account_id in account_ids]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # add() keeps a token another process set in the meantime. A token
+        # evicted later never matches again, so a page cannot outlive it.
+        for key in missing:
+            cache.add(key, _new_version(), timeout=None)
+        versions.update(cache.get_many(missing))
+    return versions
+
+
+def _list_page_key(cache, params):
+    source = replica_read_alias() or "primary"
+    return LIST_PAGE_KEY.format(source, _list_generation(cache), params)
+
+
+def get_list_page(params):
+    cache = account_cache()
+    entry = cache.get(_list_page_key(cache, params))
+    page = None
+    if entry is not None:
+        page, versions = entry
+        if cache.get_many(list(versions)) != versions:
+            page = None
+    _count("list_page", hits=page is not None, misses=page is None)
+    return page
+
+
+def set_list_page(params, page, account_ids):
+    cache = account_cache()
+    key = _list_page_key(cache, params)
+    versions = _account_versions(cache, account_ids)
+    cache.set(key, (page, versions), timeout=_timeout())
+
+
+def _invalidate(accounts, created, lookups):
+    cache = account_cache()
+    cache.set_many(
+        {
+            ACCOUNT_VERSION_KEY.format(account.pk): _new_version()
+            for account in accounts
+        },
+        timeout=None,
+    )
+    if lookups:
+        cache.delete_many([ACCOUNT_KEY.format(account.ref) for account in accounts])
+    if created:
+        try:
+            cache.incr(LIST_GENERATION_KEY)
+        except ValueError:
+            cache.set(LIST_GENERATION_KEY, 1, timeout=None)
+
+
+def invalidate_accounts(accounts, created=False, lookups=True):
+    # Invalidates now and again after commit, so a reader that cached the
+    # pre-commit state in between cannot keep it. lookups=False keeps the
+    # per-ref lookups and only drops the list pages showing the accounts.
+    accounts = list(accounts)
+    if not accounts and not created:
+        return
+    _invalidate(accounts, created, lookups)
+    transaction.on_commit(lambda: _invalidate(accounts, created, lookups))
@@ -0,0 +1,336 @@
+import csv
+import io
+import mmap
+from collections import namedtuple
+from decimal import Context, Decimal, DecimalException, Inexact, InvalidOperation
+from functools import reduce
+from itertools import chain, compress, islice, repeat
+from operator import itemgetter
+
+from django.core.exceptions import ValidationError
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.csv
+except ImportError:
+    pyarrow = None
+
+REQUIRED_FIELDS = ("ID", "Name", "Balance")
+NO_DATA_ROWS = "The CSV file contains only headers and no data rows."
+READ_SIZE = 1 << 20
+CENTS = Decimal("0.01")
+# Arithmetic under this context raises instead of rounding, so balances are
+# either kept exactly or rejected. The precision matches Account.balance.
+BALANCE_CONTEXT = Context(prec=100, traps=[InvalidOperation, Inexact])
+
+# Parsed rows, column by column. row_numbers are the 1-based data row
+# numbers of the accepted rows.
+AccountColumns = namedtuple(
+    "AccountColumns",
+    ["row_numbers", "refs", "names", "balances", "skipped_rows", "duplicate_rows"],
+)
+
+
+def read_headers(header_line, fields=REQUIRED_FIELDS):
+    # Returns (width, positions): the number of columns and the column of
+    # each field.
+    headers = next(csv.reader([header_line]), None)
+    if not headers:
+        raise ValidationError("The CSV file does not contain any headers.")
+    missing_headers = [field for field in fields if field not in headers]
+    if missing_headers:
+        raise ValidationError(
+            f"Missing required headers in CSV: {', '.join(missing_headers)}"
+        )
+    # A repeated header name maps to its last column, as with DictReader.
+    columns = {name: index for index, name in enumerate(headers)}
+    return len(headers), [columns[field] for field in fields]
+
+
+def read_blocks(text_file, fields=REQUIRED_FIELDS, read_size=READ_SIZE):
+    # Yields (first_row_number, columns) blocks, where columns holds one
+    # list of raw strings per field. Blocks of plain CSV (no quotes, the
+    # same field count on every line) are split with str methods over the
+    # whole block; anything else goes through csv.reader.
+    width, positions = read_headers(text_file.readline(), fields)
+    first_row = 1
+    for block in iter_column_blocks(text_file, width, positions, read_size):
+        yield first_row, block
+        first_row += len(block[0])
+    if first_row == 1:
+        raise ValidationError(NO_DATA_ROWS)
+
+
+def iter_column_blocks(text_file, width, positions, read_size=READ_SIZE):
+    # With pyarrow installed, plain blocks are split by its CSV reader and
+    # yielded as Arrow columns, which parse_block validates without leaving
+    # Arrow for any row that is accepted.
+    pending = ""
+    at_end = False
+    while not at_end:
+        text = pending + text_file.read(read_size)
+        at_end = len(text) - len(pending) < read_size
+        if at_end:
+            pending = ""
+            if text and not text.endswith("\n"):
+                text += "\n"
+        else:
+            cut = text.rfind("\n") + 1
+            text, pending = text[:cut], text[cut:]
+        if not text:
+            continue
+
+        bare_cr = "\r" in text and text.count("\r") != text.count("\r\n")
+        if '"' in text or bare_cr:
+            # Quoted fields may span lines and blocks, so the rest of the
+            # file is read by csv.reader.
+            rest = io.StringIO(text + pending + text_file.readline(), newline="")
+            yield from _csv_column_blocks(chain(rest, text_file), positions, read_size)
+            return
+
+        if pyarrow is not None:
+            block = _arrow_columns(text, width, positions)
+            if block is not None:
+                if len(block[0]):
+                    yield block
+                continue
+
+        if "\r" in text:
+            text = text.replace("\r\n", "\n")
+        lines = text.split("\n")
+        lines.pop()
+        if "" in lines:
+            lines = list(filter(None, lines))  # Blank lines are not data rows.
+        if not lines:
+            continue
+        counts = list(map(str.count, lines, repeat(",")))
+        if min(counts) == max(counts) == width - 1:
+            cells = ",".join(lines).split(",")
+            yield [cells[position::width] for position in positions]
+        else:
+            yield _rows_to_columns(list(filter(None, csv.reader(lines))), positions)
+
+
+def _arrow_columns(text, width, positions):
+    # None when the lines do not all have width fields; the str and
+    # csv.reader path handles those. Blank lines are skipped by both, and
+    # pyarrow ends lines at \r\n as well as \n.
+    names = list(map(str, range(width)))
+    try:
+        table = pyarrow.csv.read_csv(
+            io.BytesIO(text.encode()),
+            read_options=pyarrow.csv.ReadOptions(column_names=names),
+            convert_options=pyarrow.csv.ConvertOptions(
+                include_columns=[names[position] for position in positions],
+                column_types=dict.fromkeys(names, pyarrow.string()),
+            ),
+        )
+    except pyarrow.ArrowInvalid:
+        return None
+    return table.columns
+
+
+def _csv_column_blocks(lines, positions, read_size):
+    rows = filter(None, csv.reader(lines))
+    while True:
+        block = list(islice(rows, max(1, read_size // 32)))
+        if not block:
+            return
+        yield _rows_to_columns(block, positions)
+
+
+def _rows_to_columns(rows, positions):
+    width = max(positions) + 1
+    if min(map(len, rows)) < width:
+        rows = [row + [""] * (width - len(row)) for row in rows]
+    return [list(map(itemgetter(position), rows)) for position in positions]
+
+
+def parse_block(first_row, columns):
+    # Drops rows with a blank required field and parses the balance column
+    # as Decimal. Pure, so blocks can be parsed in any order or process.
+    if pyarrow is not None and isinstance(columns[0], pyarrow.ChunkedArray):
+        parsed = _parse_arrow_block(first_row, columns)
+        if parsed is not None:
+            return parsed
+        columns = [column.to_pylist() for column in columns]
+    row_numbers = range(first_row, first_row + len(columns[0]))
+    skipped_rows = []
+    if not all(all(map(str.strip, column)) for column in columns):
+        blank = set()
+        for column in columns:
+            blank.update(
+                index for index, value in enumerate(map(str.strip, column)) if not value
+            )
+        keep = [index not in blank for index in range(len(row_numbers))]
+        columns = [list(compress(column, keep)) for column in columns]
+        skipped_rows = [first_row + index for index in sorted(blank)]
+        row_numbers = compress(row_numbers, keep)
+    refs, names, balances = columns
+    row_numbers = list(row_numbers)
+    return AccountColumns(
+        row_numbers,
+        refs,
+        names,
+        parse_balances(balances, row_numbers),
+        skipped_rows,
+        [],
+    )
+
+
+def _parse_arrow_block(first_row, columns):
+    # Accepts a block with no blank field whose balances all cast exactly
+    # to non-negative decimals with two places; a cast that would round
+    # fails, as does one of a blank balance. Returns None for any other
+    # block, which is then parsed in Python, so skipped rows and errors
+    # are reported the same way.
+    compute = pyarrow.compute
+    refs, names, balances = columns
+    for column in (refs, names):
+        if not compute.min(compute.binary_length(column)).as_py():
+            return None
+        if compute.any(compute.utf8_is_space(column)).as_py():
+            return None
+    try:
+        exact = compute.cast(balances, pyarrow.decimal128(38, 2))
+    except pyarrow.ArrowInvalid:
+        return None
+    if compute.min(exact).as_py() < 0:
+        return None
+    return AccountColumns(
+        list(range(first_row, first_row + len(refs))),
+        refs.to_pylist(),
+        names.to_pylist(),
+        list(map(BALANCE_CONTEXT.create_decimal, balances.to_pylist())),
+        [],
+        [],
+    )
+
+
+def parse_file_range(
+    path,
+    header_line,
+    start,
+    end,
+    fields=REQUIRED_FIELDS,
+    first_row=1,
+    text_balances=False,
+):
+    # Parses the data rows in bytes [start, end) of the file at path, which
+    # must begin and end on line boundaries of a file without quoted fields.
+    # Returns (parsed blocks, row count). Runs in import_accounts' worker
+    # processes, which is why it takes a path rather than a file. Validated
+    # balances pickle several times faster as their exact str form than as
+    # Decimal, so text_balances returns them that way for decimal_balances.
+    width, positions = read_headers(header_line, fields)
+    with open(path, "rb") as data_file:
+        with mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            text = data[start:end].decode("utf-8")
+    blocks = []
+    rows = 0
+    for block in iter_column_blocks(io.StringIO(text, newline=""), width, positions):
+        columns = parse_block(first_row + rows, block)
+        if text_balances:
+            columns = columns._replace(balances=list(map(str, columns.balances)))
+        blocks.append(columns)
+        rows += len(block[0])
+    return blocks, rows
+
+
+def decimal_balances(columns):
+    return columns._replace(balances=list(map(Decimal, columns.balances)))
+
+
+def offset_rows(columns, offset):
+    # Renumbers a block parsed on its own so its rows follow offset earlier
+    # rows of the file.
+    if not offset:
+        return columns
+    return columns._replace(
+        row_numbers=[row + offset for row in columns.row_numbers],
+        skipped_rows=[row + offset for row in columns.skipped_rows],
+        duplicate_rows=[row + offset for row in columns.duplicate_rows],
+    )
+
+
+def parse_balance(value):
+    balance = BALANCE_CONTEXT.quantize(Decimal(value), CENTS)
+    if not balance.is_finite():
+        raise InvalidOperation(value)
+    return balance
+
+
+def parse_balances(values, row_numbers):
+    # The exact sum of a column has the smallest exponent among its values
+    # and is only finite if they all are, so one check covers the block.
+    # Only a block failing it is parsed again value by value.
+    try:
+        balances = list(map(BALANCE_CONTEXT.create_decimal, values))
+        total = reduce(BALANCE_CONTEXT.add, balances, Decimal(0))
+        exact = total.is_finite() and total.as_tuple().exponent >= -2
+    except DecimalException:
+        exact = False
+    if not exact:
+        balances = []
+        for value, row_number in zip(values, row_numbers):
+            try:
+                balances.append(parse_balance(value))
+            except DecimalException:
+                raise ValueError(
+                    f"Invalid balance '{value.strip()}' on row {row_number}."
+                )
+    if balances and min(balances) < 0:
+        raise ValueError("Balance cannot be negative.")
+    return balances
+
+
+def drop_duplicates(columns, seen_refs):
+    # Keeps the first row for each ref across the whole file and reports
+    # the later ones. seen_refs carries the refs of earlier blocks, so an
+    # import holds every distinct ref of the file in memory: about 100 bytes
+    # for a short ref, or 100 MB per million accounts. It has to be exact.
+    # A bounded filter would drop rows wrongly on false positives, and the
+    # database cannot tell an earlier row of this file from an existing
+    # account that the import is meant to update.
+    # A block of new refs grows the set by one per row unless it repeats a
+    # ref itself, in which case its refs are taken out again.
+    if seen_refs.isdisjoint(columns.refs):
+        seen = len(seen_refs)
+        seen_refs.update(columns.refs)
+        if len(seen_refs) - seen == len(columns.refs):
+            return columns
+        seen_refs.difference_update(columns.refs)
+
+    keep = []
+    duplicate_rows = []
+    for ref, row_number in zip(columns.refs, columns.row_numbers):
+        duplicate = ref in seen_refs
+        keep.append(not duplicate)
+        if duplicate:
+            duplicate_rows.append(row_number)
+        else:
+            seen_refs.add(ref)
+    return AccountColumns(
+        list(compress(columns.row_numbers, keep)),
+        list(compress(columns.refs, keep)),
+        list(compress(columns.names, keep)),
+        list(compress(columns.balances, keep)),
+        columns.skipped_rows,
+        duplicate_rows,
+    )
+
+
+def split_columns(columns, size):
+    # Cuts a parsed block into save batches of at most size rows. Skipped
+    # and duplicate row numbers travel with the first batch.
+    for start in range(0, max(len(columns.refs), 1), size):
+        end = start + size
+        yield AccountColumns(
+            columns.row_numbers[start:end],
+            columns.refs[start:end],
+            columns.names[start:end],
+            columns.balances[start:end],
+            columns.skipped_rows if not start else [],
+            columns.duplicate_rows if not start else [],
+        )
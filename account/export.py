@@ -0,0 +1,76 @@
+import csv
+import io
+import itertools
+import zlib
+
+from transaction.models import ArchivedTransaction, Transactions
+
+from .csv_import import REQUIRED_FIELDS
+from .models import Account, AccountBalanceShard
+
+CHUNK_SIZE = 2000
+TRANSACTION_HEADERS = ("ID", "Created", "Sender", "Recipient", "Amount")
+TRANSACTION_FIELDS = ("id", "created", "sender__ref", "recipient__ref", "amount")
+
+
+def _csv_chunks(headers, rows, chunk_size):
+    # Renders rows to CSV text chunk_size rows at a time, so only one chunk
+    # is ever held in memory.
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(headers)
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending == chunk_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue()
+
+
+def account_rows(chunk_size=CHUNK_SIZE):
+    # Balances include pending shard credits of hot accounts, so the file
+    # holds what each account really has. There are few hot accounts, so
+    # their totals are read once up front.
+    hot_ids = Account.objects.filter(is_hot=True).values_list("pk", flat=True)
+    shard_totals = AccountBalanceShard.totals(list(hot_ids))
+    rows = (
+        Account.objects.order_by("pk")
+        .values_list("pk", "ref", "name", "balance")
+        .iterator(chunk_size=chunk_size)
+    )
+    for pk, ref, name, balance in rows:
+        if pk in shard_totals:
+            balance += shard_totals[pk]
+        yield ref, name, balance
+
+
+def export_accounts(chunk_size=CHUNK_SIZE):
+    # The headers are the import's, so the file can be imported back.
+    return _csv_chunks(REQUIRED_FIELDS, account_rows(chunk_size), chunk_size)
+
+
+def export_transactions(account, chunk_size=CHUNK_SIZE):
+    # Oldest first, with the Sender, Recipient and Amount columns the bulk
+    # transfer upload reads. Archived transactions are all older than the
+    # hot table's, so they come first.
+    rows = itertools.chain.from_iterable(
+        model.history(account, fields=TRANSACTION_FIELDS)
+        .order_by("created", "id")
+        .values_list(*TRANSACTION_FIELDS)
+        .iterator(chunk_size=chunk_size)
+        for model in (ArchivedTransaction, Transactions)
+    )
+    return _csv_chunks(TRANSACTION_HEADERS, rows, chunk_size)
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # 31: gzip header and trailer.
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,71 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .models import ImportJob
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.ACCOUNT_IMPORT_WORKERS,
+                thread_name_prefix="account-import",
+            )
+    return _executor
+
+
+def submit_import_job(job):
+    # ACCOUNT_IMPORT_WORKERS = 0 runs the job inline, which keeps tests and
+    # single-process deployments free of background threads.
+    if settings.ACCOUNT_IMPORT_WORKERS <= 0:
+        run_import_job(job.pk)
+        job.refresh_from_db()
+        return
+    transaction.on_commit(lambda: _get_executor().submit(_run_in_worker, job.pk))
+
+
+def _run_in_worker(job_id):
+    try:
+        run_import_job(job_id)
+    finally:
+        connections.close_all()
+
+
+def run_import_job(job_id):
+    from .views import ImportAccountsView
+
+    job = ImportJob.objects.get(pk=job_id)
+    jobs = ImportJob.objects.filter(pk=job_id)
+    jobs.update(status=ImportJob.RUNNING)
+
+    def report_progress(imported_rows):
+        jobs.update(rows_processed=imported_rows, rows_skipped=job.rows_skipped)
+
+    try:
+        with job.data_file.open("rb") as data_file:
+            imported_rows = ImportAccountsView()._import_csv_file(
+                data_file, job, on_progress=report_progress
+            )
+    except Exception as e:
+        jobs.update(status=ImportJob.FAILED, errors=[f"{e}"], finished=timezone.now())
+    else:
+        jobs.update(
+            status=ImportJob.COMPLETED,
+            rows_processed=imported_rows,
+            rows_skipped=job.rows_skipped,
+            rows_duplicate=job.rows_duplicate,
+            skipped_rows=job.skipped_rows,
+            duplicate_rows=job.duplicate_rows,
+            finished=timezone.now(),
+        )
+    finally:
+        job.data_file.delete(save=False)
+        jobs.update(data_file="")
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.14 on 2026-10-18 01:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0003_importjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='account',
+            index=models.Index(fields=['name'], name='account_name_idx'),
+        ),
+    ]
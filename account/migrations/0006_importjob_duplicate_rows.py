@@ -0,0 +1,18 @@
+# Generated by Django 4.2.14 on 2026-10-18 01:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0005_account_is_hot_accountbalanceshard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='duplicate_rows',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.14 on 2026-10-18 02:39
+
+from django.db import migrations, models
+
+
+def count_duplicate_rows(apps, schema_editor):
+    # Earlier jobs listed every duplicate row, so their lists give the count.
+    ImportJob = apps.get_model("account", "ImportJob")
+    for job in ImportJob.objects.exclude(duplicate_rows=[]).iterator():
+        job.rows_duplicate = len(job.duplicate_rows)
+        job.save(update_fields=["rows_duplicate"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0007_importjob_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='rows_duplicate',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunPython(count_duplicate_rows, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,45 @@
-from django.db import models
+import random
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, models
+from django.db.models import Case, F, OuterRef, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from account_transfer.db import atomic_immediate
+
+from .cache import get_accounts_by_ref, invalidate_accounts
+
+
+class BalanceExpressionField(models.DecimalField):
+    # Output field for computed balances. SQLite returns arithmetic on
+    # decimal columns unquantized, so 150.00 would come back as 150.
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return Decimal(value).quantize(Decimal(1).scaleb(-self.decimal_places))
+
+
+class AccountQuerySet(models.QuerySet):
+    def with_current_balance(self):
+        # current_balance is what the account really has: the row balance
+        # plus, for hot accounts, the credits still on their shards. The
+        # shard subquery only runs for hot rows.
+        shard_total = (
+            AccountBalanceShard.objects.filter(account=OuterRef("pk"))
+            .values("account")
+            .annotate(total=Sum("balance"))
+            .values("total")
+        )
+        return self.annotate(
+            current_balance=Case(
+                When(is_hot=True, then=F("balance") + Coalesce(Subquery(shard_total), 0)),
+                default=F("balance"),
+                output_field=BalanceExpressionField(max_digits=100, decimal_places=2),
+            )
+        )
 
 
 class Account(models.Model):
@@ -6,18 +47,240 @@ class Account(models.Model):
     ref = models.CharField(max_length=100, unique=True, null=False, blank=False)
     name = models.CharField(max_length=100, null=False, blank=False)
     balance = models.DecimalField(max_digits=100, decimal_places=2, default=0.00)
+    # Hot accounts take single transfer credits on AccountBalanceShard rows
+    # instead of this row; see AccountBalanceShard.
+    is_hot = models.BooleanField(default=False)
+
+    objects = AccountQuerySet.as_manager()
+
+    class Meta:
+        indexes = [models.Index(fields=["name"], name="account_name_idx")]
+
+    def available_balance(self):
+        if not self.is_hot:
+            return self.balance
+        return self.balance + AccountBalanceShard.total(self.pk)
 
     def can_transfer(self, transaction_amount):
-        return self.balance >= transaction_amount
+        return self.available_balance() >= transaction_amount
+
 
     
     @classmethod
     def _get_account_by_ref(cls, ref):
+        return cls._get_accounts_by_ref([ref]).get(ref)
+
+    @classmethod
+    def _get_accounts_by_ref(cls, refs):
+        # Read-through the accounts cache; see account/cache.py.
+        return get_accounts_by_ref(
+            refs, lambda missing: cls.objects.in_bulk(missing, field_name="ref")
+        )
+
+    @classmethod
+    def _lock_accounts_by_ref(cls, refs):
+        # Rows are locked in primary key order so concurrent callers always
+        # acquire them in the same order and cannot deadlock each other.
+        refs = sorted(set(refs))
+        batch_size = connection.features.max_query_params or len(refs) or 1
+        accounts = {}
+        for start in range(0, len(refs), batch_size):
+            batch = refs[start : start + batch_size]
+            for account in (
+                cls.objects.select_for_update().filter(ref__in=batch).order_by("pk")
+            ):
+                accounts[account.ref] = account
+        return accounts
+
+    @classmethod
+    def import_batch(cls, batch, batch_size=500):
+        # Saves one AccountColumns batch of a CSV import, with one INSERT ...
+        # ON CONFLICT (ref) DO UPDATE. The keyed read before it is only for
+        # the ledger: it locks the rows being overwritten and returns their
+        # previous balances. BEGIN IMMEDIATE takes the SQLite write lock
+        # before that read, so a transfer committing in between cannot fail
+        # the write; lock timeouts are retried.
+        from transaction.models import run_with_retry
+
         try:
-            account = cls.objects.get(ref=ref)
-            return account
-        except cls.DoesNotExist:
-            return None
+            run_with_retry(lambda: cls._save_import_batch(batch, batch_size))
+        except Exception as e:
+            raise Exception(f"Error saving accounts: {e}")
+
+    @classmethod
+    def _save_import_batch(cls, batch, batch_size):
+        from transaction.models import LedgerEntry
+        from transaction.shards import fold_and_record_shards
+
+        with atomic_immediate():
+            previous = {
+                ref: (pk, balance, is_hot)
+                for ref, pk, balance, is_hot in cls.objects.select_for_update()
+                .filter(ref__in=batch.refs)
+                .order_by("pk")
+                .values_list("ref", "pk", "balance", "is_hot")
+            }
+            # Pending shard credits are part of a hot account's balance,
+            # so they are folded in before the import overwrites it.
+            folded = fold_and_record_shards(
+                [pk for pk, balance, is_hot in previous.values() if is_hot]
+            )
+            cls.objects.bulk_create(
+                [
+                    cls(ref=ref, name=name, balance=balance)
+                    for ref, name, balance in zip(
+                        batch.refs, batch.names, batch.balances
+                    )
+                ],
+                update_conflicts=True,
+                unique_fields=["ref"],
+                update_fields=["name", "balance"],
+                batch_size=batch_size,
+            )
+            created_refs = [ref for ref in batch.refs if ref not in previous]
+            if created_refs:
+                previous.update(
+                    (ref, (pk, 0, False))
+                    for ref, pk in cls.objects.filter(
+                        ref__in=created_refs
+                    ).values_list("ref", "pk")
+                )
+            deltas = {}
+            for ref, balance in zip(batch.refs, batch.balances):
+                pk, previous_balance, is_hot = previous[ref]
+                deltas[pk] = balance - previous_balance - folded.get(pk, 0)
+            LedgerEntry.post_adjustments(
+                deltas, LedgerEntry.IMPORT, batch_size=batch_size
+            )
+            invalidate_accounts(
+                [cls(pk=pk, ref=ref) for ref, (pk, *_) in previous.items()],
+                created=bool(created_refs),
+            )
+
+    def __str__(self):
+        return f"{self.name} - {self.balance}"
+
+
+class AccountBalanceShard(models.Model):
+    # Credits to a hot account are spread over settings.ACCOUNT_BALANCE_SHARDS
+    # rows chosen at random, so concurrent transfers to it do not queue on
+    # one row lock. The account's balance is Account.balance plus the sum of
+    # its shards until compact_balance_shards folds them back. The received
+    # counters do the same for the account's ledger summary.
+    account = models.ForeignKey(
+        Account, related_name="balance_shards", on_delete=models.CASCADE, db_index=False
+    )
+    shard = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=100, decimal_places=2, default=0)
+    received_count = models.PositiveBigIntegerField(default=0)
+    last_activity = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["account", "shard"], name="account_balance_shard_unique"
+            )
+        ]
+
+    @classmethod
+    def create_for(cls, account_id, shards=None):
+        shards = shards or settings.ACCOUNT_BALANCE_SHARDS
+        cls.objects.bulk_create(
+            [cls(account_id=account_id, shard=shard) for shard in range(shards)],
+            ignore_conflicts=True,
+        )
+
+    @classmethod
+    def credit(cls, account_id, amount, when):
+        # Returns False when the chosen shard does not exist, so the caller
+        # can credit the account row instead.
+        return bool(
+            cls.objects.filter(
+                account_id=account_id,
+                shard=random.randrange(settings.ACCOUNT_BALANCE_SHARDS),
+            ).update(
+                balance=F("balance") + amount,
+                received_count=F("received_count") + 1,
+                last_activity=when,
+            )
+        )
+
+    @classmethod
+    def total(cls, account_id):
+        return cls.totals([account_id]).get(account_id, 0)
+
+    @classmethod
+    def totals(cls, account_ids):
+        return dict(
+            cls.objects.filter(account_id__in=account_ids)
+            .values("account_id")
+            .annotate(total=Sum("balance"))
+            .order_by()
+            .values_list("account_id", "total")
+        )
+
+    def __str__(self):
+        return f"{self.account_id}#{self.shard} : {self.balance}"
+
+
+class ImportJob(models.Model):
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (COMPLETED, "Completed"),
+        (FAILED, "Failed"),
+    ]
+
+    # Row numbers reported per kind of skipped row. The counts cover them
+    # all; only the first ones are listed, so saving a job stays cheap
+    # however many rows a large file skips.
+    MAX_REPORTED_ROWS = 100
+
+    data_file = models.FileField(upload_to="imports/", blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    rows_processed = models.PositiveBigIntegerField(default=0)
+    rows_skipped = models.PositiveBigIntegerField(default=0)
+    rows_duplicate = models.PositiveBigIntegerField(default=0)
+    skipped_rows = models.JSONField(default=list, blank=True)
+    duplicate_rows = models.JSONField(default=list, blank=True)
+    errors = models.JSONField(default=list, blank=True)
+    created = models.DateTimeField(default=timezone.now)
+    finished = models.DateTimeField(null=True, blank=True)
+    # Checkpoint of an import_accounts run: the file is read in parts of
+    # part_size bytes, and parts_committed of them have been saved.
+    source_path = models.CharField(max_length=1024, blank=True)
+    source_size = models.PositiveBigIntegerField(null=True, blank=True)
+    part_size = models.PositiveIntegerField(null=True, blank=True)
+    parts_committed = models.PositiveIntegerField(default=0)
+
+    @property
+    def is_finished(self):
+        return self.status in (self.COMPLETED, self.FAILED)
+
+    def add_skipped_rows(self, skipped_rows, duplicate_rows):
+        self.rows_skipped += len(skipped_rows)
+        self.rows_duplicate += len(duplicate_rows)
+        limit = self.MAX_REPORTED_ROWS
+        self.skipped_rows += skipped_rows[: limit - len(self.skipped_rows)]
+        self.duplicate_rows += duplicate_rows[: limit - len(self.duplicate_rows)]
+
+    def as_dict(self):
+        return {
+            "id": self.pk,
+            "status": self.status,
+            "rows_processed": self.rows_processed,
+            "rows_skipped": self.rows_skipped,
+            "rows_duplicate": self.rows_duplicate,
+            "skipped_rows": self.skipped_rows,
+            "duplicate_rows": self.duplicate_rows,
+            "errors": self.errors,
+            "created": self.created,
+            "finished": self.finished,
+        }
 
     def __str__(self):
-        return f"{self.name} - {self.balance}"
\ No newline at end of file
+        return f"Import #{self.pk} - {self.status}"
@@ -0,0 +1,45 @@
+from datetime import datetime
+
+from django.db.models import Q
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Highest code point, used as the exclusive upper bound of a prefix range.
+_PREFIX_UPPER_BOUND = "\U0010ffff"
+
+
+def get_page_size(request, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    try:
+        page_size = int(request.GET.get("page_size", default))
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(page_size, maximum))
+
+
+def get_int_param(request, name):
+    try:
+        return int(request.GET[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def prefix_q(field, prefix):
+    # A range predicate instead of LIKE 'prefix%' so the lookup can use a
+    # plain B-tree index on any backend.
+    return Q(
+        **{f"{field}__gte": prefix, f"{field}__lt": prefix + _PREFIX_UPPER_BOUND}
+    )
+
+
+def encode_cursor(created, pk):
+    return f"{created.isoformat()}|{pk}"
+
+
+def decode_cursor(value):
+    try:
+        created, pk = value.rsplit("|", 1)
+        return datetime.fromisoformat(created), int(pk)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
@@ -0,0 +1,34 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache import invalidate_accounts
+from .models import Account
+
+
+@receiver(pre_save, sender=Account)
+def remember_stored_ref(sender, instance, raw=False, update_fields=None, **kwargs):
+    # A changed ref leaves the lookup cached under the old one behind.
+    instance._stored_ref = None
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and "ref" not in update_fields:
+        return
+    instance._stored_ref = (
+        Account.objects.filter(pk=instance.pk).values_list("ref", flat=True).first()
+    )
+
+
+# Single-row saves (admin, shell, fixtures) go through these receivers. Bulk
+# writes do not send signals and invalidate explicitly instead.
+@receiver(post_save, sender=Account)
+def invalidate_saved_account(sender, instance, created, **kwargs):
+    accounts = [instance]
+    stored_ref = getattr(instance, "_stored_ref", None)
+    if stored_ref is not None and stored_ref != instance.ref:
+        accounts.append(Account(pk=instance.pk, ref=stored_ref))
+    invalidate_accounts(accounts, created=created)
+
+
+@receiver(post_delete, sender=Account)
+def invalidate_deleted_account(sender, instance, **kwargs):
+    invalidate_accounts([instance], created=True)
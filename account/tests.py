@@ -1,8 +1,50 @@
-from django.test import TestCase
+import gzip
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import closing
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import Sum
+from django.test import (
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
-from .models import Account
-from transaction.models import Transactions
+from django.utils.html import escape
+from . import bulk_import, csv_import, jobs
+from .cache import (
+    ACCOUNT_VERSION_KEY,
+    account_cache,
+    cache_stats,
+    reset_cache_stats,
+)
+from .models import Account, AccountBalanceShard, ImportJob
+from .csv_import import AccountColumns, drop_duplicates, parse_block, read_blocks
+from .export import export_accounts
+from .pagination import MAX_PAGE_SIZE
+from .jobs import submit_import_job
+from .views import CsvExportView, ImportAccountsView
+from account_transfer.replica import ReplicaStickinessMiddleware
+from transaction.ledger import balance_at
+from transaction.models import LedgerEntry, Transactions
 
 
 class AccountListViewTests(TestCase):
@@ -33,6 +75,128 @@ class AccountListViewTests(TestCase):
         )
 
 
+    def test_account_list_view_keyset_pagination(self):
+        account3 = Account.objects.create(ref="3", name="Account 3", balance=300.0)
+        response = self.client.get(reverse("account-list"), {"page_size": 2})
+        self.assertEqual(list(response.context["accounts"]), [account3, self.account2])
+        self.assertIsNone(response.context["previous_url"])
+        self.assertEqual(
+            response.context["next_url"], f"?page_size=2&after={self.account2.id}"
+        )
+
+        response = self.client.get(
+            reverse("account-list"), {"page_size": 2, "after": self.account2.id}
+        )
+        self.assertEqual(list(response.context["accounts"]), [self.account1])
+        self.assertIsNone(response.context["next_url"])
+        self.assertEqual(
+            response.context["previous_url"], f"?page_size=2&before={self.account1.id}"
+        )
+
+        response = self.client.get(
+            reverse("account-list"), {"page_size": 2, "before": self.account1.id}
+        )
+        self.assertEqual(list(response.context["accounts"]), [account3, self.account2])
+        self.assertIsNone(response.context["previous_url"])
+
+    def test_account_list_view_page_size_is_capped(self):
+        response = self.client.get(reverse("account-list"), {"page_size": 100000})
+        self.assertEqual(response.context["page_size"], MAX_PAGE_SIZE)
+
+    def test_account_list_view_loads_only_listed_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("account-list"))
+        sql = queries[0]["sql"]
+        self.assertIn("LIMIT 51", sql)
+        self.assertIn('"account_account"."balance"', sql)
+
+    def test_account_list_view_prefix_search(self):
+        Account.objects.create(ref="abc", name="Zed", balance=1.0)
+        Account.objects.create(ref="xyz", name="Account Search", balance=1.0)
+        response = self.client.get(reverse("account-list"), {"q": "Account S"})
+        self.assertEqual(
+            [account.name for account in response.context["accounts"]],
+            ["Account Search"],
+        )
+        response = self.client.get(reverse("account-list"), {"q": "ab"})
+        self.assertEqual(
+            [account.ref for account in response.context["accounts"]], ["abc"]
+        )
+
+
+class AccountCacheTests(TestCase):
+    def setUp(self):
+        account_cache().clear()
+        reset_cache_stats()
+        self.account1 = Account.objects.create(ref="1", name="Account 1", balance=100.0)
+        self.account2 = Account.objects.create(ref="2", name="Account 2", balance=200.0)
+
+    def test_account_lookup_reads_through_cache(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(Account._get_account_by_ref("1"), self.account1)
+        with self.assertNumQueries(0):
+            self.assertEqual(Account._get_account_by_ref("1"), self.account1)
+        self.assertIsNone(Account._get_account_by_ref("999"))
+        stats = cache_stats()
+        self.assertEqual((stats["account_hits"], stats["account_misses"]), (1, 2))
+
+    def test_saving_account_invalidates_lookup(self):
+        Account._get_account_by_ref("1")
+        self.account1.name = "Renamed"
+        self.account1.save()
+        self.assertEqual(Account._get_account_by_ref("1").name, "Renamed")
+
+    def test_changing_ref_invalidates_lookup_of_old_ref(self):
+        Account._get_account_by_ref("1")
+        self.account1.ref = "11"
+        self.account1.save()
+        self.assertIsNone(Account._get_account_by_ref("1"))
+        self.assertEqual(Account._get_account_by_ref("11"), self.account1)
+
+    def test_list_page_is_served_from_cache(self):
+        self.client.get(reverse("account-list"))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("account-list"))
+        self.assertContains(response, "Account 1")
+        stats = cache_stats()
+        self.assertEqual((stats["list_page_hits"], stats["list_page_misses"]), (1, 1))
+
+    def test_transfer_invalidates_only_affected_pages(self):
+        Account.objects.create(ref="3", name="Account 3", balance=300.0)
+        first_page = {"page_size": 1}
+        last_page = {"page_size": 1, "after": self.account2.id}
+        self.client.get(reverse("account-list"), first_page)
+        self.client.get(reverse("account-list"), last_page)
+
+        Transactions.transfer("1", "10.00", "2")
+
+        with self.assertNumQueries(0):
+            self.client.get(reverse("account-list"), first_page)
+        response = self.client.get(reverse("account-list"), last_page)
+        self.assertContains(response, "<td>90.00</td>")
+
+    def test_page_is_dropped_when_an_account_version_is_evicted(self):
+        self.client.get(reverse("account-list"))
+        account_cache().delete(ACCOUNT_VERSION_KEY.format(self.account1.pk))
+        self.client.get(reverse("account-list"))
+        self.client.get(reverse("account-list"))
+        stats = cache_stats()
+        self.assertEqual((stats["list_page_hits"], stats["list_page_misses"]), (1, 2))
+
+    def test_import_creating_accounts_invalidates_pages(self):
+        self.client.get(reverse("account-list"))
+        csv_file = SimpleUploadedFile("new.csv", b"ID,Name,Balance\n3,New,5.0")
+        with override_settings(ACCOUNT_IMPORT_WORKERS=0):
+            self.client.post(reverse("import-accounts"), {"data_file": csv_file})
+        response = self.client.get(reverse("account-list"))
+        self.assertContains(response, "New")
+
+    def test_cache_stats_endpoint(self):
+        Account._get_account_by_ref("1")
+        response = self.client.get(reverse("api-cache-stats"))
+        self.assertEqual(response.json()["account_misses"], 1)
+
+
 class AccountDetailsViewTests(TestCase):
     def setUp(self):
         self.account = Account.objects.create(ref="1", name="Account 1", balance=100.0)
@@ -72,7 +236,255 @@ class AccountDetailsViewTests(TestCase):
             ordered=True,
         )
 
+    def test_account_details_view_history_query_count(self):
+        for _ in range(10):
+            Transactions.objects.create(
+                sender=self.account, recipient=self.other_account, amount=1.0
+            )
+        # Account lookup plus one UNION query for the page of history.
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                reverse("account-details", args=[self.account.pk])
+            )
+        self.assertEqual(len(response.context["transactions"]), 12)
+
+    def test_account_details_view_cursor_pagination(self):
+        url = reverse("account-details", args=[self.account.pk])
+        response = self.client.get(url, {"page_size": 1})
+        self.assertEqual(response.context["transactions"], [self.transaction2])
+        self.assertTrue(response.context["is_first_page"])
+
+        response = self.client.get(url + response.context["next_url"])
+        self.assertEqual(response.context["transactions"], [self.transaction1])
+        self.assertIsNone(response.context["next_url"])
+        self.assertFalse(response.context["is_first_page"])
 
+    def test_account_details_view_cursor_breaks_created_ties(self):
+        tied = Transactions.objects.create(
+            sender=self.account,
+            recipient=self.other_account,
+            amount=5.0,
+            created=self.transaction2.created,
+        )
+        url = reverse("account-details", args=[self.account.pk])
+        response = self.client.get(url, {"page_size": 1})
+        self.assertEqual(response.context["transactions"], [tied])
+        response = self.client.get(url + response.context["next_url"])
+        self.assertEqual(response.context["transactions"], [self.transaction2])
+
+
+class AsyncAccountViewTests(TestCase):
+    def setUp(self):
+        self.account = Account.objects.create(ref="1", name="Account 1", balance=100.0)
+        self.other_account = Account.objects.create(
+            ref="2", name="Account 2", balance=200.0
+        )
+        self.transaction = Transactions.objects.create(
+            sender=self.account, recipient=self.other_account, amount=50.0
+        )
+
+    async def test_async_account_list_view(self):
+        response = await self.async_client.get(
+            reverse("account-list-async"), {"page_size": 1}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [account.ref for account in response.context["accounts"]], ["2"]
+        )
+        self.assertEqual(
+            response.context["next_url"], f"?page_size=1&after={self.other_account.id}"
+        )
+
+    async def test_async_account_details_view(self):
+        response = await self.async_client.get(
+            reverse("account-details-async", args=[self.account.pk])
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["account"], self.account)
+        self.assertEqual(response.context["transactions"], [self.transaction])
+
+    async def test_async_account_details_view_not_found(self):
+        response = await self.async_client.get(
+            reverse("account-details-async", args=[999])
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(ACCOUNT_IMPORT_WORKERS=0)
+class AccountExportTests(TestCase):
+    def setUp(self):
+        self.alice = Account.objects.create(ref="1", name="Alice, Jr.", balance=100)
+        self.shop = Account.objects.create(ref="2", name="Shop", balance=0, is_hot=True)
+        AccountBalanceShard.create_for(self.shop.pk)
+        self.first = Transactions.transfer_between(self.alice, self.shop, Decimal("40.00"))
+        self.second = Transactions.transfer_between(self.alice, self.shop, Decimal("10.50"))
+
+    def read(self, response):
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def test_account_export_round_trips_through_import(self):
+        exported = self.read(self.client.get(reverse("account-export")))
+        self.assertEqual(
+            exported.decode(),
+            'ID,Name,Balance\n1,"Alice, Jr.",49.50\n2,Shop,50.50\n',
+        )
+        Account.objects.filter(pk=self.alice.pk).update(balance=0, name="Changed")
+        self.client.post(
+            reverse("import-accounts"),
+            {"data_file": SimpleUploadedFile("accounts.csv", exported)},
+        )
+        self.alice.refresh_from_db()
+        self.shop.refresh_from_db()
+        self.assertEqual(self.alice.name, "Alice, Jr.")
+        self.assertEqual(self.alice.balance, Decimal("49.50"))
+        self.assertEqual(self.shop.available_balance(), Decimal("50.50"))
+
+    def test_account_export_can_be_gzipped(self):
+        plain = self.read(self.client.get(reverse("account-export")))
+        response = self.client.get(reverse("account-export"), {"gzip": "1"})
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        self.assertIn("accounts.csv.gz", response["Content-Disposition"])
+        self.assertEqual(gzip.decompress(self.read(response)), plain)
+
+    def test_export_streams_in_chunks(self):
+        chunks = list(export_accounts(chunk_size=1))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(chunks[0], 'ID,Name,Balance\n1,"Alice, Jr.",49.50\n')
+
+    def test_export_view_takes_its_chunks_from_export_function(self):
+        request = RequestFactory().get("/export/")
+        view = CsvExportView.as_view(export_function=lambda: iter(["a\n", "b\n"]))
+        self.assertEqual(self.read(view(request)), b"a\nb\n")
+        with self.assertRaisesMessage(ImproperlyConfigured, "export_function"):
+            CsvExportView.as_view()(request)
+
+    def test_transactions_export_is_oldest_first(self):
+        url = reverse("account-transactions-export", args=[self.alice.pk])
+        lines = self.read(self.client.get(url)).decode().splitlines()
+        self.assertEqual(lines[0], "ID,Created,Sender,Recipient,Amount")
+        self.assertEqual(
+            [line.split(",")[0::2] for line in lines[1:]],
+            [[str(self.first.id), "1", "40.00"], [str(self.second.id), "1", "10.50"]],
+        )
+        missing = reverse("account-transactions-export", args=[999])
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+    def test_export_command_writes_gzipped_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "transactions.csv.gz")
+            call_command("export_csv", "transactions", "--account", "2", "--gzip", "-o", path)
+            with gzip.open(path, "rt") as exported:
+                self.assertEqual(len(exported.read().splitlines()), 3)
+        with self.assertRaises(CommandError):
+            call_command("export_csv", "transactions")
+
+
+@override_settings(DATABASE_REPLICA_ALIAS="replica")
+class ReplicaRoutingTests(TransactionTestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        account_cache().clear()
+        self.account = Account.objects.create(ref="1", name="Account 1", balance=100.0)
+        Account.objects.create(ref="2", name="Account 2", balance=200.0)
+
+    def capture_reads(self, *urls, **extra):
+        with CaptureQueriesContext(connections["default"]) as primary:
+            with CaptureQueriesContext(connections["replica"]) as replica:
+                for url in urls:
+                    self.assertEqual(self.client.get(url, **extra).status_code, 200)
+        return len(primary), len(replica)
+
+    def test_account_pages_read_from_replica(self):
+        primary, replica = self.capture_reads(
+            reverse("account-list"),
+            reverse("account-details", args=[self.account.pk]),
+            reverse("api-account-transactions", args=[self.account.pk]),
+        )
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+
+    def test_transfer_pins_reads_to_primary(self):
+        response = self.client.post(
+            reverse("balance-transaction"),
+            {"sender": "1", "recipient": "2", "amount": "10.00"},
+        )
+        self.assertIn(settings.DATABASE_REPLICA_PIN_COOKIE, response.cookies)
+        primary, replica = self.capture_reads(
+            reverse("account-details", args=[self.account.pk])
+        )
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    def test_reads_stay_on_primary_without_a_replica(self):
+        with override_settings(DATABASE_REPLICA_ALIAS=None):
+            primary, replica = self.capture_reads(reverse("account-list"))
+        self.assertGreater(primary, 0)
+        self.assertEqual(replica, 0)
+
+    async def test_async_transfer_pins_reads_to_primary(self):
+        async def get_response(request):
+            pass
+
+        self.assertTrue(iscoroutinefunction(ReplicaStickinessMiddleware(get_response)))
+        response = await self.async_client.post(
+            reverse("balance-transaction-async"),
+            {"sender": "1", "recipient": "2", "amount": "10.00"},
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(settings.DATABASE_REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_pages_read_from_replica_are_cached_briefly(self):
+        with mock.patch.object(
+            LocMemCache, "set", autospec=True, side_effect=LocMemCache.set
+        ) as cache_set:
+            self.capture_reads(reverse("account-list"))
+            self.client.cookies[settings.DATABASE_REPLICA_PIN_COOKIE] = "1"
+            self.capture_reads(reverse("account-list") + "?page_size=1")
+        timeouts = [
+            call.kwargs["timeout"]
+            for call in cache_set.call_args_list
+            if call.args[1].startswith("account-list:page:")
+        ]
+        self.assertEqual(
+            timeouts, [settings.DATABASE_REPLICA_STICKY_SECONDS, DEFAULT_TIMEOUT]
+        )
+
+    def test_pinned_requests_skip_pages_rendered_from_the_replica(self):
+        self.capture_reads(reverse("account-list"))
+        reset_cache_stats()
+        self.client.cookies[settings.DATABASE_REPLICA_PIN_COOKIE] = "1"
+        self.capture_reads(reverse("account-list"), reverse("account-list"))
+        stats = cache_stats()
+        self.assertEqual((stats["list_page_misses"], stats["list_page_hits"]), (1, 1))
+
+        del self.client.cookies[settings.DATABASE_REPLICA_PIN_COOKIE]
+        reset_cache_stats()
+        self.capture_reads(reverse("account-list"))
+        self.assertEqual(cache_stats()["list_page_hits"], 1)
+
+    def test_sync_replica_copies_the_primary(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "replica.sqlite3")
+            with mock.patch.dict(settings.DATABASES["replica"], NAME=path):
+                call_command("sync_replica", stdout=io.StringIO())
+            with closing(sqlite3.connect(path)) as replica:
+                refs = replica.execute(
+                    "SELECT ref FROM account_account ORDER BY ref"
+                ).fetchall()
+        self.assertEqual(refs, [("1",), ("2",)])
+
+        name = connections["default"].settings_dict["NAME"]
+        with mock.patch.dict(settings.DATABASES["replica"], NAME=name):
+            with self.assertRaisesMessage(CommandError, "same file"):
+                call_command("sync_replica", stdout=io.StringIO())
+        with override_settings(DATABASE_REPLICA_ALIAS=None):
+            with self.assertRaisesMessage(CommandError, "No replica"):
+                call_command("sync_replica", stdout=io.StringIO())
+
+
+@override_settings(ACCOUNT_IMPORT_WORKERS=0)
 class ImportAccountsViewTests(TestCase):
     def setUp(self):
         self.url = reverse("import-accounts")
@@ -92,6 +504,19 @@ class ImportAccountsViewTests(TestCase):
         self.assertRedirects(response, self.url)
         self.assertEqual(Account.objects.count(), 2)
 
+    def test_import_posts_ledger_entries_for_balance_changes(self):
+        Account.objects.create(ref="1", name="John", balance=100)
+        csv_file = SimpleUploadedFile(
+            "valid.csv", b"ID,Name,Balance\n1,John,250.5\n2,Jane,200.0"
+        )
+        self.client.post(self.url, {"data_file": csv_file})
+        entries = LedgerEntry.objects.filter(kind=LedgerEntry.IMPORT)
+        self.assertEqual(
+            sorted(entries.exclude(account=None).values_list("account__ref", "amount")),
+            [("1", Decimal("150.50")), ("2", Decimal("200.00"))],
+        )
+        self.assertEqual(entries.aggregate(total=Sum("amount"))["total"], 0)
+
     def test_import_header_only_csv(self):
         header_only_csv = SimpleUploadedFile("header_only.csv", b"ID,Name,Balance\n")
         response = self.client.post(self.url, {"data_file": header_only_csv})
@@ -187,3 +612,370 @@ class ImportAccountsViewTests(TestCase):
             response, "Some rows were skipped due to missing fields: 1."
         )
         self.assertEqual(Account.objects.count(), 1)
+
+    def test_import_processes_file_in_chunks(self):
+        Account.objects.create(ref="2", name="Old Name", balance=10.0)
+        chunked_csv = SimpleUploadedFile(
+            "chunked.csv",
+            b"ID,Name,Balance\n1,John,100.0\n2,Jane,200.0\n,Missing,1.0\n3,Jim,300.0",
+        )
+        with mock.patch.object(ImportAccountsView, "chunk_size", 2):
+            response = self.client.post(self.url, {"data_file": chunked_csv})
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(
+            response, "Some rows were skipped due to missing fields: 3."
+        )
+        self.assertEqual(Account.objects.count(), 3)
+        updated = Account.objects.get(ref="2")
+        self.assertEqual(updated.name, "Jane")
+        self.assertEqual(updated.balance, 200)
+
+    def test_import_looks_up_only_chunk_refs(self):
+        Account.objects.create(ref="unrelated", name="Unrelated", balance=1.0)
+        valid_csv = SimpleUploadedFile(
+            "valid.csv", b"ID,Name,Balance\n1,John,100.0\n2,Jane,200.0"
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url, {"data_file": valid_csv})
+        lookups = [q["sql"] for q in queries if q["sql"].startswith("SELECT")]
+        self.assertTrue(lookups)
+        self.assertTrue(all(" IN (" in sql for sql in lookups if "account_account" in sql))
+
+    def test_import_upserts_each_chunk_in_one_statement(self):
+        Account.objects.create(ref="2", name="Old Name", balance=10.0)
+        csv_file = SimpleUploadedFile(
+            "valid.csv", b"ID,Name,Balance\n1,John,100.0\n2,Jane,200.0\n3,Jim,300.0"
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(self.url, {"data_file": csv_file})
+        account_writes = ('INSERT INTO "account_account"', 'UPDATE "account_account"')
+        writes = [q["sql"] for q in queries if q["sql"].startswith(account_writes)]
+        self.assertEqual(len(writes), 1)
+        self.assertIn("ON CONFLICT", writes[0])
+        self.assertEqual(
+            list(Account.objects.order_by("ref").values_list("ref", "name", "balance")),
+            [
+                ("1", "John", Decimal("100.00")),
+                ("2", "Jane", Decimal("200.00")),
+                ("3", "Jim", Decimal("300.00")),
+            ],
+        )
+
+    def test_import_folds_pending_shards_of_hot_accounts(self):
+        sender = Account.objects.create(ref="1", name="John", balance=100)
+        merchant = Account.objects.create(ref="2", name="Shop", balance=0, is_hot=True)
+        AccountBalanceShard.create_for(merchant.pk)
+        Transactions.transfer_between(sender, merchant, Decimal("40.00"))
+        csv_file = SimpleUploadedFile("valid.csv", b"ID,Name,Balance\n2,Shop,25.00")
+        self.client.post(self.url, {"data_file": csv_file})
+        merchant.refresh_from_db()
+        self.assertEqual(merchant.available_balance(), Decimal("25.00"))
+        self.assertEqual(balance_at(merchant.pk), Decimal("25.00"))
+
+    def test_import_json_returns_job_id(self):
+        valid_csv = SimpleUploadedFile(
+            "valid.csv", b"ID,Name,Balance\n1,John,100.0\n,Jane,200.0"
+        )
+        response = self.client.post(
+            self.url, {"data_file": valid_csv}, HTTP_ACCEPT="application/json"
+        )
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()["job_id"]
+
+        status = self.client.get(reverse("import-job-status", args=[job_id])).json()
+        self.assertEqual(status["status"], ImportJob.COMPLETED)
+        self.assertEqual(status["rows_processed"], 1)
+        self.assertEqual(status["rows_skipped"], 1)
+        self.assertEqual(status["skipped_rows"], [2])
+
+    def test_import_job_records_errors(self):
+        negative_balance_csv = SimpleUploadedFile(
+            "negative_balance.csv", b"ID,Name,Balance\n1,John,-100.0\n"
+        )
+        job = ImportJob.objects.create(data_file=negative_balance_csv)
+        submit_import_job(job)
+        self.assertEqual(job.status, ImportJob.FAILED)
+        self.assertEqual(job.errors, ["Balance cannot be negative."])
+        self.assertFalse(job.data_file)
+
+    def test_bad_row_after_the_first_chunk_imports_nothing(self):
+        rows = b"".join(b"%d,Name,1.00\n" % i for i in range(1, 8))
+        csv_file = SimpleUploadedFile(
+            "late_error.csv", b"ID,Name,Balance\n" + rows + b"8,Late,abc\n"
+        )
+        with mock.patch.object(ImportAccountsView, "chunk_size", 2):
+            response = self.client.post(self.url, {"data_file": csv_file})
+        self.assertContains(response, escape("Invalid balance 'abc' on row 8."))
+        self.assertFalse(Account.objects.exists())
+
+    def test_failed_save_reports_the_rows_already_saved(self):
+        import_batch = Account.import_batch
+        saves = []
+
+        def fail_on_second_batch(batch, batch_size):
+            saves.append(batch)
+            if len(saves) == 2:
+                raise Exception("Error saving accounts: disk I/O error")
+            import_batch(batch, batch_size)
+
+        csv_file = SimpleUploadedFile(
+            "valid.csv", b"ID,Name,Balance\n1,A,1\n2,B,2\n3,C,3\n4,D,4\n"
+        )
+        with mock.patch.object(ImportAccountsView, "chunk_size", 2):
+            with mock.patch.object(Account, "import_batch", fail_on_second_batch):
+                response = self.client.post(self.url, {"data_file": csv_file})
+        self.assertContains(response, "disk I/O error")
+        self.assertContains(response, "The import stopped after saving 2 rows.")
+        self.assertEqual(Account.objects.count(), 2)
+
+    def test_import_skips_duplicate_refs_across_chunks(self):
+        csv_file = SimpleUploadedFile(
+            "duplicates.csv",
+            b"ID,Name,Balance\n1,John,100.0\n2,Jane,200.0\n1,Johnny,5.0\n2,Janet,6.0",
+        )
+        with mock.patch.object(ImportAccountsView, "chunk_size", 3):
+            response = self.client.post(self.url, {"data_file": csv_file})
+        self.assertContains(
+            response,
+            "Some rows were skipped because their ID appeared earlier in the file: 3, 4.",
+        )
+        self.assertEqual(Account.objects.get(ref="1").name, "John")
+        self.assertEqual(Account.objects.get(ref="2").balance, Decimal("200.00"))
+
+    def test_parse_block_reads_balances_exactly(self):
+        columns = parse_block(
+            1, [["1", "2", "3"], ["John", "Jane", "Jim"], ["12345678901234567.89", " ", "0.1"]]
+        )
+        self.assertEqual(columns.refs, ["1", "3"])
+        self.assertEqual(
+            columns.balances, [Decimal("12345678901234567.89"), Decimal("0.10")]
+        )
+        self.assertEqual(columns.skipped_rows, [2])
+        self.assertEqual(columns.row_numbers, [1, 3])
+
+    @skipUnless(csv_import.pyarrow, "needs pyarrow")
+    def test_arrow_blocks_parse_like_python_blocks(self):
+        def parse(data):
+            try:
+                return [
+                    parse_block(first_row, block)
+                    for first_row, block in read_blocks(io.StringIO(data, newline=""))
+                ]
+            except ValueError as e:
+                return str(e)
+
+        header = "ID,Name,Balance\r\n"
+        for rows in (
+            "1,John,100\r\n2,Jane,0.50\r\n\r\n3,Jim,1e2\r\n",
+            "1,John,100\n2, ,5\n3,Jim,\n",
+            "1,John,100\n2,Jane\n3,Jim,7,extra\n",
+            "1,John,100\n2,Jane, 2.5\n",
+            "1,John,1.230\n2,Jane,1.005\n",
+            "1,John,100\n2,Jane,-1\n",
+            "1,John,12345678901234567890123456789012345678901234567890.01\n",
+        ):
+            with mock.patch.object(csv_import, "pyarrow", None):
+                expected = parse(header + rows)
+            self.assertEqual(parse(header + rows), expected, rows)
+
+        block = next(read_blocks(io.StringIO(header + "1,John,1\r\n", newline="")))[1]
+        self.assertIsInstance(block[0], csv_import.pyarrow.ChunkedArray)
+
+    def test_duplicate_detection_memory_grows_with_distinct_refs_only(self):
+        rows, block_size = 100_000, 25_000
+        seen_refs = set()
+        duplicates = []
+        tracemalloc.start()
+        try:
+            for start in range(0, rows, block_size):
+                refs = [f"acc-{i:07d}" for i in range(start, start + block_size)]
+                if start:
+                    refs[-1] = "acc-0000000"
+                columns = AccountColumns(
+                    list(range(start + 1, start + block_size + 1)),
+                    refs,
+                    [""] * block_size,
+                    [Decimal(0)] * block_size,
+                    [],
+                    [],
+                )
+                duplicates += drop_duplicates(columns, seen_refs).duplicate_rows
+                del refs, columns
+            retained = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(duplicates, [50_000, 75_000, 100_000])
+        self.assertEqual(len(seen_refs), rows - 3)
+        # The refs themselves and their set entries, nothing per block.
+        self.assertLess(retained / len(seen_refs), 128)
+
+    def test_import_rejects_invalid_balances(self):
+        for balance, error in (
+            (b"abc", "Invalid balance 'abc' on row 2."),
+            (b"1.005", "Invalid balance '1.005' on row 2."),
+            (b"NaN", "Invalid balance 'NaN' on row 2."),
+        ):
+            csv_file = SimpleUploadedFile(
+                "invalid.csv", b"ID,Name,Balance\n1,John,1\n2,Jane," + balance
+            )
+            response = self.client.post(self.url, {"data_file": csv_file})
+            self.assertContains(response, escape(error))
+        self.assertFalse(Account.objects.exists())
+
+    def test_import_job_status_not_found(self):
+        response = self.client.get(reverse("import-job-status", args=[999]))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(ACCOUNT_IMPORT_WORKERS=2)
+class ImportJobWorkerTests(TransactionTestCase):
+    def wait_for(self, job_id):
+        url = reverse("import-job-status", args=[job_id])
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            status = self.client.get(url).json()
+            if status["status"] in (ImportJob.COMPLETED, ImportJob.FAILED):
+                return status
+            time.sleep(0.01)
+        self.fail(f"Import #{job_id} did not finish.")
+
+    def test_jobs_run_in_the_worker_pool_once_committed(self):
+        threads = []
+        run_import_job = jobs.run_import_job
+
+        def record_thread(job_id):
+            threads.append(threading.current_thread().name)
+            return run_import_job(job_id)
+
+        with mock.patch.object(jobs, "run_import_job", record_thread):
+            with transaction.atomic():
+                job = ImportJob.objects.create(
+                    data_file=SimpleUploadedFile("a.csv", b"ID,Name,Balance\n1,A,5\n")
+                )
+                submit_import_job(job)
+                self.assertEqual(threads, [])
+            self.assertEqual(self.wait_for(job.pk)["rows_processed"], 1)
+
+            response = self.client.post(
+                reverse("import-accounts"),
+                {"data_file": SimpleUploadedFile("b.csv", b"ID,Name,Balance\n2,B,-1\n")},
+                HTTP_ACCEPT="application/json",
+            )
+            status = self.wait_for(response.json()["job_id"])
+        self.assertEqual(status["errors"], ["Balance cannot be negative."])
+        self.assertEqual(len(threads), 2)
+        self.assertTrue(all(name.startswith("account-import") for name in threads))
+        self.assertEqual(Account.objects.get().ref, "1")
+        # The uploads went to the test MEDIA_ROOT and were removed after use.
+        self.assertFalse(settings.MEDIA_ROOT.startswith(str(settings.BASE_DIR)))
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, "imports")), [])
+
+
+@override_settings(ACCOUNT_IMPORT_WORKERS=0)
+class ImportAccountsCommandTests(TestCase):
+    # Row 4 has no name and row 9 repeats ref 2. With 32-byte parts the
+    # file is split into about two rows per part.
+    rows = [f"{i},Name {i},{i}.50" for i in range(1, 13)]
+    rows[3] = "4,,4.50"
+    rows[8] = "2,Again,9.50"
+    content = ("ID,Name,Balance\n" + "\n".join(rows) + "\n").encode()
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "accounts.csv")
+
+    def run_import(self, content, *args):
+        with open(self.path, "wb") as data_file:
+            data_file.write(content)
+        call_command(
+            "import_accounts", self.path, "--part-size", "32", *args, stdout=io.StringIO()
+        )
+        return ImportJob.objects.latest("pk")
+
+    def web_import(self, content):
+        csv_file = SimpleUploadedFile("accounts.csv", content)
+        job = ImportJob()
+        imported_rows = ImportAccountsView()._import_csv_file(csv_file, job)
+        return imported_rows, job.skipped_rows, job.duplicate_rows
+
+    def accounts(self):
+        return sorted(Account.objects.values_list("ref", "name", "balance"))
+
+    def test_command_imports_like_the_web_path(self):
+        job = self.run_import(self.content, "--workers", "2")
+        self.assertEqual(job.status, ImportJob.COMPLETED)
+        self.assertGreater(job.parts_committed, 3)
+        self.assertEqual(
+            (job.rows_processed, job.skipped_rows, job.duplicate_rows), (10, [4], [9])
+        )
+        imported = self.accounts()
+        self.assertEqual(self.web_import(self.content), (10, [4], [9]))
+        self.assertEqual(self.accounts(), imported)
+        self.assertIn(("2", "Name 2", Decimal("2.50")), imported)
+
+    def test_reported_rows_are_capped_but_all_counted(self):
+        content = b"ID,Name,Balance\n" + b"1,Same,1.00\n" * 40 + b"2,,1.00\n" * 3
+        with mock.patch.object(ImportJob, "MAX_REPORTED_ROWS", 2):
+            job = self.run_import(content)
+            self.assertEqual((job.rows_duplicate, job.duplicate_rows), (39, [2, 3]))
+            self.assertEqual((job.rows_skipped, job.skipped_rows), (3, [41, 42]))
+            self.assertEqual(self.web_import(content), (1, [41, 42], [2, 3]))
+
+            response = self.client.post(
+                reverse("import-accounts"),
+                {"data_file": SimpleUploadedFile("accounts.csv", content)},
+            )
+        self.assertContains(response, "appeared earlier in the file: 2, 3 and 37 more.")
+
+    def test_command_reports_the_web_import_errors(self):
+        files = [
+            b"Name,Balance\nJohn,1\n",
+            b"ID,Name,Balance\n\n",
+            self.content + b"13,Late,abc\n",
+            b'ID,Name,Balance\n1,"Doe, John",-5\n',
+        ]
+        for content in files:
+            with self.subTest(content=content):
+                with self.assertRaises(Exception) as web_error:
+                    self.web_import(content)
+                with self.assertRaises(CommandError) as command_error:
+                    self.run_import(content, "--workers", "2")
+                self.assertTrue(
+                    str(command_error.exception).startswith(str(web_error.exception))
+                )
+        errors = [job.errors for job in ImportJob.objects.order_by("pk")]
+        self.assertEqual(errors[2], ["Invalid balance 'abc' on row 13."])
+
+    def test_quoted_files_are_read_sequentially(self):
+        content = b'ID,Name,Balance\n1,"Doe,\nJohn",5\n2,Jane,6\n'
+        job = self.run_import(content, "--workers", "2")
+        self.assertEqual(job.status, ImportJob.COMPLETED)
+        self.assertEqual(Account.objects.get(ref="1").name, "Doe,\nJohn")
+
+    def test_resume_continues_after_the_last_committed_part(self):
+        save_part = bulk_import._save_part
+
+        def fail_on_fourth_part(job, index, *args):
+            if index == 3:
+                raise OperationalError("disk I/O error")
+            return save_part(job, index, *args)
+
+        with mock.patch.object(bulk_import, "_save_part", fail_on_fourth_part):
+            with self.assertRaisesMessage(CommandError, "disk I/O error"):
+                self.run_import(self.content)
+        job = ImportJob.objects.latest("pk")
+        self.assertEqual((job.status, job.parts_committed), (ImportJob.FAILED, 3))
+        saved_rows = job.rows_processed
+
+        with mock.patch.object(bulk_import, "_save_part", wraps=save_part) as saved:
+            job = self.run_import(self.content, "--resume", str(job.pk))
+        self.assertEqual(saved.call_args_list[0].args[1], 3)
+        self.assertEqual(job.status, ImportJob.COMPLETED)
+        self.assertLess(saved_rows, job.rows_processed)
+        self.assertEqual(
+            (job.rows_processed, job.skipped_rows, job.duplicate_rows), (10, [4], [9])
+        )
+        self.assertEqual(Account.objects.get(ref="2").name, "Name 2")
+        with self.assertRaisesMessage(CommandError, "already completed"):
+            self.run_import(self.content, "--resume", str(job.pk))
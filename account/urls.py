@@ -4,7 +4,12 @@ from .views import *
 urlpatterns = [
     path("", AccountListView.as_view(),name="account-list"),
     path("account-details/<int:pk>", AccountDetailsView.as_view(),name="account-details"),
-    path("import-accounts/",ImportAccountsView.as_view(),name='import-accounts')
+    path("async/", AsyncAccountListView.as_view(),name="account-list-async"),
+    path("async/account-details/<int:pk>", AsyncAccountDetailsView.as_view(),name="account-details-async"),
+    path("import-accounts/",ImportAccountsView.as_view(),name='import-accounts'),
+    path("import-jobs/<int:pk>",ImportJobStatusView.as_view(),name='import-job-status'),
+    path("export-accounts/",AccountExportView.as_view(),name='account-export'),
+    path("account-details/<int:pk>/export-transactions/",AccountTransactionsExportView.as_view(),name='account-transactions-export'),
     ]
 
 
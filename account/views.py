@@ -1,62 +1,228 @@
-from django.shortcuts import render, redirect
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render, redirect
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils.safestring import mark_safe
 from django.views import View
 from django.views.generic.list import ListView
 from django.views.generic.detail import DetailView
-from django.db.models import Q
 import csv
+import io
+from urllib.parse import urlencode
 from django.contrib import messages
-from django.core.exceptions import ValidationError
-from django.db import transaction
-from .models import Account
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from .csv_import import (
+    REQUIRED_FIELDS,
+    drop_duplicates,
+    parse_block,
+    read_blocks,
+    split_columns,
+)
+from .export import export_accounts, export_transactions, gzip_chunks
+from .cache import get_list_page, set_list_page
+from .models import Account, ImportJob
 from .forms import UploadDataFileForm
-from transaction.models import Transactions
-
-
-class AccountListView(ListView):
+from .jobs import submit_import_job
+from .pagination import (
+    decode_cursor,
+    encode_cursor,
+    get_int_param,
+    get_page_size,
+    prefix_q,
+)
+from account_transfer.replica import ReplicaReadMixin
+from transaction.archive import ahistory_page, history_page
+
+
+class AccountListView(ReplicaReadMixin, ListView):
     model = Account
     context_object_name = "accounts"
     template_name = "account/account_list.html"
+    fragment_template_name = "account/account_list_page.html"
+    list_fields = (
+        "id",
+        "ref",
+        "name",
+        "balance",
+        "ledger_summary__transaction_count",
+        "ledger_summary__last_activity",
+    )
 
     def get_queryset(self, *args, **kwargs):
-        qs = super().get_queryset(*args, **kwargs)
+        qs = (
+            super()
+            .get_queryset(*args, **kwargs)
+            .select_related("ledger_summary")
+            .only(*self.list_fields)
+            .with_current_balance()
+        )
+        self.search = self.request.GET.get("q", "").strip()
+        self.after = get_int_param(self.request, "after")
+        self.before = get_int_param(self.request, "before")
+
+        if self.search:
+            qs = qs.filter(prefix_q("ref", self.search) | prefix_q("name", self.search))
+        # Keyset pagination on id: every page is an index range scan, so deep
+        # pages cost the same as the first one.
+        if self.before is not None:
+            return qs.filter(id__gt=self.before).order_by("id")
+        if self.after is not None:
+            qs = qs.filter(id__lt=self.after)
         return qs.order_by("-id")
 
+    def get(self, request, *args, **kwargs):
+        return self.render_cached_page() or super().get(request, *args, **kwargs)
+
+    def render_cached_page(self):
+        page = get_list_page(self._cache_params())
+        if page is None:
+            return None
+        return render(
+            self.request,
+            self.template_name,
+            {
+                "accounts_html": mark_safe(page),
+                "search": self.request.GET.get("q", "").strip(),
+                "page_size": get_page_size(self.request),
+            }
+        )
+
+    def _cache_params(self):
+        params = {
+            name: self.request.GET.get(name, "").strip()
+            for name in ("q", "after", "before")
+        }
+        params["page_size"] = get_page_size(self.request)
+        return urlencode(sorted(params.items()))
+
+    def get_context_data(self, *args, page_rows=None, **kwargs):
+        page_size = get_page_size(self.request)
+        if page_rows is None:
+            page_rows = list(self.object_list[: page_size + 1])
+        accounts = page_rows
+        has_more = len(accounts) > page_size
+        accounts = accounts[:page_size]
+
+        if self.before is not None:
+            accounts.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, self.after is not None
+
+        context = super().get_context_data(*args, object_list=accounts, **kwargs)
+        context.update(
+            {
+                "search": self.search,
+                "page_size": page_size,
+                "next_url": self._page_url(after=accounts[-1].id)
+                if has_next and accounts
+                else None,
+                "previous_url": self._page_url(before=accounts[0].id)
+                if has_previous and accounts
+                else None,
+            }
+        )
+        context["accounts_html"] = render_to_string(self.fragment_template_name, context)
+        set_list_page(
+            self._cache_params(),
+            context["accounts_html"],
+            [account.id for account in accounts],
+        )
+        return context
 
-class AccountDetailsView(DetailView):
+    def _page_url(self, **cursor):
+        params = {"page_size": get_page_size(self.request), **cursor}
+        if self.search:
+            params["q"] = self.search
+        return f"?{urlencode(params)}"
+
+
+class AccountDetailsView(ReplicaReadMixin, DetailView):
     model = Account
     context_object_name = "account"
     template_name = "account/account_details.html"
 
-    def get_context_data(self, *args, **kwargs):
+    def get_queryset(self):
+        return (
+            super()
+            .get_queryset()
+            .select_related("ledger_summary", "archive_summary")
+            .with_current_balance()
+        )
+
+    def get_history_args(self):
+        # Accounts without archived transactions never query the archive.
+        page_size = get_page_size(self.request)
+        cursor = decode_cursor(self.request.GET.get("cursor"))
+        archived = hasattr(self.object, "archive_summary")
+        return self.object, cursor, page_size + 1, None, archived
+
+    def get_history(self):
+        return history_page(*self.get_history_args())
+
+    def get_context_data(self, *args, history_rows=None, **kwargs):
         context = super().get_context_data(*args, **kwargs)
-        account = self.get_object()
+        page_size = get_page_size(self.request)
+        cursor = decode_cursor(self.request.GET.get("cursor"))
 
-        transactions = Transactions.objects.filter(
-            Q(sender=account) | Q(recipient=account)
-        ).order_by("-id")
-        context["transactions"] = transactions
+        if history_rows is None:
+            history_rows = list(self.get_history())
+        transactions = history_rows
 
+        has_next = len(transactions) > page_size
+        transactions = transactions[:page_size]
+        context["transactions"] = transactions
+        context["page_size"] = page_size
+        context["is_first_page"] = cursor is None
+        context["next_url"] = (
+            "?"
+            + urlencode(
+                {
+                    "page_size": page_size,
+                    "cursor": encode_cursor(
+                        transactions[-1].created, transactions[-1].pk
+                    ),
+                }
+            )
+            if has_next
+            else None
+        )
         return context
 
 
-class AccountDetailsView(DetailView):
-    model = Account
-    context_object_name = "account"
-    template_name = "account/account_details.html"
+# Native async variants for ASGI deployments. They share the queryset and
+# context building of the sync views and read through the async ORM, so a
+# request never hops to a worker thread for its queries.
+class AsyncAccountListView(AccountListView):
 
-    def get_context_data(self, *args, **kwargs):
-        context = super().get_context_data(*args, **kwargs)
-        account = self.get_object()
-        transactions = Transactions.objects.filter(
-            Q(sender=account) | Q(recipient=account)
-        ).order_by("-id")
-        context["transactions"] = transactions
-        return context
+    async def get(self, request, *args, **kwargs):
+        cached = self.render_cached_page()
+        if cached:
+            return cached
+        self.object_list = self.get_queryset()
+        page_size = get_page_size(request)
+        page_rows = [account async for account in self.object_list[: page_size + 1]]
+        return self.render_to_response(self.get_context_data(page_rows=page_rows))
+
+
+class AsyncAccountDetailsView(AccountDetailsView):
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            self.object = await self.get_queryset().aget(pk=self.kwargs["pk"])
+        except Account.DoesNotExist:
+            raise Http404("No account found matching the query")
+        history_rows = await ahistory_page(*self.get_history_args())
+        return self.render_to_response(
+            self.get_context_data(object=self.object, history_rows=history_rows)
+        )
 
 
 class ImportAccountsView(View):
     form_class = UploadDataFileForm
     template_name = "account/import_accounts.html"
+    required_fields = REQUIRED_FIELDS
+    chunk_size = 500
 
     def get(self, request, *args, **kwargs):
         form = self.form_class()
@@ -72,30 +238,23 @@ class ImportAccountsView(View):
                     request, form, "Uploaded file is not a CSV file."
                 )
 
-            try:
-                accounts_to_create, accounts_to_update, skipped_rows = (
-                    self._process_csv_file(csv_file)
+            job = ImportJob.objects.create(data_file=csv_file)
+            submit_import_job(job)
+
+            if self._wants_json(request):
+                return JsonResponse(
+                    {
+                        "job_id": job.pk,
+                        "status": job.status,
+                        "status_url": reverse("import-job-status", args=[job.pk]),
+                    },
+                    status=202,
                 )
+            if job.is_finished:
+                return self._render_job_result(request, form, job)
 
-                if accounts_to_create or accounts_to_update:
-                    self._save_accounts(accounts_to_create, accounts_to_update)
-                    messages.success(request, "Accounts imported successfully.")
-                if skipped_rows:
-                    messages.warning(
-                        request,
-                        f"Some rows were skipped due to missing fields: {', '.join(map(str, skipped_rows))}.",
-                    )
-                    return render(request, self.template_name, {"form": form})
-    
-                return redirect("import-accounts")
-
-            except ValidationError as e:
-                error_message = (
-                    " ".join(e.messages) if hasattr(e, "messages") else str(e)
-                )
-                messages.error(request, error_message)
-            except Exception as e:
-                messages.error(request, f"{e}")
+            messages.info(request, "Import started.")
+            return render(request, self.template_name, {"form": form, "job": job})
 
         for field, errors in form.errors.items():
             for error in errors:
@@ -103,80 +262,84 @@ class ImportAccountsView(View):
 
         return render(request, self.template_name, {"form": form})
 
-    def _process_csv_file(self, csv_file):
-        accounts_to_create = []
-        accounts_to_update = []
-        skipped_rows = []
+    def _render_job_result(self, request, form, job):
+        if job.status == ImportJob.FAILED:
+            for error in job.errors:
+                messages.error(request, error)
+            return render(request, self.template_name, {"form": form})
+
+        if job.rows_processed:
+            messages.success(request, "Accounts imported successfully.")
+        if job.skipped_rows:
+            messages.warning(
+                request,
+                f"Some rows were skipped due to missing fields: {self._row_list(job.skipped_rows, job.rows_skipped)}.",
+            )
+        if job.duplicate_rows:
+            messages.warning(
+                request,
+                f"Some rows were skipped because their ID appeared earlier in the file: {self._row_list(job.duplicate_rows, job.rows_duplicate)}.",
+            )
+        if job.skipped_rows or job.duplicate_rows:
+            return render(request, self.template_name, {"form": form})
+
+        return redirect("import-accounts")
+
+    def _row_list(self, rows, count):
+        listed = ", ".join(map(str, rows))
+        if count > len(rows):
+            listed += f" and {count - len(rows)} more"
+        return listed
+
+    def _wants_json(self, request):
+        return "application/json" in request.headers.get("Accept", "")
+
+    def _import_csv_file(self, csv_file, job, on_progress=None):
+        # Each batch commits on its own, so the whole file is parsed once
+        # before anything is saved: a bad row anywhere fails the import with
+        # nothing written. Only a failure while saving can leave it partly
+        # applied, and the error then says so. Skipped and duplicate rows
+        # are counted on the unsaved job, which keeps only the first few.
+        for batch in self._process_csv_file(csv_file):
+            pass
+        imported_rows = 0
+        try:
+            for batch in self._process_csv_file(csv_file):
+                if batch.refs:
+                    Account.import_batch(batch, self.chunk_size)
+                    imported_rows += len(batch.refs)
+                job.add_skipped_rows(batch.skipped_rows, batch.duplicate_rows)
+                if on_progress:
+                    on_progress(imported_rows)
+        except Exception as e:
+            if not imported_rows:
+                raise
+            raise Exception(
+                f"{e} The import stopped after saving {imported_rows} rows. "
+                "Upload the file again to finish it; rows already saved are "
+                "updated in place, not added twice."
+            )
+        return imported_rows
 
+    def _process_csv_file(self, csv_file):
+        # Yields AccountColumns batches of at most chunk_size rows so memory
+        # stays flat regardless of the file size. Parsing works column by
+        # column; see csv_import.py.
+        csv_file.seek(0)
+        decoded_file = io.TextIOWrapper(csv_file.file, encoding="utf-8", newline="")
+        seen_refs = set()
         try:
-            decoded_file = csv_file.read().decode("utf-8").splitlines()
-            reader = csv.DictReader(decoded_file)
-            required_fields = ["ID", "Name", "Balance"]
-            existing_accounts = {
-                account.ref: account for account in Account.objects.all()
-            }
-            headers = reader.fieldnames
-            if not headers:
-                raise ValidationError("The CSV file does not contain any headers.")
-            missing_headers = [
-                field for field in required_fields if field not in headers
-            ]
-            if missing_headers:
-                raise ValidationError(
-                    f"Missing required headers in CSV: {', '.join(missing_headers)}"
-                )
-            rows = list(reader)
-            if not rows:
-                raise ValidationError(
-                    "The CSV file contains only headers and no data rows."
-                )
+            for first_row, block in read_blocks(decoded_file, self.required_fields):
+                columns = drop_duplicates(parse_block(first_row, block), seen_refs)
+                yield from split_columns(columns, self.chunk_size)
 
-            for index, row in enumerate(rows):
-                if not all(
-                    field in row and row[field].strip() for field in required_fields
-                ):
-                    skipped_rows.append(index + 1)  # Row numbers are 1-based
-                    continue
-
-                account_ref = row["ID"]
-                name = row["Name"]
-                balance = self._parse_balance(row["Balance"])
-
-                if account_ref in existing_accounts:
-                    account = existing_accounts[account_ref]
-                    account.name = name
-                    account.balance = balance
-                    accounts_to_update.append(account)
-                else:
-                    accounts_to_create.append(
-                        Account(ref=account_ref, name=name, balance=balance)
-                    )
-
-        except csv.Error as e:
+        except (csv.Error, UnicodeDecodeError) as e:
             raise Exception(f"Error reading CSV file: {e}")
         except ValidationError as e:
             raise Exception(f"{e.message}")
-
-        return accounts_to_create, accounts_to_update, skipped_rows
-
-    def _parse_balance(self, balance_str):
-        try:
-            balance = float(balance_str)
-            if balance < 0:
-                raise ValueError("Balance cannot be negative.")
-            return balance
-        except ValueError as e:
-            raise ValueError(f"{e}")
-
-    def _save_accounts(self, accounts_to_create, accounts_to_update):
-        try:
-            with transaction.atomic():
-                Account.objects.bulk_create(accounts_to_create, batch_size=500)
-                Account.objects.bulk_update(
-                    accounts_to_update, ["name", "balance"], batch_size=500
-                )
-        except Exception as e:
-            raise Exception(f"Error saving accounts: {e}")
+        finally:
+            # Leave the uploaded file open for Django to clean up.
+            decoded_file.detach()
 
     def _is_file_csv(self, file):
         return file.name.endswith(".csv")
@@ -184,3 +347,52 @@ class ImportAccountsView(View):
     def _render_form_with_errors(self, request, form, error_message):
         messages.error(request, error_message)
         return render(request, self.template_name, {"form": form})
+
+
+class ImportJobStatusView(View):
+
+    def get(self, request, pk):
+        job = get_object_or_404(ImportJob, pk=pk)
+        return JsonResponse(job.as_dict())
+
+
+class CsvExportView(ReplicaReadMixin, View):
+    # Streams CSV built by a generator, so memory use does not grow with the
+    # table. ?gzip=1 compresses it on the fly. The chunks come from
+    # export_function, or from get_chunks() when they depend on the request.
+    filename = "export.csv"
+    export_function = None
+
+    def get_chunks(self):
+        if self.export_function is None:
+            raise ImproperlyConfigured(
+                f"{type(self).__name__} is missing an export_function. Define "
+                f"{type(self).__name__}.export_function or override get_chunks()."
+            )
+        return self.export_function()
+
+    def get(self, request, *args, **kwargs):
+        chunks = self.get_chunks()
+        filename = self.filename
+        if request.GET.get("gzip") in ("1", "true"):
+            chunks = gzip_chunks(chunks)
+            content_type = "application/gzip"
+            filename += ".gz"
+        else:
+            content_type = "text/csv"
+        response = StreamingHttpResponse(chunks, content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
+class AccountExportView(CsvExportView):
+    filename = "accounts.csv"
+    export_function = staticmethod(export_accounts)
+
+
+class AccountTransactionsExportView(CsvExportView):
+
+    def get_chunks(self):
+        account = get_object_or_404(Account, pk=self.kwargs["pk"])
+        self.filename = f"account-{account.ref}-transactions.csv"
+        return export_transactions(account)
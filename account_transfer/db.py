@@ -0,0 +1,37 @@
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created, dispatch_uid="account_transfer.apply_sqlite_pragmas")
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    # PRAGMAS in a DATABASES entry are applied to each new SQLite
+    # connection; see DATABASE_PROFILES in settings.
+    if connection.vendor != "sqlite":
+        return
+    pragmas = connection.settings_dict.get("PRAGMAS") or {}
+    if pragmas:
+        with connection.cursor() as cursor:
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+
+
+@contextmanager
+def atomic_immediate(using=None):
+    # transaction.atomic() that opens the outermost transaction with BEGIN
+    # IMMEDIATE on backends that support it (account_transfer.sqlite).
+    # Nested blocks and other backends behave exactly like atomic().
+    connection = connections[using or DEFAULT_DB_ALIAS]
+    if not hasattr(connection, "begin_immediate"):
+        with transaction.atomic(using=using):
+            yield
+        return
+    connection.begin_immediate = True
+    try:
+        with transaction.atomic(using=using):
+            connection.begin_immediate = False
+            yield
+    finally:
+        connection.begin_immediate = False
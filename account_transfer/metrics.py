@@ -0,0 +1,214 @@
+import json
+import logging
+import math
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger("account_transfer.requests")
+MAX_LOGGED_SQL = 300
+_END = object()
+
+# URL name -> the latest REQUEST_METRICS_WINDOW (view_ms, sql_ms, queries)
+# samples. Percentiles are computed from the window when read.
+_samples = defaultdict(lambda: deque(maxlen=settings.REQUEST_METRICS_WINDOW))
+_samples_lock = threading.Lock()
+
+# The recorder of the request being handled. A context variable rather than
+# a wrapper per connection, because the async ORM runs its queries on the
+# connections of sync_to_async threads, which inherit the context.
+_active_recorder = ContextVar("active_query_recorder", default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    recorder = _active_recorder.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def _install_recorder(connection, **kwargs):
+    # First in the list, so that execute_wrapper() blocks, which pop the
+    # last wrapper on exit, still remove their own.
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _record_query)
+
+
+connection_created.connect(_install_recorder)
+
+
+class QueryRecorder:
+    # execute_wrapper callable counting queries and SQL time. The same
+    # SELECT run again with other parameters is counted as a duplicate,
+    # which is what an N+1 loop looks like. Writes are left out: batched
+    # bulk inserts repeat their statement by design.
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            if sql.lstrip()[:6].upper() == "SELECT":
+                self.statements[sql] += 1
+
+    @contextmanager
+    def recording(self):
+        # Records the queries of every database alias while active,
+        # including those run in threads started from this context.
+        for alias in connections:
+            _install_recorder(connections[alias])
+        token = _active_recorder.set(self)
+        try:
+            yield
+        finally:
+            _active_recorder.reset(token)
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values())
+
+    def most_repeated(self):
+        return self.statements.most_common(1)[0][0]
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile of an already sorted list.
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def record_request(name, view_ms, sql_ms, queries):
+    with _samples_lock:
+        _samples[name].append((view_ms, sql_ms, queries))
+
+
+def request_metrics():
+    with _samples_lock:
+        windows = {name: list(samples) for name, samples in _samples.items()}
+    metrics = {}
+    for name, samples in sorted(windows.items()):
+        metrics[name] = {"count": len(samples)}
+        for index, field in enumerate(("view_ms", "sql_ms", "queries")):
+            values = sorted(sample[index] for sample in samples)
+            metrics[name][field] = {
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+                "p99": percentile(values, 0.99),
+            }
+    return metrics
+
+
+def reset_request_metrics():
+    with _samples_lock:
+        _samples.clear()
+
+
+class RequestMetricsMiddleware:
+    # Records query count, SQL time, duplicate queries and wall time for
+    # every request, on every database alias. They are added to the
+    # response as headers, logged as one JSON line on
+    # account_transfer.requests and kept per URL name for request_metrics().
+    # A streaming response is measured until its last chunk is produced and
+    # recorded and logged then; its headers are sent before that, so it gets
+    # none of the X- headers. Runs natively under both WSGI and ASGI.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with recorder.recording():
+            response = self.get_response(request)
+        return self._finish(request, response, recorder, start)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with recorder.recording():
+            response = await self.get_response(request)
+        return self._finish(request, response, recorder, start)
+
+    def _finish(self, request, response, recorder, start):
+        if not response.streaming:
+            self._report(request, response, recorder, start)
+        elif response.is_async:
+            response.streaming_content = self._ameasure_stream(
+                request, response, recorder, start, response.streaming_content
+            )
+        else:
+            response.streaming_content = self._measure_stream(
+                request, response, recorder, start, response.streaming_content
+            )
+        return response
+
+    def _measure_stream(self, request, response, recorder, start, content):
+        iterator = iter(content)
+        try:
+            while True:
+                with recorder.recording():
+                    chunk = next(iterator, _END)
+                if chunk is _END:
+                    return
+                yield chunk
+        finally:
+            self._report(request, response, recorder, start)
+
+    async def _ameasure_stream(self, request, response, recorder, start, content):
+        iterator = aiter(content)
+        try:
+            while True:
+                with recorder.recording():
+                    chunk = await anext(iterator, _END)
+                if chunk is _END:
+                    return
+                yield chunk
+        finally:
+            self._report(request, response, recorder, start)
+
+    def _report(self, request, response, recorder, start):
+        view_ms = round((time.perf_counter() - start) * 1000, 2)
+        sql_ms = round(recorder.duration * 1000, 2)
+
+        match = request.resolver_match
+        name = match.view_name if match and match.view_name else "unresolved"
+        record_request(name, view_ms, sql_ms, recorder.count)
+
+        if settings.REQUEST_METRICS_HEADERS and not response.streaming:
+            response["X-Query-Count"] = recorder.count
+            response["X-Duplicate-Queries"] = recorder.duplicates
+            response["X-SQL-Time-Ms"] = sql_ms
+            response["X-View-Time-Ms"] = view_ms
+
+        log = {
+            "method": request.method,
+            "path": request.path,
+            "url_name": name,
+            "status": response.status_code,
+            "queries": recorder.count,
+            "duplicate_queries": recorder.duplicates,
+            "sql_ms": sql_ms,
+            "view_ms": view_ms,
+        }
+        if recorder.duplicates:
+            log["most_repeated_sql"] = recorder.most_repeated()[:MAX_LOGGED_SQL]
+        logger.info(json.dumps(log))
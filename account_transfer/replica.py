@@ -0,0 +1,154 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS", "TRACE")
+
+# Set while a replica-reading view runs; see ReplicaReadMixin.
+_replica_reads = ContextVar("replica_reads", default=False)
+# The current request's PrimaryPin, set by ReplicaStickinessMiddleware. It
+# is mutated rather than replaced so writes made in sync_to_async threads
+# are seen by the middleware.
+_primary_pin = ContextVar("primary_pin", default=None)
+
+
+class PrimaryPin:
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+def replica_alias():
+    alias = settings.DATABASE_REPLICA_ALIAS
+    return alias if alias in settings.DATABASES else None
+
+
+@contextmanager
+def read_from_replica():
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def replica_read_alias():
+    # The replica alias when reads would go to it right now: inside
+    # read_from_replica(), with one configured, outside any transaction on
+    # the primary, and when the request is not pinned to the primary by a
+    # recent write. None otherwise.
+    alias = replica_alias()
+    if alias is None or not _replica_reads.get():
+        return None
+    pin = _primary_pin.get()
+    if pin and (pin.pinned or pin.wrote):
+        return None
+    if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+        return None
+    return alias
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        return replica_read_alias()
+
+    def db_for_write(self, model, **hints):
+        pin = _primary_pin.get()
+        if pin:
+            pin.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # The replica is a copy of the primary, never migrated on its own.
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaReadMixin:
+    # Runs the view, and renders or streams its response, with reads routed
+    # to the replica.
+
+    def dispatch(self, request, *args, **kwargs):
+        if self.view_is_async:
+            return self._async_dispatch(request, *args, **kwargs)
+        with read_from_replica():
+            return self._render(super().dispatch(request, *args, **kwargs))
+
+    async def _async_dispatch(self, request, *args, **kwargs):
+        with read_from_replica():
+            return self._render(await super().dispatch(request, *args, **kwargs))
+
+    def _render(self, response):
+        if hasattr(response, "render") and callable(response.render):
+            response.render()
+        if response.streaming:
+            response.streaming_content = _stream_from_replica(response.streaming_content)
+        return response
+
+
+def _stream_from_replica(content):
+    # Streamed content is produced after the view returns, so each chunk is
+    # read with the replica routing re-entered.
+    iterator = iter(content)
+    while True:
+        with read_from_replica():
+            chunk = next(iterator, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+class ReplicaStickinessMiddleware:
+    # A request that writes to the primary sets a short-lived cookie, and
+    # requests carrying it read from the primary, so users see their own
+    # transfers even while the replica lags. Runs natively under both WSGI
+    # and ASGI, so async views are not pushed onto a thread.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        pin = self._pin(request)
+        token = _primary_pin.set(pin)
+        try:
+            response = self.get_response(request)
+        finally:
+            _primary_pin.reset(token)
+        return self._set_cookie(request, pin, response)
+
+    async def __acall__(self, request):
+        pin = self._pin(request)
+        token = _primary_pin.set(pin)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _primary_pin.reset(token)
+        return self._set_cookie(request, pin, response)
+
+    def _pin(self, request):
+        cookie = settings.DATABASE_REPLICA_PIN_COOKIE
+        return PrimaryPin(pinned=cookie in request.COOKIES)
+
+    def _set_cookie(self, request, pin, response):
+        if pin.wrote and request.method not in SAFE_METHODS:
+            response.set_cookie(
+                settings.DATABASE_REPLICA_PIN_COOKIE,
+                "1",
+                max_age=settings.DATABASE_REPLICA_STICKY_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
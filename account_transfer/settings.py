@@ -41,10 +41,13 @@ INSTALLED_APPS = [
     'bootstrap5',
     'account',
     'transaction',
+    'api',
 ]
 
 MIDDLEWARE = [
+    'account_transfer.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'account_transfer.replica.ReplicaStickinessMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -79,13 +82,84 @@ WSGI_APPLICATION = 'account_transfer.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
+# DATABASE_PROFILE picks how the SQLite database is run. 'tuned' uses WAL
+# so readers do not block the writer, keeps connections open between
+# requests and opens transfer transactions with BEGIN IMMEDIATE (see
+# account_transfer/sqlite). 'default' is Django's stock SQLite setup.
+DATABASE_PROFILES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
+        'CONN_MAX_AGE': 0,
+        'PRAGMAS': {},
+    },
+    'tuned': {
+        'ENGINE': 'account_transfer.sqlite',
+        'CONN_MAX_AGE': int(os.environ.get('DATABASE_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        'PRAGMAS': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': 5000,
+            'mmap_size': 256 * 1024 * 1024,
+        },
+    },
+}
+DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'tuned')
+
+DATABASES = {
+    'default': {
         'NAME': BASE_DIR / 'db.sqlite3',
+        **DATABASE_PROFILES[DATABASE_PROFILE],
     }
 }
 
+# Read replica for the account list and details pages and the API's
+# reporting reads (see account_transfer/replica.py). Set
+# DATABASE_REPLICA_NAME to enable it; locally, a second SQLite file kept
+# up to date with sync_replica stands in for a streaming replica. A user
+# who has just written reads from the primary for
+# DATABASE_REPLICA_STICKY_SECONDS.
+DATABASE_REPLICA_NAME = os.environ.get('DATABASE_REPLICA_NAME')
+DATABASE_REPLICA_ALIAS = 'replica' if DATABASE_REPLICA_NAME else None
+DATABASE_REPLICA_STICKY_SECONDS = 10
+DATABASE_REPLICA_PIN_COOKIE = 'read_primary'
+
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': DATABASE_REPLICA_NAME or DATABASES['default']['NAME'],
+    'PRAGMAS': {**DATABASES['default']['PRAGMAS'], 'query_only': 'ON'},
+    'TEST': {'MIRROR': 'default'},
+}
+DATABASE_ROUTERS = ['account_transfer.replica.ReplicaRouter']
+
+
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# The accounts cache holds per-ref account lookups and rendered account-list
+# fragments. The local-memory backend evicts least recently used entries
+# once MAX_ENTRIES is reached. It is private to each process, so a write
+# handled by one worker process cannot invalidate another's copy, which
+# serves stale data until its TIMEOUT. Run a single process with it, or set
+# ACCOUNT_CACHE_BACKEND to a shared backend (file, Redis, Memcached).
+ACCOUNT_CACHE_ALIAS = 'accounts'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    ACCOUNT_CACHE_ALIAS: {
+        'BACKEND': os.environ.get(
+            'ACCOUNT_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('ACCOUNT_CACHE_LOCATION', 'accounts'),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -129,6 +203,62 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Per-request query and latency metrics (account_transfer/metrics.py).
+# Percentiles are computed over the last REQUEST_METRICS_WINDOW requests of
+# each URL name and served at api/metrics/. The X-Query-Count, SQL and view
+# time headers can be turned off for public deployments.
+REQUEST_METRICS_WINDOW = 1000
+REQUEST_METRICS_HEADERS = True
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'account_transfer.requests': {
+            'handlers': ['console'],
+            # The test runner raises this to WARNING; see TEST_RUNNER.
+            'level': os.environ.get('REQUEST_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
+# Quiets the per-request log lines while tests run, which check them with
+# assertLogs, and gives the tests a temporary MEDIA_ROOT.
+TEST_RUNNER = 'account_transfer.test_runner.DiscoverRunner'
+
+# Number of background threads running CSV account imports. 0 runs imports
+# inline in the request thread.
+ACCOUNT_IMPORT_WORKERS = int(os.environ.get('ACCOUNT_IMPORT_WORKERS', 2))
+
+# Number of balance shards created for accounts marked hot with
+# mark_hot_accounts.
+ACCOUNT_BALANCE_SHARDS = 8
+
+# Group commit for single transfers (transaction/group_commit.py). When on,
+# concurrent transfers are queued and one committer thread applies up to
+# TRANSFER_GROUP_COMMIT_MAX_BATCH of them per transaction, waiting at most
+# TRANSFER_GROUP_COMMIT_MAX_DELAY_MS after the first for others to arrive.
+# A caller stops waiting for its transfer after
+# TRANSFER_GROUP_COMMIT_TIMEOUT_SECONDS.
+TRANSFER_GROUP_COMMIT = os.environ.get('TRANSFER_GROUP_COMMIT') == '1'
+TRANSFER_GROUP_COMMIT_MAX_BATCH = 100
+TRANSFER_GROUP_COMMIT_MAX_DELAY_MS = 2
+TRANSFER_GROUP_COMMIT_TIMEOUT_SECONDS = 30
+
+# How long transfer idempotency keys are kept before purge_idempotency_keys
+# removes them.
+TRANSFER_IDEMPOTENCY_KEY_TTL_HOURS = 24
+
+# archive_transactions moves transactions older than this into the archive
+# table. Account pages read the archive only past the hot table's history.
+TRANSACTION_ARCHIVE_AFTER_DAYS = 365
+
 
 STATIC_URL = 'static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
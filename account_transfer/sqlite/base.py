@@ -0,0 +1,13 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # SQLite's default deferred BEGIN takes the write lock at the first
+    # write, and a reader that then needs to write fails with "database is
+    # locked" without waiting on the busy timeout. Transactions started
+    # through account_transfer.db.atomic_immediate take the write lock up
+    # front instead, so concurrent writers queue on the busy timeout.
+    begin_immediate = False
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute("BEGIN IMMEDIATE" if self.begin_immediate else "BEGIN")
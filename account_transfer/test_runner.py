@@ -0,0 +1,23 @@
+import logging
+import tempfile
+
+from django.test import runner
+from django.test.utils import override_settings
+
+
+class DiscoverRunner(runner.DiscoverRunner):
+    # One request log line per test client request would drown the test
+    # output. Uploaded files go to a temporary MEDIA_ROOT, removed at the
+    # end, rather than next to the real ones.
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        logging.getLogger("account_transfer.requests").setLevel(logging.WARNING)
+        self._media_root = tempfile.TemporaryDirectory(prefix="test-media-")
+        self._media_settings = override_settings(MEDIA_ROOT=self._media_root.name)
+        self._media_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._media_settings.disable()
+        self._media_root.cleanup()
+        super().teardown_test_environment(**kwargs)
@@ -24,6 +24,7 @@ urlpatterns = [
     path("admin/", admin.site.urls),
     path("", include("account.urls")),
     path("transaction/", include("transaction.urls")),
+    path("api/", include("api.urls")),
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,232 @@
+import json
+from decimal import Decimal
+
+from django.db import connection
+from django.test import TestCase
+from django.urls import reverse
+
+from account.models import Account
+from account_transfer.metrics import (
+    QueryRecorder,
+    request_metrics,
+    reset_request_metrics,
+)
+from transaction.models import Transactions
+
+
+class AccountApiTests(TestCase):
+    def setUp(self):
+        self.accounts = [
+            Account.objects.create(ref=str(i), name=f"Account {i}", balance=i * 100)
+            for i in range(1, 4)
+        ]
+
+    def test_account_list_cursor_pagination(self):
+        url = reverse("api-account-list")
+        response = self.client.get(url, {"page_size": 2})
+        data = response.json()
+        self.assertEqual([row["ref"] for row in data["results"]], ["3", "2"])
+        self.assertEqual(data["results"][0]["balance"], "300.00")
+        self.assertEqual(data["next_cursor"], self.accounts[1].id)
+
+        data = self.client.get(
+            url, {"page_size": 2, "after": data["next_cursor"]}
+        ).json()
+        self.assertEqual([row["ref"] for row in data["results"]], ["1"])
+        self.assertIsNone(data["next_cursor"])
+
+    def test_account_list_sparse_fields(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("api-account-list"), {"fields": "ref"})
+        self.assertEqual(response.json()["results"][0], {"ref": "3"})
+
+    def test_account_balance_at_point_in_time(self):
+        url = reverse("api-account-balance", args=[self.accounts[0].pk])
+        self.assertEqual(self.client.get(url).json()["balance"], "100.00")
+        response = self.client.get(url, {"at": "2000-01-01T00:00:00"})
+        self.assertEqual(response.json()["balance"], "0.00")
+        response = self.client.get(url, {"at": "yesterday"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_account_list_unknown_field(self):
+        response = self.client.get(reverse("api-account-list"), {"fields": "ref,secret"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"errors": ["Unknown fields: secret"]})
+
+    def test_account_details(self):
+        Transactions.transfer("3", "50.00", "1")
+        url = reverse("api-account-details", args=[self.accounts[0].pk])
+        data = self.client.get(url).json()
+        self.assertEqual(data["ref"], "1")
+        self.assertEqual(data["balance"], "150.00")
+        self.assertEqual(data["total_received"], "50.00")
+        self.assertEqual(data["transaction_count"], 1)
+
+        data = self.client.get(url, {"fields": "name,balance"}).json()
+        self.assertEqual(data, {"name": "Account 1", "balance": "150.00"})
+
+    def test_account_details_not_found(self):
+        response = self.client.get(reverse("api-account-details", args=[999]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_account_transactions(self):
+        first = Transactions.transfer("3", "50.00", "1")
+        second = Transactions.transfer("1", "20.00", "2")
+        url = reverse("api-account-transactions", args=[self.accounts[0].pk])
+        data = self.client.get(url, {"page_size": 1}).json()
+        self.assertEqual(len(data["results"]), 1)
+        self.assertEqual(
+            {key: data["results"][0][key] for key in ("id", "sender", "recipient", "amount")},
+            {"id": second.id, "sender": "1", "recipient": "2", "amount": "20.00"},
+        )
+        data = self.client.get(url, {"page_size": 1, "cursor": data["next_cursor"]}).json()
+        self.assertEqual([row["id"] for row in data["results"]], [first.id])
+        self.assertIsNone(data["next_cursor"])
+
+
+class TransferApiTests(TestCase):
+    def setUp(self):
+        self.sender = Account.objects.create(ref="1", name="John", balance=1000.0)
+        self.recipient = Account.objects.create(ref="2", name="Jane", balance=500.0)
+
+    def post_json(self, name, data, **extra):
+        return self.client.post(
+            reverse(name), json.dumps(data), content_type="application/json", **extra
+        )
+
+    def test_transfer(self):
+        response = self.post_json(
+            "api-transfer", {"sender": "1", "recipient": "2", "amount": "100.00"}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["amount"], "100.00")
+        self.sender.refresh_from_db()
+        self.assertEqual(self.sender.balance, Decimal("900.00"))
+
+    def test_transfer_idempotency_header(self):
+        data = {"sender": "1", "recipient": "2", "amount": "100.00"}
+        first = self.post_json("api-transfer", data, HTTP_IDEMPOTENCY_KEY="abc")
+        second = self.post_json("api-transfer", data, HTTP_IDEMPOTENCY_KEY="abc")
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 200)
+        self.assertTrue(second.json()["replayed"])
+        self.assertEqual(first.json()["id"], second.json()["id"])
+        self.assertEqual(Transactions.objects.count(), 1)
+
+    def test_transfer_rejects_bad_idempotency_headers(self):
+        data = {"sender": "1", "recipient": "2", "amount": "100.00"}
+        for key in ("k" * 256, ""):
+            response = self.post_json("api-transfer", data, HTTP_IDEMPOTENCY_KEY=key)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("idempotency_key", response.json()["errors"])
+        self.assertFalse(Transactions.objects.exists())
+
+    def test_transfer_validation_errors(self):
+        response = self.post_json(
+            "api-transfer", {"sender": "1", "recipient": "999", "amount": "100.00"}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()["errors"]["recipient"][0]["message"],
+            "Recipient with reference '999' does not exist.",
+        )
+
+    def test_transfer_insufficient_funds(self):
+        response = self.post_json(
+            "api-transfer", {"sender": "1", "recipient": "2", "amount": "5000.00"}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"errors": {"__all__": ["Insufficient funds."]}})
+
+    def test_transfer_invalid_json(self):
+        response = self.client.post(
+            reverse("api-transfer"), "{", content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"errors": ["Request body is not valid JSON."]})
+
+    def test_bulk_transfer(self):
+        response = self.post_json(
+            "api-bulk-transfer",
+            {
+                "transfers": [
+                    {"sender": "1", "recipient": "2", "amount": "100.00"},
+                    {"sender": "2", "recipient": "1", "amount": "9000.00"},
+                ]
+            },
+        )
+        data = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((data["completed"], data["rejected"]), (1, 1))
+        self.assertEqual(data["results"][1]["error"], "Insufficient funds.")
+
+    def test_bulk_transfer_requires_transfers(self):
+        response = self.post_json("api-bulk-transfer", {"transfers": [{"sender": "1"}]})
+        self.assertEqual(response.status_code, 400)
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        reset_request_metrics()
+        self.account = Account.objects.create(ref="1", name="Account 1", balance=100)
+        self.url = reverse("api-account-details", args=[self.account.pk])
+
+    def test_response_headers_report_queries_and_timings(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response["X-Query-Count"], "1")
+        self.assertEqual(response["X-Duplicate-Queries"], "0")
+        self.assertGreaterEqual(float(response["X-SQL-Time-Ms"]), 0)
+        self.assertGreaterEqual(
+            float(response["X-View-Time-Ms"]), float(response["X-SQL-Time-Ms"])
+        )
+
+    def test_repeated_statements_are_counted_as_duplicates(self):
+        other = Account.objects.create(ref="2", name="Account 2", balance=100)
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for pk in (self.account.pk, other.pk, self.account.pk):
+                Account.objects.get(pk=pk)
+            Account.objects.count()
+            Account.objects.bulk_create(
+                [Account(ref=f"new-{i}", name="New", balance=0) for i in range(4)],
+                batch_size=2,
+            )
+        self.assertEqual((recorder.count, recorder.duplicates), (6, 2))
+        self.assertIn("WHERE", recorder.most_repeated())
+
+    def test_requests_are_logged_as_json(self):
+        with self.assertLogs("account_transfer.requests", "INFO") as logs:
+            self.client.get(self.url)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["url_name"], "api-account-details")
+        self.assertEqual((record["status"], record["queries"]), (200, 1))
+
+    async def test_async_requests_are_measured_without_adapting_middleware(self):
+        # Django logs "Asynchronous handler adapted for middleware ..." at
+        # DEBUG when it has to wrap sync-only middleware for ASGI.
+        with self.assertNoLogs("django.request", "DEBUG"):
+            response = await self.async_client.get(
+                reverse("account-details-async", args=[self.account.pk])
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertGreaterEqual(int(response["X-Query-Count"]), 1)
+
+    def test_streaming_responses_are_measured_to_the_last_chunk(self):
+        response = self.client.get(reverse("account-export"))
+        self.assertNotIn("X-Query-Count", response)
+        with self.assertLogs("account_transfer.requests", "INFO") as logs:
+            b"".join(response.streaming_content)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record["url_name"], "account-export")
+        self.assertGreaterEqual(record["queries"], 2)
+        self.assertEqual(request_metrics()["account-export"]["count"], 1)
+
+    def test_metrics_endpoint_reports_percentiles_per_url_name(self):
+        for _ in range(3):
+            self.client.get(self.url)
+        data = self.client.get(reverse("api-metrics")).json()
+        details = data["requests"]["api-account-details"]
+        self.assertEqual(details["count"], 3)
+        self.assertEqual(details["queries"], {"p50": 1, "p95": 1, "p99": 1})
+        self.assertEqual(set(details["view_ms"]), {"p50", "p95", "p99"})
+        self.assertIn("cache", data)
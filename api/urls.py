@@ -0,0 +1,21 @@
+from django.urls import path
+from .views import *
+
+urlpatterns = [
+    path("accounts/", AccountListApiView.as_view(), name="api-account-list"),
+    path("accounts/<int:pk>/", AccountDetailsApiView.as_view(), name="api-account-details"),
+    path(
+        "accounts/<int:pk>/transactions/",
+        AccountTransactionsApiView.as_view(),
+        name="api-account-transactions",
+    ),
+    path(
+        "accounts/<int:pk>/balance/",
+        AccountBalanceApiView.as_view(),
+        name="api-account-balance",
+    ),
+    path("transfers/", TransferApiView.as_view(), name="api-transfer"),
+    path("transfers/bulk/", BulkTransferApiView.as_view(), name="api-bulk-transfer"),
+    path("cache-stats/", CacheStatsApiView.as_view(), name="api-cache-stats"),
+    path("metrics/", MetricsApiView.as_view(), name="api-metrics"),
+    ]
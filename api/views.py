@@ -0,0 +1,264 @@
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import F
+from django.http import Http404, JsonResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from account.cache import cache_stats
+from account.models import Account
+from account.pagination import (
+    decode_cursor,
+    encode_cursor,
+    get_int_param,
+    get_page_size,
+    prefix_q,
+)
+from account_transfer.metrics import request_metrics
+from account_transfer.replica import ReplicaReadMixin
+from transaction.archive import history_page
+from transaction.forms import TransactionForm
+from transaction.ledger import balance_at
+from transaction.models import Transactions
+
+# Public field name -> values() lookup. Summary fields come from the joined
+# ledger summary row, so sparse selections without them skip the join.
+# balance is the current_balance annotation, which includes hot accounts'
+# shard credits.
+ACCOUNT_FIELDS = {
+    "id": "id",
+    "ref": "ref",
+    "name": "name",
+    "balance": "current_balance",
+    "total_sent": "ledger_summary__total_sent",
+    "total_received": "ledger_summary__total_received",
+    "transaction_count": "ledger_summary__transaction_count",
+    "last_activity": "ledger_summary__last_activity",
+}
+DEFAULT_ACCOUNT_FIELDS = ["id", "ref", "name", "balance"]
+TRANSACTION_FIELDS = ["id", "sender__ref", "recipient__ref", "amount", "created"]
+
+
+def error_response(errors, status=400):
+    return JsonResponse({"errors": errors}, status=status)
+
+
+def select_values(queryset, requested, allowed):
+    # Fields and annotations are selected under their own names; related
+    # lookups are renamed with F() so the JSON keys stay flat. values() cannot
+    # rename an annotation to a model field's name, so public_row() renames
+    # those.
+    plain = [allowed[field] for field in requested if "__" not in allowed[field]]
+    renamed = {
+        field: F(allowed[field]) for field in requested if "__" in allowed[field]
+    }
+    return queryset.values(*plain, **renamed)
+
+
+def public_row(row, requested, allowed):
+    return {
+        field: row[field] if field in row else row[allowed[field]]
+        for field in requested
+    }
+
+
+class JsonApiView(View):
+
+    def get_fields(self, allowed, default):
+        requested = self.request.GET.get("fields")
+        if not requested:
+            return list(default)
+        fields = [field.strip() for field in requested.split(",") if field.strip()]
+        unknown = [field for field in fields if field not in allowed]
+        if unknown:
+            raise ValidationError(f"Unknown fields: {', '.join(unknown)}")
+        return fields
+
+    def get_json_body(self):
+        try:
+            return json.loads(self.request.body or b"{}")
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            raise ValidationError("Request body is not valid JSON.")
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except ValidationError as e:
+            return error_response(e.messages)
+        except Http404 as e:
+            return error_response([str(e)], status=404)
+
+
+class AccountListApiView(ReplicaReadMixin, JsonApiView):
+
+    def get(self, request):
+        fields = self.get_fields(ACCOUNT_FIELDS, DEFAULT_ACCOUNT_FIELDS)
+        page_size = get_page_size(request)
+        after = get_int_param(request, "after")
+        search = request.GET.get("q", "").strip()
+
+        accounts = Account.objects.with_current_balance().order_by("-id")
+        if search:
+            accounts = accounts.filter(prefix_q("ref", search) | prefix_q("name", search))
+        if after is not None:
+            accounts = accounts.filter(id__lt=after)
+        # The cursor column is always selected and dropped again when it was
+        # not requested.
+        rows = list(
+            select_values(accounts, ["id", *fields], ACCOUNT_FIELDS)[: page_size + 1]
+        )
+
+        next_cursor = rows[page_size - 1]["id"] if len(rows) > page_size else None
+        rows = [public_row(row, fields, ACCOUNT_FIELDS) for row in rows[:page_size]]
+        return JsonResponse({"results": rows, "next_cursor": next_cursor})
+
+
+class AccountDetailsApiView(ReplicaReadMixin, JsonApiView):
+
+    def get(self, request, pk):
+        fields = self.get_fields(ACCOUNT_FIELDS, ACCOUNT_FIELDS)
+        accounts = Account.objects.with_current_balance().filter(pk=pk)
+        account = select_values(accounts, fields, ACCOUNT_FIELDS).first()
+        if account is None:
+            raise Http404("Account does not exist.")
+        return JsonResponse(public_row(account, fields, ACCOUNT_FIELDS))
+
+
+class AccountTransactionsApiView(ReplicaReadMixin, JsonApiView):
+
+    def get(self, request, pk):
+        page_size = get_page_size(request)
+        cursor = decode_cursor(request.GET.get("cursor"))
+        # One query checks the account exists and whether it has archived
+        # transactions to fall through to.
+        archive = list(
+            Account.objects.filter(pk=pk).values_list("archive_summary", flat=True)
+        )
+        if not archive:
+            raise Http404("Account does not exist.")
+
+        rows = history_page(
+            pk,
+            cursor,
+            page_size + 1,
+            TRANSACTION_FIELDS,
+            archived=archive[0] is not None,
+        )
+        next_cursor = (
+            encode_cursor(rows[page_size - 1]["created"], rows[page_size - 1]["id"])
+            if len(rows) > page_size
+            else None
+        )
+        results = [
+            {
+                "id": row["id"],
+                "sender": row["sender__ref"],
+                "recipient": row["recipient__ref"],
+                "amount": row["amount"],
+                "created": row["created"],
+            }
+            for row in rows[:page_size]
+        ]
+        return JsonResponse({"results": results, "next_cursor": next_cursor})
+
+
+class AccountBalanceApiView(ReplicaReadMixin, JsonApiView):
+
+    def get(self, request, pk):
+        if not Account.objects.filter(pk=pk).exists():
+            raise Http404("Account does not exist.")
+        at = request.GET.get("at")
+        when = None
+        if at:
+            try:
+                when = parse_datetime(at)
+            except ValueError:
+                when = None
+            if when is None:
+                raise ValidationError("at must be an ISO 8601 datetime.")
+            if timezone.is_naive(when):
+                when = timezone.make_aware(when)
+        return JsonResponse({"id": pk, "at": when, "balance": balance_at(pk, when)})
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class TransferApiView(JsonApiView):
+
+    def post(self, request):
+        data = self.get_json_body()
+        if not isinstance(data, dict):
+            raise ValidationError("Request body must be a JSON object.")
+        form = TransactionForm(
+            data=data, idempotency_header=request.headers.get("Idempotency-Key")
+        )
+        if not form.is_valid():
+            return error_response(form.errors.get_json_data())
+
+        cleaned_data = form.cleaned_data
+        try:
+            ledger_row = Transactions.transfer_between(
+                sender=cleaned_data["sender_account"],
+                recipient=cleaned_data["recipient_account"],
+                transaction_amount=cleaned_data["amount"],
+                idempotency_key=cleaned_data["idempotency_key"],
+            )
+        except ValidationError as e:
+            return error_response({"__all__": e.messages})
+
+        replayed = getattr(ledger_row, "replayed", False)
+        return JsonResponse(
+            {
+                "id": ledger_row.pk,
+                "sender": cleaned_data["sender"],
+                "recipient": cleaned_data["recipient"],
+                "amount": ledger_row.amount,
+                "created": ledger_row.created,
+                "replayed": replayed,
+            },
+            status=200 if replayed else 201,
+        )
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class BulkTransferApiView(JsonApiView):
+
+    def post(self, request):
+        data = self.get_json_body()
+        transfers = data.get("transfers") if isinstance(data, dict) else None
+        if not isinstance(transfers, list) or not transfers:
+            raise ValidationError("transfers must be a non-empty list.")
+        try:
+            items = [
+                (str(item["sender"]), str(item["recipient"]), item["amount"])
+                for item in transfers
+            ]
+        except (KeyError, TypeError):
+            raise ValidationError(
+                "Every transfer needs sender, recipient and amount."
+            )
+
+        results = Transactions.bulk_transfer(items)
+        rejected = sum(1 for result in results if result["error"])
+        return JsonResponse(
+            {
+                "completed": len(results) - rejected,
+                "rejected": rejected,
+                "results": results,
+            }
+        )
+
+
+class CacheStatsApiView(JsonApiView):
+
+    def get(self, request):
+        return JsonResponse(cache_stats())
+
+
+class MetricsApiView(JsonApiView):
+
+    def get(self, request):
+        return JsonResponse({"requests": request_metrics(), "cache": cache_stats()})
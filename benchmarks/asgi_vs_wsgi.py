@@ -0,0 +1,124 @@
+"""
+Compare requests per second and p99 latency of the sync (WSGI) and native
+async (ASGI) views under concurrent clients.
+
+    python -m benchmarks.asgi_vs_wsgi --concurrency 1 8 32 --requests 400
+
+WSGI requests go through django.test.Client on a thread pool, ASGI requests
+through django.test.AsyncClient on one event loop, so both sides exercise the
+real handler and middleware stack without a network server.
+"""
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import Timer, setup_django, summarize
+
+
+def seed(accounts, transactions):
+    from account.models import Account
+    from transaction.models import Transactions
+
+    Account.objects.bulk_create(
+        Account(ref=f"acc-{i}", name=f"Account {i}", balance=1_000_000)
+        for i in range(accounts)
+    )
+    ids = list(Account.objects.values_list("id", flat=True))
+    Transactions.objects.bulk_create(
+        Transactions(sender_id=ids[i % len(ids)], recipient_id=ids[(i + 1) % len(ids)], amount=5)
+        for i in range(transactions)
+    )
+    return ids
+
+
+def scenarios(account_ids):
+    from django.urls import reverse
+
+    hot = account_ids[0]
+    return {
+        "list": (reverse("account-list"), reverse("account-list-async"), None),
+        "details": (
+            reverse("account-details", args=[hot]),
+            reverse("account-details-async", args=[hot]),
+            None,
+        ),
+        "transfer": (
+            reverse("balance-transaction"),
+            reverse("balance-transaction-async"),
+            {"sender": "acc-1", "recipient": "acc-2", "amount": "5.00"},
+        ),
+    }
+
+
+def run_wsgi(url, data, concurrency, requests):
+    from django.db import connections
+    from django.test import Client
+
+    def worker(count):
+        client = Client()
+        latencies = []
+        for _ in range(count):
+            start = time.perf_counter()
+            response = client.post(url, data) if data else client.get(url)
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code < 400, response.status_code
+        connections.close_all()
+        return latencies
+
+    per_worker = max(1, requests // concurrency)
+    with Timer() as timer, ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(worker, [per_worker] * concurrency))
+    return summarize([latency for result in results for latency in result], timer.elapsed)
+
+
+def run_asgi(url, data, concurrency, requests):
+    from django.test import AsyncClient
+
+    async def worker(count):
+        client = AsyncClient()
+        latencies = []
+        for _ in range(count):
+            start = time.perf_counter()
+            if data:
+                response = await client.post(url, data)
+            else:
+                response = await client.get(url)
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code < 400, response.status_code
+        return latencies
+
+    async def main():
+        per_worker = max(1, requests // concurrency)
+        return await asyncio.gather(*(worker(per_worker) for _ in range(concurrency)))
+
+    with Timer() as timer:
+        results = asyncio.run(main())
+    return summarize([latency for result in results for latency in result], timer.elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--transactions", type=int, default=20000)
+    parser.add_argument("--database", help="SQLite file to use (default: temp file)")
+    args = parser.parse_args()
+
+    setup_django(args.database)
+    account_ids = seed(args.accounts, args.transactions)
+
+    print(f"{'scenario':<10} {'server':<6} {'clients':>7} {'rps':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for name, (sync_url, async_url, data) in scenarios(account_ids).items():
+        for concurrency in args.concurrency:
+            for server, run, url in (("wsgi", run_wsgi, sync_url), ("asgi", run_asgi, async_url)):
+                result = run(url, data, concurrency, args.requests)
+                print(
+                    f"{name:<10} {server:<6} {concurrency:>7} {result['rps']:>9.1f} "
+                    f"{result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
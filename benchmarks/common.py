@@ -0,0 +1,70 @@
+import atexit
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def setup_django(database_name=None, database_profile=None):
+    # Points the project at a throwaway SQLite file, so benchmarks never
+    # touch the development database, and migrates it. database_profile
+    # selects one of settings.DATABASE_PROFILES.
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "account_transfer.settings")
+
+    import django
+    from django.conf import settings
+
+    if database_name is None:
+        handle, database_name = tempfile.mkstemp(prefix="bench-", suffix=".sqlite3")
+        os.close(handle)
+        atexit.register(_remove_database, database_name)
+    if database_profile:
+        settings.DATABASES["default"].update(settings.DATABASE_PROFILES[database_profile])
+    settings.DATABASES["default"]["NAME"] = database_name
+    settings.DEBUG = False
+    django.setup()
+
+    from django.core.management import call_command
+
+    call_command("migrate", verbosity=0)
+    return database_name
+
+
+def _remove_database(database_name):
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        try:
+            os.remove(database_name + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def percentile(samples, percent):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed):
+    return {
+        "requests": len(latencies),
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000 if latencies else 0.0,
+    }
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start
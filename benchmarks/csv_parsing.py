@@ -0,0 +1,105 @@
+"""
+Compare rows per second of the row-by-row DictReader import parser with the
+columnar block parser in account/csv_import.py.
+
+    python -m benchmarks.csv_parsing --rows 1000000
+
+The columnar parser uses pyarrow when it is installed; --no-pyarrow times
+its pure-Python fallback instead.
+Only parsing and validation are timed. Both parsers hand the same rows to
+the save stage, so database time is left out.
+"""
+import argparse
+import csv
+import os
+import random
+import tempfile
+
+from benchmarks.common import Timer, setup_django
+
+
+def write_csv(path, rows):
+    rng = random.Random(0)
+    with open(path, "w", newline="") as handle:
+        writer = csv.writer(handle)
+        writer.writerow(["ID", "Name", "Balance"])
+        for i in range(rows):
+            writer.writerow([f"acc-{i}", f"Account {i}", f"{rng.randrange(10**8) / 100:.2f}"])
+
+
+def parse_rowwise(path, chunk_size):
+    # The parser the import view used before the columnar engine.
+    required_fields = ["ID", "Name", "Balance"]
+    parsed = 0
+    with open(path, newline="", encoding="utf-8") as handle:
+        reader = csv.DictReader(handle)
+        chunk = []
+
+        def process(chunk):
+            accounts = {}
+            for index, row in chunk:
+                if not all(row.get(field) and row[field].strip() for field in required_fields):
+                    continue
+                balance = float(row["Balance"])
+                if balance < 0:
+                    raise ValueError("Balance cannot be negative.")
+                accounts[row["ID"]] = (row["Name"], balance)
+            return len(accounts)
+
+        for index, row in enumerate(reader, start=1):
+            chunk.append((index, row))
+            if len(chunk) >= chunk_size:
+                parsed += process(chunk)
+                chunk = []
+        if chunk:
+            parsed += process(chunk)
+    return parsed
+
+
+def parse_columnar(path, chunk_size):
+    from account.csv_import import drop_duplicates, parse_block, read_blocks, split_columns
+
+    parsed = 0
+    seen_refs = set()
+    with open(path, newline="", encoding="utf-8") as handle:
+        for first_row, block in read_blocks(handle):
+            columns = drop_duplicates(parse_block(first_row, block), seen_refs)
+            for batch in split_columns(columns, chunk_size):
+                parsed += len(batch.refs)
+    return parsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--no-pyarrow", action="store_true")
+    args = parser.parse_args()
+
+    setup_django()
+    from account import csv_import
+    from account.views import ImportAccountsView
+
+    if args.no_pyarrow:
+        csv_import.pyarrow = None
+    print(f"columnar engine: {'pyarrow' if csv_import.pyarrow else 'python'}")
+
+    chunk_size = args.chunk_size or ImportAccountsView.chunk_size
+    handle, path = tempfile.mkstemp(suffix=".csv")
+    os.close(handle)
+    try:
+        write_csv(path, args.rows)
+        results = {}
+        for name, parse in (("rowwise", parse_rowwise), ("columnar", parse_columnar)):
+            with Timer() as timer:
+                parsed = parse(path, chunk_size)
+            assert parsed == args.rows, (name, parsed)
+            results[name] = args.rows / timer.elapsed
+            print(f"{name:<9} {timer.elapsed:>8.2f}s {results[name]:>12,.0f} rows/s")
+        print(f"speedup   {results['columnar'] / results['rowwise']:>8.2f}x")
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Seeded synthetic data for benchmarks: accounts, transfers whose recipients
+follow a Zipf distribution, and account CSV files of a given size.
+
+    python -m benchmarks.datagen csv accounts.csv --rows 1000000
+    python -m benchmarks.datagen csv accounts.csv --size-mb 512 --seed 7
+
+The same seed always gives the same data, so runs on different commits or
+machines measure the same workload.
+"""
+import argparse
+import itertools
+import random
+from datetime import timedelta
+
+DEFAULT_SEED = 42
+# Exponent of the Zipf distribution of recipients. With s = 1.1 and 10k
+# accounts, the top 1% of accounts receive about two thirds of the transfers.
+DEFAULT_SKEW = 1.1
+
+
+def account_ref(index):
+    return f"acc-{index}"
+
+
+def zipf_cum_weights(count, skew):
+    # Cumulative weights of ranks 1..count, for random.choices.
+    return list(itertools.accumulate(1 / rank**skew for rank in range(1, count + 1)))
+
+
+def transfer_pairs(accounts, transfers, skew=DEFAULT_SKEW, seed=DEFAULT_SEED):
+    # (sender index, recipient index) pairs. Recipients follow Zipf, so a
+    # few accounts are hot; senders are uniform. Which indexes are hot is
+    # shuffled by the seed rather than always being the first ones.
+    rng = random.Random(seed)
+    ranks = list(range(accounts))
+    rng.shuffle(ranks)
+    weights = zipf_cum_weights(accounts, skew)
+    recipients = rng.choices(ranks, cum_weights=weights, k=transfers)
+    pairs = []
+    for recipient in recipients:
+        sender = rng.randrange(accounts - 1)
+        pairs.append((sender + (sender >= recipient), recipient))
+    return pairs
+
+
+def hottest(pairs):
+    # Index of the account receiving the most transfers.
+    counts = {}
+    for _, recipient in pairs:
+        counts[recipient] = counts.get(recipient, 0) + 1
+    return max(counts, key=counts.get)
+
+
+def account_rows(rows=None, seed=DEFAULT_SEED):
+    # (ref, name, balance) CSV fields; endless when rows is None.
+    rng = random.Random(seed)
+    indexes = itertools.count() if rows is None else range(rows)
+    for index in indexes:
+        cents = rng.randrange(100_000_000)
+        balance = f"{cents // 100}.{cents % 100:02}"
+        yield account_ref(index), f"Account {index}", balance
+
+
+def write_accounts_csv(path, rows=None, size_bytes=None, seed=DEFAULT_SEED):
+    # Writes rows accounts, or as many as fit in size_bytes, with the
+    # import's headers. Returns the number of rows written.
+    written = 0
+    size = 0
+    with open(path, "w", newline="") as csv_file:
+        size += csv_file.write("ID,Name,Balance\n")
+        for row in account_rows(rows, seed):
+            line = ",".join(row) + "\n"
+            if size_bytes is not None and size + len(line) > size_bytes:
+                break
+            size += csv_file.write(line)
+            written += 1
+    return written
+
+
+def seed_accounts(count, balance=1_000_000, batch_size=5000):
+    from account.models import Account
+
+    Account.objects.bulk_create(
+        (
+            Account(ref=account_ref(index), name=f"Account {index}", balance=balance)
+            for index in range(count)
+        ),
+        batch_size=batch_size,
+    )
+    return dict(Account.objects.values_list("ref", "pk"))
+
+
+def seed_history(account_ids, pairs, amount=5, batch_size=5000):
+    # Inserts completed transfers directly, one second apart, to give the
+    # history pages realistic depth. Balances and ledgers are not touched;
+    # this is page-rendering data, not a consistent ledger.
+    from django.utils import timezone
+
+    from transaction.models import Transactions
+
+    start = timezone.now() - timedelta(seconds=len(pairs))
+    Transactions.objects.bulk_create(
+        (
+            Transactions(
+                sender_id=account_ids[account_ref(sender)],
+                recipient_id=account_ids[account_ref(recipient)],
+                amount=amount,
+                created=start + timedelta(seconds=offset),
+            )
+            for offset, (sender, recipient) in enumerate(pairs)
+        ),
+        batch_size=batch_size,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    csv_parser = commands.add_parser("csv", help="Write an account import file.")
+    csv_parser.add_argument("path")
+    size = csv_parser.add_mutually_exclusive_group(required=True)
+    size.add_argument("--rows", type=int)
+    size.add_argument("--size-mb", type=float)
+    csv_parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    args = parser.parse_args()
+
+    size_bytes = int(args.size_mb * 1024 * 1024) if args.size_mb else None
+    written = write_accounts_csv(args.path, args.rows, size_bytes, args.seed)
+    print(f"Wrote {written} accounts to {args.path}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Measure single-transfer throughput with and without the group commit queue
+at several concurrency levels.
+
+    python -m benchmarks.group_commit --threads 1 8 32 --transfers 2000
+    python -m benchmarks.group_commit --synchronous FULL --max-delay-ms 1 5
+
+Each thread transfers between its own pair of accounts, so the only thing
+the threads share is the database. Without the queue every transfer is one
+commit; with it, one committer thread commits many transfers at a time.
+--synchronous FULL syncs every commit to disk, which is where batching
+helps most.
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import Timer, setup_django, summarize
+
+
+def seed(threads):
+    from account.models import Account
+
+    Account.objects.bulk_create(
+        Account(ref=f"bench-{i}", name=f"Account {i}", balance=1_000_000)
+        for i in range(threads * 2)
+    )
+    return list(Account.objects.order_by("pk"))
+
+
+def run(accounts, threads, transfers):
+    from django.db import connections
+
+    from transaction.group_commit import submit_transfer
+
+    def worker(index):
+        sender, recipient = accounts[2 * index], accounts[2 * index + 1]
+        latencies = []
+        try:
+            for _ in range(transfers // threads):
+                start = time.perf_counter()
+                submit_transfer(sender, recipient, "5.00")
+                latencies.append(time.perf_counter() - start)
+        finally:
+            connections.close_all()
+        return latencies
+
+    with Timer() as timer, ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(worker, range(threads)))
+    return summarize([latency for result in results for latency in result], timer.elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--transfers", type=int, default=2000)
+    parser.add_argument("--max-batch", type=int, default=100)
+    parser.add_argument("--max-delay-ms", type=float, nargs="+", default=[2])
+    parser.add_argument("--synchronous", help="PRAGMA synchronous for the run")
+    parser.add_argument("--database", help="SQLite file to use (default: temp file)")
+    args = parser.parse_args()
+
+    setup_django(args.database)
+    from django.conf import settings
+    from django.db import connections
+
+    from transaction import models as transaction_models
+    from transaction.group_commit import close_transfer_queue
+
+    # Lock errors are part of what is being measured, so retry generously.
+    transaction_models.TRANSFER_MAX_ATTEMPTS = 200
+    if args.synchronous:
+        # Connections opened from here on apply the new PRAGMAS.
+        pragmas = settings.DATABASES["default"]["PRAGMAS"]
+        settings.DATABASES["default"]["PRAGMAS"] = {
+            **pragmas,
+            "synchronous": args.synchronous,
+        }
+        connections.close_all()
+    accounts = seed(max(args.threads))
+    settings.TRANSFER_GROUP_COMMIT_MAX_BATCH = args.max_batch
+
+    modes = [("direct", None)] + [(f"queue {ms}ms", ms) for ms in args.max_delay_ms]
+    print(f"{'mode':<12} {'threads':>7} {'tps':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for mode, max_delay_ms in modes:
+        settings.TRANSFER_GROUP_COMMIT = max_delay_ms is not None
+        settings.TRANSFER_GROUP_COMMIT_MAX_DELAY_MS = max_delay_ms or 0
+        for threads in args.threads:
+            result = run(accounts, threads, args.transfers)
+            close_transfer_queue()
+            print(
+                f"{mode:<12} {threads:>7} {result['rps']:>9.1f} "
+                f"{result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f}"
+            )
+    synchronous = settings.DATABASES["default"]["PRAGMAS"].get("synchronous")
+    print(f"synchronous: {synchronous or 'sqlite default'}")
+
+
+if __name__ == "__main__":
+    main()
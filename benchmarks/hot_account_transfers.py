@@ -0,0 +1,88 @@
+"""
+Measure transfers per second into one hot recipient, with and without
+sharded balance counters.
+
+    python -m benchmarks.hot_account_transfers --threads 1 8 32 --transfers 2000
+
+Each thread sends from its own sender accounts to the same merchant, so the
+only shared row is the merchant's. SQLite serializes every writer on the
+database lock, so the gain shows up on backends with row-level locks; on
+SQLite the numbers mostly show the overhead of the shard path.
+"""
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import Timer, setup_django, summarize
+
+
+def seed(senders):
+    from account.models import Account
+
+    Account.objects.bulk_create(
+        [Account(ref="merchant", name="Merchant", balance=0)]
+        + [
+            Account(ref=f"sender-{i}", name=f"Sender {i}", balance=1_000_000)
+            for i in range(senders)
+        ]
+    )
+
+
+def run(threads, transfers, senders):
+    from django.db import connections
+
+    from transaction.models import Transactions
+
+    def worker(index):
+        rng = random.Random(index)
+        latencies = []
+        own = [f"sender-{i}" for i in range(index, senders, threads)]
+        try:
+            for _ in range(transfers // threads):
+                start = time.perf_counter()
+                Transactions.transfer(rng.choice(own), "5.00", "merchant")
+                latencies.append(time.perf_counter() - start)
+        finally:
+            connections.close_all()
+        return latencies
+
+    with Timer() as timer, ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(worker, range(threads)))
+    return summarize([latency for result in results for latency in result], timer.elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--transfers", type=int, default=2000)
+    parser.add_argument("--database", help="SQLite file to use (default: temp file)")
+    args = parser.parse_args()
+
+    setup_django(args.database)
+    from django.conf import settings
+
+    from transaction import models as transaction_models
+    from transaction.shards import compact_shards, mark_hot
+
+    # Lock errors are part of what is being measured, so retry generously.
+    transaction_models.TRANSFER_MAX_ATTEMPTS = 200
+    senders = max(args.threads) * 4
+    seed(senders)
+
+    print(f"{'mode':<8} {'threads':>7} {'tps':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for hot in (False, True):
+        mark_hot(["merchant"], hot=hot)
+        for threads in args.threads:
+            result = run(threads, args.transfers, senders)
+            mode = "sharded" if hot else "single"
+            print(
+                f"{mode:<8} {threads:>7} {result['rps']:>9.1f} "
+                f"{result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f}"
+            )
+    compact_shards()
+    print(f"shards per hot account: {settings.ACCOUNT_BALANCE_SHARDS}")
+
+
+if __name__ == "__main__":
+    main()
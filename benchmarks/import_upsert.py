@@ -0,0 +1,94 @@
+"""
+Compare the account import write path before and after the switch to a
+native upsert.
+
+    python -m benchmarks.import_upsert --rows 10000 100000 1000000
+
+"split" is the old path: an in_bulk read per chunk, bulk_create for new
+refs and bulk_update(["name", "balance"]) for existing ones. "upsert" is
+one bulk_create(update_conflicts=True) statement per chunk. Half of each
+file's refs already exist, so both paths insert and update. Only the
+account writes are timed; the ledger and cache work is the same for both.
+"""
+import argparse
+from decimal import Decimal
+
+from benchmarks.common import Timer, setup_django
+
+
+def batches(rows, chunk_size):
+    for start in range(0, rows, chunk_size):
+        refs = [f"acc-{i}" for i in range(start, min(start + chunk_size, rows))]
+        yield refs, [f"Imported {ref}" for ref in refs], [Decimal("12.34")] * len(refs)
+
+
+def save_split(refs, names, balances, chunk_size):
+    from account.models import Account
+
+    existing = Account.objects.in_bulk(refs, field_name="ref")
+    to_create = []
+    to_update = []
+    for ref, name, balance in zip(refs, names, balances):
+        account = existing.get(ref)
+        if account is None:
+            to_create.append(Account(ref=ref, name=name, balance=balance))
+        else:
+            account.name = name
+            account.balance = balance
+            to_update.append(account)
+    Account.objects.bulk_create(to_create, batch_size=chunk_size)
+    Account.objects.bulk_update(to_update, ["name", "balance"], batch_size=chunk_size)
+
+
+def save_upsert(refs, names, balances, chunk_size):
+    from account.models import Account
+
+    Account.objects.bulk_create(
+        [
+            Account(ref=ref, name=name, balance=balance)
+            for ref, name, balance in zip(refs, names, balances)
+        ],
+        update_conflicts=True,
+        unique_fields=["ref"],
+        update_fields=["name", "balance"],
+        batch_size=chunk_size,
+    )
+
+
+def run(save, rows, chunk_size):
+    from django.db import transaction
+
+    from account.models import Account
+
+    Account.objects.all().delete()
+    Account.objects.bulk_create(
+        (Account(ref=f"acc-{i}", name="Existing", balance=1) for i in range(0, rows, 2)),
+        batch_size=chunk_size,
+    )
+    with Timer() as timer:
+        for refs, names, balances in batches(rows, chunk_size):
+            with transaction.atomic():
+                save(refs, names, balances, chunk_size)
+    assert Account.objects.filter(name="Existing").count() == 0
+    return timer.elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--database", help="SQLite file to use (default: temp file)")
+    args = parser.parse_args()
+
+    setup_django(args.database)
+    from account.views import ImportAccountsView
+
+    chunk_size = ImportAccountsView.chunk_size
+    print(f"{'rows':>9} {'split s':>9} {'upsert s':>9} {'speedup':>8}")
+    for rows in args.rows:
+        split = run(save_split, rows, chunk_size)
+        upsert = run(save_upsert, rows, chunk_size)
+        print(f"{rows:>9} {split:>9.2f} {upsert:>9.2f} {split / upsert:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
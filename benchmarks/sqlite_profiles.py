@@ -0,0 +1,103 @@
+"""
+Compare concurrent transfer throughput and lock errors under the 'default'
+and 'tuned' SQLite database profiles.
+
+    python -m benchmarks.sqlite_profiles --threads 1 8 32 --transfers 2000
+
+Each thread makes random transfers between a pool of accounts and closes
+old connections after every transfer, as the request cycle does. Transfers
+are attempted once, without the usual lock retries, so every "database is
+locked" error is counted. Each profile runs in its own process because the
+database settings cannot be swapped after Django has started.
+"""
+import argparse
+import json
+import random
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import Timer, setup_django
+
+
+def seed(accounts):
+    from account.models import Account
+
+    Account.objects.bulk_create(
+        Account(ref=f"acc-{i}", name=f"Account {i}", balance=1_000_000)
+        for i in range(accounts)
+    )
+
+
+def run(threads, transfers, accounts):
+    from django.core.exceptions import ValidationError
+    from django.db import OperationalError, close_old_connections, connections
+
+    from transaction.models import Transactions
+
+    refs = [f"acc-{i}" for i in range(accounts)]
+
+    def worker(index):
+        rng = random.Random(index)
+        completed = locked = 0
+        try:
+            for _ in range(transfers // threads):
+                sender, recipient = rng.sample(refs, 2)
+                try:
+                    Transactions.transfer(sender, "5.00", recipient)
+                    completed += 1
+                except OperationalError:
+                    locked += 1
+                except ValidationError:
+                    pass
+                close_old_connections()
+        finally:
+            connections.close_all()
+        return completed, locked
+
+    with Timer() as timer, ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(worker, range(threads)))
+    completed = sum(result[0] for result in results)
+    locked = sum(result[1] for result in results)
+    return {"tps": completed / timer.elapsed, "completed": completed, "locked": locked}
+
+
+def run_profile(args):
+    setup_django(database_profile=args.profile)
+    from transaction import models as transaction_models
+
+    transaction_models.TRANSFER_MAX_ATTEMPTS = 1
+    seed(args.accounts)
+    print(json.dumps({threads: run(threads, args.transfers, args.accounts) for threads in args.threads}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--transfers", type=int, default=2000)
+    parser.add_argument("--accounts", type=int, default=100)
+    parser.add_argument("--profile", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.profile:
+        return run_profile(args)
+
+    print(f"{'profile':<8} {'threads':>7} {'tps':>9} {'completed':>9} {'locked':>7}")
+    for profile in ("default", "tuned"):
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.sqlite_profiles", "--profile", profile]
+            + ["--threads", *map(str, args.threads)]
+            + ["--transfers", str(args.transfers), "--accounts", str(args.accounts)],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout
+        for threads, result in json.loads(output.splitlines()[-1]).items():
+            print(
+                f"{profile:<8} {threads:>7} {result['tps']:>9.1f} "
+                f"{result['completed']:>9} {result['locked']:>7}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""
+Run the benchmark suite on seeded synthetic data and write the results as
+JSON, or compare two result files and flag regressions.
+
+    python -m benchmarks.suite run --out baseline.json
+    python -m benchmarks.suite run --out results.json --baseline baseline.json
+    python -m benchmarks.suite compare baseline.json results.json --threshold 0.1
+
+The suite covers Transactions.transfer throughput (one thread and several),
+AccountListView and AccountDetailsView latency and query counts, and
+ImportAccountsView rows per second and peak traced memory. Every run uses a
+fresh temporary database seeded from --seed, so results from different
+commits are comparable on the same machine. compare exits with status 1
+when a metric is worse than the baseline by more than the threshold; query
+counts may not grow at all.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from benchmarks import datagen
+from benchmarks.common import BASE_DIR, Timer, percentile, setup_django, summarize
+
+HIGHER_IS_BETTER = {"tps", "rows_per_s"}
+EXACT_METRICS = {"queries"}
+
+
+def latency_metrics(latencies, elapsed):
+    summary = summarize(latencies, elapsed)
+    return {
+        "tps": round(summary["rps"], 1),
+        "p50_ms": round(summary["p50_ms"], 2),
+        "p99_ms": round(summary["p99_ms"], 2),
+    }
+
+
+def bench_transfer_single(pairs):
+    from transaction.models import Transactions
+
+    latencies = []
+    with Timer() as timer:
+        for sender, recipient in pairs:
+            start = time.perf_counter()
+            Transactions.transfer(
+                datagen.account_ref(sender), "5.00", datagen.account_ref(recipient)
+            )
+            latencies.append(time.perf_counter() - start)
+    return latency_metrics(latencies, timer.elapsed)
+
+
+def bench_transfer_concurrent(pairs, threads):
+    from django.db import connections
+
+    from transaction.models import Transactions
+
+    def worker(index):
+        latencies = []
+        try:
+            for sender, recipient in pairs[index::threads]:
+                start = time.perf_counter()
+                Transactions.transfer(
+                    datagen.account_ref(sender), "5.00", datagen.account_ref(recipient)
+                )
+                latencies.append(time.perf_counter() - start)
+        finally:
+            connections.close_all()
+        return latencies
+
+    with Timer() as timer, ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(worker, range(threads)))
+    latencies = [latency for result in results for latency in result]
+    metrics = latency_metrics(latencies, timer.elapsed)
+    metrics["threads"] = threads
+    return metrics
+
+
+def bench_page(client, urls):
+    # Page latency with the account cache cleared before every request, so
+    # each one renders from the database. Queries come from the
+    # X-Query-Count header of the metrics middleware.
+    from account.cache import account_cache
+
+    latencies = []
+    queries = 0
+    for url in urls:
+        account_cache().clear()
+        start = time.perf_counter()
+        response = client.get(url)
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200, (url, response.status_code)
+        queries = max(queries, int(response["X-Query-Count"]))
+    return {
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "queries": queries,
+    }
+
+
+def bench_import(client, rows, seed):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.urls import reverse
+
+    from account.models import ImportJob
+
+    handle, path = tempfile.mkstemp(prefix="bench-import-", suffix=".csv")
+    os.close(handle)
+    try:
+        datagen.write_accounts_csv(path, rows=rows, seed=seed)
+        with open(path, "rb") as csv_file:
+            content = csv_file.read()
+    finally:
+        os.remove(path)
+
+    def post():
+        upload = SimpleUploadedFile("accounts.csv", content, content_type="text/csv")
+        response = client.post(reverse("import-accounts"), {"data_file": upload})
+        assert response.status_code == 302, response.status_code
+        assert ImportJob.objects.latest("pk").rows_processed == rows
+
+    # Timed and traced separately: tracemalloc slows allocation-heavy code.
+    with Timer() as timer:
+        post()
+    tracemalloc.start()
+    try:
+        post()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        "rows_per_s": round(rows / timer.elapsed, 1),
+        "peak_mb": round(peak / (1024 * 1024), 2),
+    }
+
+
+def run_suite(args):
+    setup_django(database_profile=args.profile)
+    from django.conf import settings
+    from django.test import Client
+    from django.urls import reverse
+
+    from account.models import Account
+
+    settings.ACCOUNT_IMPORT_WORKERS = 0
+    logging.getLogger("account_transfer.requests").setLevel(logging.WARNING)
+    client = Client()
+    results = {}
+
+    def record(name, metrics):
+        results[name] = metrics
+        print(f"{name:<20} {json.dumps(metrics)}", file=sys.stderr)
+
+    account_ids = datagen.seed_accounts(args.accounts)
+    history = datagen.transfer_pairs(args.accounts, args.history, seed=args.seed)
+    datagen.seed_history(account_ids, history)
+    pairs = datagen.transfer_pairs(
+        args.accounts, args.transfers * 2, seed=args.seed + 1
+    )
+
+    record("transfer_single", bench_transfer_single(pairs[: args.transfers]))
+    record(
+        "transfer_concurrent",
+        bench_transfer_concurrent(pairs[args.transfers :], args.threads),
+    )
+
+    # List pages at seeded cursors spread over the whole table.
+    rng = random.Random(args.seed)
+    ids = sorted(account_ids.values())
+    list_url = reverse("account-list")
+    list_urls = [f"{list_url}?after={rng.choice(ids)}" for _ in range(args.requests)]
+    record("account_list", bench_page(client, list_urls))
+
+    hot = Account.objects.get(ref=datagen.account_ref(datagen.hottest(history)))
+    details_url = reverse("account-details", args=[hot.pk])
+    record("account_details", bench_page(client, [details_url] * args.requests))
+
+    record("import_accounts", bench_import(client, args.import_rows, args.seed))
+
+    return {
+        "meta": {
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "params": {
+                key: value
+                for key, value in vars(args).items()
+                if key not in ("command", "out", "baseline", "threshold")
+            },
+        },
+        "results": results,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, threshold):
+    # Returns (rows, regressions). A metric regresses when it is worse than
+    # the baseline by more than threshold, relative to the baseline; exact
+    # metrics regress on any increase.
+    rows = []
+    regressions = []
+    for name, metrics in current["results"].items():
+        for metric, value in metrics.items():
+            base = baseline["results"].get(name, {}).get(metric)
+            if base is None or metric == "threads":
+                continue
+            change = (value - base) / base if base else 0.0
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            allowed = 0 if metric in EXACT_METRICS else threshold
+            regressed = worse > allowed
+            rows.append((f"{name}.{metric}", base, value, change, regressed))
+            if regressed:
+                regressions.append(f"{name}.{metric}")
+    return rows, regressions
+
+
+def print_comparison(baseline, current, threshold):
+    rows, regressions = compare(baseline, current, threshold)
+    print(f"{'metric':<32} {'baseline':>12} {'current':>12} {'change':>8}")
+    for metric, base, value, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{metric:<32} {base:>12} {value:>12} {change:>+8.1%}{flag}")
+    if regressions:
+        print(f"{len(regressions)} regression(s) beyond {threshold:.0%}.")
+    return not regressions
+
+
+def load(path):
+    with open(path) as results_file:
+        return json.load(results_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the suite.")
+    run_parser.add_argument("--out", default="benchmark-results.json")
+    run_parser.add_argument("--baseline", help="Results to compare against.")
+    run_parser.add_argument("--threshold", type=float, default=0.1)
+    run_parser.add_argument("--seed", type=int, default=datagen.DEFAULT_SEED)
+    run_parser.add_argument("--profile", help="Database profile from settings.")
+    run_parser.add_argument("--accounts", type=int, default=10_000)
+    run_parser.add_argument("--history", type=int, default=50_000)
+    run_parser.add_argument("--transfers", type=int, default=1000)
+    run_parser.add_argument("--threads", type=int, default=8)
+    run_parser.add_argument("--requests", type=int, default=200)
+    run_parser.add_argument("--import-rows", type=int, default=20_000)
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files.")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        ok = print_comparison(load(args.baseline), load(args.current), args.threshold)
+        sys.exit(0 if ok else 1)
+
+    results = run_suite(args)
+    with open(args.out, "w") as results_file:
+        json.dump(results, results_file, indent=2)
+        results_file.write("\n")
+    print(f"Wrote {args.out}.")
+    if args.baseline:
+        ok = print_comparison(load(args.baseline), results, args.threshold)
+        sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 from django.contrib import admin
 
-from transaction.models import  Transactions
+from transaction.models import  ArchivedTransaction, Transactions
 
 admin.site.register(Transactions)
+admin.site.register(ArchivedTransaction)
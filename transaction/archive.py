@@ -0,0 +1,68 @@
+from account.models import Account
+from account_transfer.db import atomic_immediate
+
+from .models import AccountArchiveSummary, ArchivedTransaction, Transactions
+
+
+def archive_transactions(older_than, batch_size=1000, on_batch=None):
+    # Moves transactions created before older_than into ArchivedTransaction,
+    # oldest first, batch_size rows per transaction. Each batch moves its
+    # rows and adds them to the accounts' carry-forward totals atomically,
+    # so an interrupted run leaves nothing half done and the next run picks
+    # up from the oldest row still in the hot table. Idempotency keys of the
+    # moved transfers are deleted with them; the caller keeps older_than
+    # past their time to live.
+    archived = 0
+    while True:
+        with atomic_immediate():
+            rows = list(
+                Transactions.objects.filter(created__lt=older_than)
+                .order_by("created", "id")
+                .values("id", "sender_id", "recipient_id", "amount", "created")[
+                    :batch_size
+                ]
+            )
+            if not rows:
+                return archived
+            moved = [ArchivedTransaction(**row) for row in rows]
+            # Rebuilds lock accounts before reading the carry-forward and
+            # the hot table, so they never see a row in neither place.
+            account_ids = {row.sender_id for row in moved}
+            account_ids.update(row.recipient_id for row in moved)
+            list(
+                Account.objects.select_for_update()
+                .filter(id__in=account_ids)
+                .order_by("id")
+                .values_list("id", flat=True)
+            )
+            ArchivedTransaction.objects.bulk_create(moved)
+            AccountArchiveSummary.record_many(moved)
+            Transactions.objects.filter(id__in=[row.id for row in moved]).delete()
+        archived += len(moved)
+        if on_batch:
+            on_batch(archived)
+
+
+def history_page(account, cursor, limit, fields=None, archived=True):
+    # Up to limit rows of history from the cursor on, newest first. Every
+    # archived row is older than every hot row, so the archive is only read
+    # once the hot table runs out, with the same cursor. archived=False
+    # skips it for accounts known to have nothing archived.
+    rows = list(Transactions.history(account, cursor, fields)[:limit])
+    if archived and len(rows) < limit:
+        rows += ArchivedTransaction.history(account, cursor, fields)[
+            : limit - len(rows)
+        ]
+    return rows
+
+
+async def ahistory_page(account, cursor, limit, fields=None, archived=True):
+    rows = [row async for row in Transactions.history(account, cursor, fields)[:limit]]
+    if archived and len(rows) < limit:
+        rows += [
+            row
+            async for row in ArchivedTransaction.history(account, cursor, fields)[
+                : limit - len(rows)
+            ]
+        ]
+    return rows
@@ -1,15 +1,12 @@
 from django import forms
+from django.core.exceptions import ValidationError
 
-from .validators import check_recipient_exists, check_sender_exists
+from .validators import check_accounts_exist
 
 
 class TransactionForm(forms.Form):
-    sender = forms.CharField(
-        required=True, help_text="Sender ID", validators=[check_sender_exists]
-    )
-    recipient = forms.CharField(
-        required=True, help_text="Recipient ID", validators=[check_recipient_exists]
-    )
+    sender = forms.CharField(required=True, help_text="Sender ID")
+    recipient = forms.CharField(required=True, help_text="Recipient ID")
     amount = forms.DecimalField(
         decimal_places=2,
         min_value=5.00,
@@ -17,3 +14,47 @@ class TransactionForm(forms.Form):
         required=True,
         max_digits=20,
     )
+    idempotency_key = forms.CharField(
+        required=False, max_length=255, widget=forms.HiddenInput
+    )
+
+    def __init__(self, *args, accounts=None, idempotency_header=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.accounts = accounts
+        self.idempotency_header = idempotency_header
+
+    def clean_idempotency_key(self):
+        # An Idempotency-Key header takes precedence over the form field and
+        # is held to the same limit.
+        key = self.idempotency_header
+        if key is None:
+            return self.cleaned_data["idempotency_key"]
+        if not key.strip():
+            raise ValidationError("The Idempotency-Key header cannot be blank.")
+        max_length = self.fields["idempotency_key"].max_length
+        if len(key) > max_length:
+            raise ValidationError(
+                f"The Idempotency-Key header must be at most {max_length} characters."
+            )
+        return key
+
+    def clean(self):
+        cleaned_data = super().clean()
+        sender_ref = cleaned_data.get("sender")
+        recipient_ref = cleaned_data.get("recipient")
+
+        if sender_ref and sender_ref == recipient_ref:
+            raise ValidationError("Sender and recipient cannot be the same.")
+
+        # Both accounts are resolved with a single query and handed to the
+        # transfer, so it does not have to look them up again.
+        sender, recipient = check_accounts_exist(
+            sender_ref, recipient_ref, accounts=self.accounts
+        )
+        cleaned_data["sender_account"] = sender
+        cleaned_data["recipient_account"] = recipient
+        return cleaned_data
+
+
+class BulkTransferForm(forms.Form):
+    data_file = forms.FileField(help_text="CSV with Sender, Recipient and Amount columns")
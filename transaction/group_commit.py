@@ -0,0 +1,181 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, OperationalError, close_old_connections
+from django.db import connection, connections, transaction
+
+from account_transfer.db import atomic_immediate
+
+from .models import Transactions, TransferIdempotencyKey, run_with_retry
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+@dataclass
+class PendingTransfer:
+    sender: object
+    recipient: object
+    amount: Decimal
+    idempotency_key: str = None
+    future: Future = field(default_factory=Future)
+
+    @property
+    def replay_args(self):
+        return self.idempotency_key, self.sender.ref, self.recipient.ref, self.amount
+
+
+class TransferQueue:
+    # Group commit for single transfers. Callers block on a future while one
+    # committer thread applies everything queued within max_delay seconds of
+    # the first waiting transfer, up to max_batch transfers, in a single
+    # transaction. Each transfer runs in its own savepoint, so a rejected
+    # one is rolled back alone, and futures are resolved after the commit.
+
+    def __init__(self, max_batch, max_delay):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._items = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, sender, recipient, amount, idempotency_key=None):
+        pending = PendingTransfer(sender, recipient, amount, idempotency_key)
+        with self._lock:
+            # Also replaces a committer that died, so nothing queued after
+            # it waits forever.
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="transfer-committer", daemon=True
+                )
+                self._thread.start()
+            self._items.put(pending)
+        return pending.future
+
+    def close(self):
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread and thread.is_alive():
+                self._items.put(None)
+        if thread:
+            thread.join()
+
+    def _run(self):
+        try:
+            while True:
+                batch = self._next_batch()
+                # None is close()'s stop marker and always ends a batch.
+                stopping = batch[-1] is None
+                if stopping:
+                    batch.pop()
+                if batch:
+                    try:
+                        close_old_connections()
+                        self._commit(batch)
+                    except Exception as e:
+                        # Fails this batch only; the committer keeps going.
+                        for pending in batch:
+                            if not pending.future.done():
+                                pending.future.set_exception(e)
+                if stopping:
+                    return
+        finally:
+            connections.close_all()
+
+    def _next_batch(self):
+        batch = [self._items.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch and batch[-1] is not None:
+            timeout = max(0, deadline - time.monotonic())
+            try:
+                batch.append(self._items.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _commit(self, batch):
+        try:
+            outcomes = run_with_retry(lambda: self._apply(batch))
+        except Exception as e:
+            for pending in batch:
+                pending.future.set_exception(e)
+            return
+        for pending, (ledger_row, error) in zip(batch, outcomes):
+            if error:
+                pending.future.set_exception(error)
+            else:
+                pending.future.set_result(ledger_row)
+
+    def _apply(self, batch):
+        with atomic_immediate():
+            return [self._apply_transfer(pending) for pending in batch]
+
+    def _apply_transfer(self, pending):
+        # Returns (ledger_row, error). Lock errors fail the whole batch, so
+        # run_with_retry can retry it.
+        def apply():
+            return Transactions._apply_transfer(
+                pending.sender, pending.recipient, pending.amount
+            )
+
+        try:
+            with transaction.atomic():
+                return Transactions._apply_once(apply, *pending.replay_args), None
+        except OperationalError:
+            raise
+        except IntegrityError as e:
+            # An earlier transfer in this batch used the same key.
+            try:
+                stored = pending.idempotency_key and TransferIdempotencyKey.replay(
+                    *pending.replay_args
+                )
+            except ValidationError as error:
+                return None, error
+            return (stored, None) if stored else (None, e)
+        except Exception as e:
+            return None, e
+
+
+def get_transfer_queue():
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = TransferQueue(
+                max_batch=settings.TRANSFER_GROUP_COMMIT_MAX_BATCH,
+                max_delay=settings.TRANSFER_GROUP_COMMIT_MAX_DELAY_MS / 1000,
+            )
+    return _queue
+
+
+def close_transfer_queue():
+    global _queue
+    with _queue_lock:
+        transfer_queue, _queue = _queue, None
+    if transfer_queue:
+        transfer_queue.close()
+
+
+def submit_transfer(sender, recipient, transaction_amount, idempotency_key=None):
+    # Transactions.transfer_between through the group commit queue when
+    # TRANSFER_GROUP_COMMIT is on. A caller already inside a transaction
+    # transfers directly, since the committer cannot join that transaction.
+    # A transfer that times out may still be committed later, so callers
+    # should retry it with the same idempotency key.
+    if not settings.TRANSFER_GROUP_COMMIT or connection.in_atomic_block:
+        return Transactions.transfer_between(
+            sender, recipient, transaction_amount, idempotency_key=idempotency_key
+        )
+    amount = Decimal(str(transaction_amount))
+    future = get_transfer_queue().submit(sender, recipient, amount, idempotency_key)
+    try:
+        return future.result(timeout=settings.TRANSFER_GROUP_COMMIT_TIMEOUT_SECONDS)
+    except TimeoutError:
+        raise TimeoutError(
+            "The transfer was not committed in time and may still complete."
+        )
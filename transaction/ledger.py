@@ -0,0 +1,139 @@
+from decimal import Decimal
+
+from django.db.models import Count, Max, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from account.models import Account, AccountBalanceShard
+from account_transfer.db import atomic_immediate
+
+from .models import BalanceSnapshot, LedgerEntry, run_with_retry
+from .summary import iter_account_id_batches
+
+
+def balance_at(account_id, when=None):
+    # Latest snapshot taken at or before `when`, plus the entries posted
+    # after it. Snapshots keep the tail short, so this never replays the
+    # whole ledger.
+    snapshots = BalanceSnapshot.objects.filter(account_id=account_id)
+    entries = LedgerEntry.objects.filter(account_id=account_id)
+    if when is not None:
+        snapshots = snapshots.filter(as_of__lte=when)
+        entries = entries.filter(created__lte=when)
+    snapshot = snapshots.order_by("-as_of", "-last_entry_id").first()
+    if snapshot:
+        entries = entries.filter(id__gt=snapshot.last_entry_id)
+    tail = entries.aggregate(total=Sum("amount"))["total"] or Decimal("0")
+    balance = (snapshot.balance if snapshot else Decimal("0")) + tail
+    return balance.quantize(Decimal("0.01"))
+
+
+def latest_snapshots(account_ids):
+    latest = (
+        BalanceSnapshot.objects.filter(account_id__in=account_ids)
+        .values("account_id")
+        .annotate(last=Max("last_entry_id"))
+        .values("last")
+    )
+    return {
+        snapshot.account_id: snapshot
+        for snapshot in BalanceSnapshot.objects.filter(last_entry_id__in=latest)
+    }
+
+
+def ledger_balances(account_ids):
+    # Returns {account_id: (balance, tail_count, last_entry_id, as_of)} for
+    # a batch of accounts in two queries: the latest snapshots, then one
+    # GROUP BY over each account's entries after its own snapshot.
+    snapshots = latest_snapshots(account_ids)
+    watermark = Coalesce(
+        Subquery(
+            BalanceSnapshot.objects.filter(account_id=OuterRef("account_id"))
+            .order_by("-last_entry_id")
+            .values("last_entry_id")[:1]
+        ),
+        0,
+    )
+    tails = (
+        LedgerEntry.objects.filter(account_id__in=account_ids)
+        .filter(id__gt=watermark)
+        .values("account_id")
+        .annotate(
+            total=Sum("amount"),
+            count=Count("id"),
+            last_id=Max("id"),
+            as_of=Max("created"),
+        )
+        .order_by()
+    )
+    balances = {}
+    for account_id in account_ids:
+        snapshot = snapshots.get(account_id)
+        balances[account_id] = (
+            snapshot.balance if snapshot else Decimal("0"),
+            0,
+            snapshot.last_entry_id if snapshot else None,
+            snapshot.as_of if snapshot else None,
+        )
+    for row in tails:
+        balance = balances[row["account_id"]][0]
+        balances[row["account_id"]] = (
+            balance + row["total"],
+            row["count"],
+            row["last_id"],
+            row["as_of"],
+        )
+    return balances
+
+
+def take_snapshots(min_entries=100, batch_size=500):
+    # Snapshots every account with at least min_entries entries since its
+    # previous snapshot. Locking the batch's accounts holds back transfers
+    # and imports to them, so no entry can commit below the new watermark.
+    taken = 0
+    for account_ids in iter_account_id_batches(batch_size):
+        taken += run_with_retry(lambda: _snapshot_batch(account_ids, min_entries))
+    return taken
+
+
+def _snapshot_batch(account_ids, min_entries):
+    with atomic_immediate():
+        list(
+            Account.objects.select_for_update()
+            .filter(id__in=account_ids)
+            .values_list("id", flat=True)
+        )
+        # A hot account's credits post its entries under a shard's row lock
+        # rather than the account's, so its shards are locked too.
+        list(
+            AccountBalanceShard.objects.select_for_update()
+            .filter(account_id__in=account_ids)
+            .order_by("pk")
+            .values_list("pk", flat=True)
+        )
+        snapshots = [
+            BalanceSnapshot(
+                account_id=account_id,
+                balance=balance,
+                last_entry_id=last_entry_id,
+                as_of=as_of,
+            )
+            for account_id, (balance, count, last_entry_id, as_of) in ledger_balances(
+                account_ids
+            ).items()
+            if count and count >= min_entries
+        ]
+        BalanceSnapshot.objects.bulk_create(snapshots)
+    return len(snapshots)
+
+
+def find_balance_mismatches(batch_size=500):
+    for account_ids in iter_account_id_batches(batch_size):
+        balances = dict(
+            Account.objects.filter(id__in=account_ids).values_list("id", "balance")
+        )
+        ledger = ledger_balances(list(balances))
+        for account_id, shard_total in AccountBalanceShard.totals(list(balances)).items():
+            balances[account_id] += shard_total
+        for account_id, balance in balances.items():
+            if Decimal(balance) != ledger[account_id][0]:
+                yield account_id, balance, ledger[account_id][0]
@@ -0,0 +1,53 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from transaction.archive import archive_transactions
+
+
+class Command(BaseCommand):
+    help = (
+        "Move transactions older than --older-than-days into the archive table, in"
+        " batches. Safe to interrupt and run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days",
+            type=int,
+            default=settings.TRANSACTION_ARCHIVE_AFTER_DAYS,
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--pause-ms",
+            type=int,
+            default=0,
+            help="Sleep between batches to leave the database to other writers.",
+        )
+
+    def handle(self, *args, **options):
+        max_age = timedelta(days=options["older_than_days"])
+        # Archiving deletes the transfers' idempotency keys, so a key still
+        # within its time to live must keep its transfer in the hot table.
+        if max_age < timedelta(hours=settings.TRANSFER_IDEMPOTENCY_KEY_TTL_HOURS):
+            raise CommandError(
+                "--older-than-days must cover TRANSFER_IDEMPOTENCY_KEY_TTL_HOURS."
+            )
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1.")
+
+        def on_batch(archived):
+            if options["verbosity"] > 1:
+                self.stdout.write(f"Archived {archived} transactions so far.")
+            if options["pause_ms"]:
+                time.sleep(options["pause_ms"] / 1000)
+
+        archived = archive_transactions(
+            timezone.now() - max_age,
+            batch_size=options["batch_size"],
+            on_batch=on_batch,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} transactions."))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from transaction.ledger import find_balance_mismatches
+
+
+class Command(BaseCommand):
+    help = "Compare account balances with the ledger entries."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        mismatches = 0
+        for account_id, balance, ledger_balance in find_balance_mismatches(
+            batch_size=options["batch_size"]
+        ):
+            mismatches += 1
+            self.stdout.write(
+                f"Account {account_id}: stored {balance}, ledger {ledger_balance}"
+            )
+        if mismatches:
+            raise CommandError(f"{mismatches} account balances do not match the ledger.")
+        self.stdout.write(self.style.SUCCESS("All account balances match the ledger."))
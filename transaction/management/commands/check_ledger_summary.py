@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from transaction.summary import find_summary_mismatches
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare account ledger summaries with the transactions table and the"
+        " archive carry-forward."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        mismatches = 0
+        for account_id, differences in find_summary_mismatches(
+            batch_size=options["batch_size"]
+        ):
+            mismatches += 1
+            details = ", ".join(
+                f"{field}: stored {stored}, ledger {expected}"
+                for field, (stored, expected) in differences.items()
+            )
+            self.stdout.write(f"Account {account_id}: {details}")
+        if mismatches:
+            raise CommandError(f"{mismatches} account summaries do not match the ledger.")
+        self.stdout.write(self.style.SUCCESS("All account summaries match the ledger."))
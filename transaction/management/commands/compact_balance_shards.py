@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from transaction.shards import compact_shards
+
+
+class Command(BaseCommand):
+    help = "Fold sharded hot-account credits back into account balances."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        compacted = compact_shards(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Compacted {compacted} accounts."))
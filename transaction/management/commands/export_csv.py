@@ -0,0 +1,46 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from account.export import CHUNK_SIZE, export_accounts, export_transactions, gzip_chunks
+from account.models import Account
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream accounts, or one account's transactions, as CSV. The accounts "
+        "file can be imported back with the account import."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("table", choices=["accounts", "transactions"])
+        parser.add_argument("--account", help="Account ref, for transactions.")
+        parser.add_argument("--output", "-o", help="File to write (default: stdout).")
+        parser.add_argument("--gzip", action="store_true")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        if options["table"] == "accounts":
+            chunks = export_accounts(chunk_size)
+        else:
+            if not options["account"]:
+                raise CommandError("--account is required to export transactions.")
+            try:
+                account = Account.objects.get(ref=options["account"])
+            except Account.DoesNotExist:
+                raise CommandError(f"Account {options['account']} does not exist.")
+            chunks = export_transactions(account, chunk_size)
+
+        if options["gzip"]:
+            chunks = gzip_chunks(chunks)
+        else:
+            chunks = (chunk.encode("utf-8") for chunk in chunks)
+
+        output = open(options["output"], "wb") if options["output"] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options["output"]:
+                output.close()
@@ -0,0 +1,88 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from account.bulk_import import PART_SIZE, create_file_import, run_file_import
+from account.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Import accounts from a CSV file on this server. The file is split into "
+        "parts parsed by a process pool and saved in order, one transaction per "
+        "part; a failed or interrupted import can be continued with --resume."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--part-size", type=int, default=PART_SIZE)
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--resume", type=int, metavar="JOB_ID")
+
+    def handle(self, *args, **options):
+        self.verbosity = options["verbosity"]
+        path = os.path.abspath(options["path"])
+        if not os.path.isfile(path):
+            raise CommandError(f"{path} does not exist.")
+        if not path.endswith(".csv"):
+            raise CommandError("The file is not a CSV file.")
+        size = os.path.getsize(path)
+        if not size:
+            raise CommandError("The file is empty.")
+
+        if options["resume"]:
+            job = self._get_resumable_job(options["resume"], path, size)
+            self.stdout.write(
+                f"Resuming import #{job.pk} after {job.parts_committed} parts."
+            )
+        else:
+            job = create_file_import(path, size, options["part_size"])
+            self.stdout.write(f"Started import #{job.pk}.")
+
+        job = run_file_import(
+            job,
+            workers=options["workers"],
+            batch_size=options["batch_size"],
+            on_progress=self._report_progress,
+        )
+        if job.status == ImportJob.FAILED:
+            raise CommandError(
+                f"{' '.join(job.errors)} Import #{job.pk} saved {job.rows_processed} "
+                f"rows before stopping; --resume {job.pk} continues after them."
+            )
+        if job.rows_skipped:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"Skipped {job.rows_skipped} rows with missing fields."
+                )
+            )
+        if job.rows_duplicate:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"Skipped {job.rows_duplicate} rows whose ID appeared "
+                    "earlier in the file."
+                )
+            )
+        self.stdout.write(
+            self.style.SUCCESS(f"Imported {job.rows_processed} accounts.")
+        )
+
+    def _get_resumable_job(self, job_id, path, size):
+        try:
+            job = ImportJob.objects.get(pk=job_id)
+        except ImportJob.DoesNotExist:
+            raise CommandError(f"Import #{job_id} does not exist.")
+        if job.source_path != path:
+            raise CommandError(f"Import #{job_id} was started for {job.source_path}.")
+        if job.source_size != size:
+            raise CommandError(f"{path} has changed since import #{job_id} started.")
+        if job.status == ImportJob.COMPLETED:
+            raise CommandError(f"Import #{job_id} has already completed.")
+        return job
+
+    def _report_progress(self, job):
+        if self.verbosity >= 2:
+            self.stdout.write(
+                f"Saved part {job.parts_committed}: {job.rows_processed} rows."
+            )
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from account.models import Account
+from transaction.shards import mark_hot
+
+
+class Command(BaseCommand):
+    help = "Mark accounts as hot so single transfers credit sharded balances."
+
+    def add_arguments(self, parser):
+        parser.add_argument("refs", nargs="+")
+        parser.add_argument(
+            "--unmark",
+            action="store_true",
+            help="Credit the account rows again. Run compact_balance_shards afterwards.",
+        )
+
+    def handle(self, *args, **options):
+        known = Account.objects.filter(ref__in=options["refs"]).values_list("ref", flat=True)
+        missing = set(options["refs"]) - set(known)
+        if missing:
+            raise CommandError(f"Unknown account references: {', '.join(sorted(missing))}")
+        accounts = mark_hot(options["refs"], hot=not options["unmark"])
+        state = "not hot" if options["unmark"] else "hot"
+        self.stdout.write(self.style.SUCCESS(f"Marked {len(accounts)} accounts {state}."))
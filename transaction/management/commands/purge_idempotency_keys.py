@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from transaction.models import TransferIdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Delete transfer idempotency keys older than their time to live."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-age-hours",
+            type=int,
+            default=settings.TRANSFER_IDEMPOTENCY_KEY_TTL_HOURS,
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options["max_age_hours"])
+        purged = TransferIdempotencyKey.purge(cutoff, batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} idempotency keys."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from transaction.summary import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild every account ledger summary from the transactions table and the"
+        " archive carry-forward."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        rebuilt = rebuild_summaries(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt summaries for {rebuilt} accounts."))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from transaction.ledger import take_snapshots
+
+
+class Command(BaseCommand):
+    help = "Snapshot account balances that have enough new ledger entries."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--min-entries", type=int, default=100)
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        taken = take_snapshots(
+            min_entries=options["min_entries"], batch_size=options["batch_size"]
+        )
+        self.stdout.write(self.style.SUCCESS(f"Took {taken} balance snapshots."))
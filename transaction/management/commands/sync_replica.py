@@ -0,0 +1,38 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from account_transfer.replica import replica_alias
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the primary SQLite database into the replica file, for local "
+        "runs with DATABASE_REPLICA_NAME set."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=1024)
+
+    def handle(self, *args, **options):
+        alias = replica_alias()
+        if alias is None:
+            raise CommandError("No replica is configured; set DATABASE_REPLICA_NAME.")
+        primary = connections[DEFAULT_DB_ALIAS]
+        replica_name = settings.DATABASES[alias]["NAME"]
+        if primary.vendor != "sqlite":
+            raise CommandError("sync_replica only copies SQLite databases.")
+        if str(replica_name) == str(primary.settings_dict["NAME"]):
+            raise CommandError("The replica and the primary are the same file.")
+
+        # The online backup copies a consistent snapshot page by page while
+        # the primary keeps accepting writes.
+        primary.ensure_connection()
+        target = sqlite3.connect(replica_name)
+        try:
+            primary.connection.backup(target, pages=options["pages"])
+        finally:
+            target.close()
+        self.stdout.write(self.style.SUCCESS(f"Copied the primary into {replica_name}."))
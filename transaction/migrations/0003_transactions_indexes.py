@@ -0,0 +1,37 @@
+# Generated by Django 4.2.14 on 2026-10-18 01:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0004_account_name_idx'),
+        ('transaction', '0002_transactions_created'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transactions',
+            name='recipient',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='received_transactions', to='account.account'),
+        ),
+        migrations.AlterField(
+            model_name='transactions',
+            name='sender',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='sent_transactions', to='account.account'),
+        ),
+        migrations.AddIndex(
+            model_name='transactions',
+            index=models.Index(fields=['sender', '-created', '-id'], name='txn_sender_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactions',
+            index=models.Index(fields=['recipient', '-created', '-id'], name='txn_recipient_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactions',
+            index=models.Index(fields=['created'], name='txn_created_idx'),
+        ),
+    ]
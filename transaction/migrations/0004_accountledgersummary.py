@@ -0,0 +1,25 @@
+# Generated by Django 4.2.14 on 2026-10-18 01:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0004_account_name_idx'),
+        ('transaction', '0003_transactions_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountLedgerSummary',
+            fields=[
+                ('account', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ledger_summary', serialize=False, to='account.account')),
+                ('total_sent', models.DecimalField(decimal_places=2, default=0, max_digits=100)),
+                ('total_received', models.DecimalField(decimal_places=2, default=0, max_digits=100)),
+                ('transaction_count', models.PositiveBigIntegerField(default=0)),
+                ('last_activity', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
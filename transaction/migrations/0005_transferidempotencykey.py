@@ -0,0 +1,24 @@
+# Generated by Django 4.2.14 on 2026-10-18 01:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transaction', '0004_accountledgersummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransferIdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('created', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_keys', to='transaction.transactions')),
+            ],
+        ),
+    ]
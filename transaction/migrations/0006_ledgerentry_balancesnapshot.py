@@ -0,0 +1,44 @@
+# Generated by Django 4.2.14 on 2026-10-18 01:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0004_account_name_idx'),
+        ('transaction', '0005_transferidempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=100)),
+                ('kind', models.CharField(choices=[('transfer', 'Transfer'), ('import', 'Import'), ('opening', 'Opening balance')], max_length=20)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('account', models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='account.account')),
+                ('transfer', models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='ledger_entries', to='transaction.transactions')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account', 'id'], name='ledger_account_entry_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=100)),
+                ('last_entry_id', models.PositiveBigIntegerField()),
+                ('as_of', models.DateTimeField()),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('account', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='balance_snapshots', to='account.account')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['account', '-as_of', '-last_entry_id'], name='snapshot_account_as_of_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+from django.utils import timezone
+
+
+def post_opening_balances(apps, schema_editor):
+    # Existing balances predate the ledger, so each account opens with one
+    # entry for its current balance, balanced against the external side.
+    Account = apps.get_model("account", "Account")
+    LedgerEntry = apps.get_model("transaction", "LedgerEntry")
+    now = timezone.now()
+    entries = []
+    for account_id, balance in (
+        Account.objects.exclude(balance=0).values_list("id", "balance").iterator()
+    ):
+        entries.append(
+            LedgerEntry(account_id=account_id, amount=balance, kind="opening", created=now)
+        )
+        entries.append(
+            LedgerEntry(account_id=None, amount=-balance, kind="opening", created=now)
+        )
+        if len(entries) >= 1000:
+            LedgerEntry.objects.bulk_create(entries)
+            entries = []
+    LedgerEntry.objects.bulk_create(entries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0004_account_name_idx"),
+        ("transaction", "0006_ledgerentry_balancesnapshot"),
+    ]
+
+    operations = [
+        migrations.RunPython(post_opening_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.14 on 2026-10-18 02:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import transaction.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0007_importjob_checkpoint'),
+        ('transaction', '0007_opening_ledger_entries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountArchiveSummary',
+            fields=[
+                ('total_sent', models.DecimalField(decimal_places=2, default=0, max_digits=100)),
+                ('total_received', models.DecimalField(decimal_places=2, default=0, max_digits=100)),
+                ('transaction_count', models.PositiveBigIntegerField(default=0)),
+                ('last_activity', models.DateTimeField(blank=True, null=True)),
+                ('account', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='archive_summary', serialize=False, to='account.account')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedTransaction',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=100)),
+                ('created', models.DateTimeField()),
+                ('archived', models.DateTimeField(default=django.utils.timezone.now)),
+                ('recipient', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_received_transactions', to='account.account')),
+                ('sender', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_sent_transactions', to='account.account')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['sender', '-created', '-id'], name='archive_sender_created_idx'), models.Index(fields=['recipient', '-created', '-id'], name='archive_recipient_created_idx')],
+            },
+            bases=(transaction.models.TransferHistory, models.Model),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.14 on 2026-10-18 02:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0007_importjob_checkpoint'),
+        ('transaction', '0008_archivedtransaction'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='account',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='ledger_entries', to='account.account'),
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='kind',
+            field=models.CharField(choices=[('transfer', 'Transfer'), ('import', 'Import'), ('opening', 'Opening balance'), ('adjustment', 'Manual adjustment')], max_length=20),
+        ),
+    ]
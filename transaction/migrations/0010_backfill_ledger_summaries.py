@@ -0,0 +1,91 @@
+from django.db import migrations
+from django.db.models import Count, Max, Sum
+
+BATCH_SIZE = 1000
+
+
+def backfill_ledger_summaries(apps, schema_editor):
+    # Summaries were only kept from 0004 on, so accounts with older
+    # transfers undercount. Rebuilds every summary from the archive
+    # carry-forward plus the hot table, as rebuild_ledger_summary does.
+    # Credits still on balance shards are left out, since folding the
+    # shards adds them to the summary.
+    Account = apps.get_model("account", "Account")
+    AccountBalanceShard = apps.get_model("account", "AccountBalanceShard")
+    AccountArchiveSummary = apps.get_model("transaction", "AccountArchiveSummary")
+    AccountLedgerSummary = apps.get_model("transaction", "AccountLedgerSummary")
+    Transactions = apps.get_model("transaction", "Transactions")
+
+    last_id = 0
+    while True:
+        account_ids = list(
+            Account.objects.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", flat=True)[:BATCH_SIZE]
+        )
+        if not account_ids:
+            return
+        last_id = account_ids[-1]
+
+        summaries = {
+            account_id: AccountLedgerSummary(
+                account_id=account_id,
+                total_sent=0,
+                total_received=0,
+                transaction_count=0,
+            )
+            for account_id in account_ids
+        }
+        for carried in AccountArchiveSummary.objects.filter(account_id__in=account_ids):
+            summary = summaries[carried.account_id]
+            summary.total_sent = carried.total_sent
+            summary.total_received = carried.total_received
+            summary.transaction_count = carried.transaction_count
+            summary.last_activity = carried.last_activity
+        for field, total_field in (
+            ("sender_id", "total_sent"),
+            ("recipient_id", "total_received"),
+        ):
+            rows = (
+                Transactions.objects.filter(**{f"{field}__in": account_ids})
+                .values(field)
+                .annotate(total=Sum("amount"), count=Count("id"), last=Max("created"))
+                .order_by()
+            )
+            for row in rows:
+                summary = summaries[row[field]]
+                total = getattr(summary, total_field) + row["total"]
+                setattr(summary, total_field, total)
+                summary.transaction_count += row["count"]
+                summary.last_activity = max(
+                    filter(None, (summary.last_activity, row["last"]))
+                )
+        pending = (
+            AccountBalanceShard.objects.filter(
+                account_id__in=account_ids, received_count__gt=0
+            )
+            .values("account_id")
+            .annotate(received=Sum("balance"), count=Sum("received_count"))
+            .order_by()
+        )
+        for row in pending:
+            summary = summaries[row["account_id"]]
+            summary.total_received -= row["received"]
+            summary.transaction_count -= row["count"]
+
+        AccountLedgerSummary.objects.filter(account_id__in=account_ids).delete()
+        AccountLedgerSummary.objects.bulk_create(
+            [summary for summary in summaries.values() if summary.transaction_count]
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("account", "0008_importjob_rows_duplicate"),
+        ("transaction", "0009_ledgerentry_adjustment_protect"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_ledger_summaries, migrations.RunPython.noop),
+    ]
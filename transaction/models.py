@@ -1,45 +1,636 @@
-from django.db import models
-from decimal import Decimal
-from django.db import models, transaction
+import random
+import time
+from decimal import Decimal, InvalidOperation
+from django.db import IntegrityError, OperationalError, connection, models
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce, Greatest
 
-from account.models import Account
+from account.cache import invalidate_accounts
+from account_transfer.db import atomic_immediate
+from account.models import Account, AccountBalanceShard
 from django.core.exceptions import ValidationError
 
 from django.utils import timezone
 
+MIN_TRANSFER_AMOUNT = Decimal("5.00")
 
-class Transactions(models.Model):
+TRANSFER_MAX_ATTEMPTS = 5
+TRANSFER_RETRY_BACKOFF = 0.01
+RETRYABLE_ERRORS = (
+    "database is locked",
+    "database table is locked",
+    "deadlock",
+    "could not serialize",
+    "lock wait timeout",
+    "lock timeout",
+)
+
+
+def run_with_retry(func, attempts=None, backoff=None):
+    # Retries func() on lock and serialization failures with jittered
+    # exponential backoff. Inside an outer atomic block the failed transaction cannot be
+    # retried from here, so the error is raised to the caller.
+    attempts = attempts or TRANSFER_MAX_ATTEMPTS
+    backoff = backoff or TRANSFER_RETRY_BACKOFF
+    for attempt in range(1, attempts + 1):
+        try:
+            return func()
+        except OperationalError as e:
+            retryable = any(marker in str(e).lower() for marker in RETRYABLE_ERRORS)
+            if not retryable or attempt == attempts or connection.in_atomic_block:
+                raise
+            time.sleep(random.uniform(0, backoff * 2 ** (attempt - 1)))
+
+
+class TransferHistory:
+    # Shared by Transactions and ArchivedTransaction, which have the same
+    # sender, recipient, amount and created columns and history indexes.
+
+    @classmethod
+    def history(cls, account, cursor=None, fields=None):
+        # Sent and received halves are combined with UNION so each half can
+        # walk its own (account, -created) index, which an OR cannot. With
+        # fields, rows come back as dicts from values() instead of models.
+        if fields:
+            transactions = cls.objects.values(*fields)
+        else:
+            transactions = cls.objects.select_related("sender", "recipient")
+        sent = transactions.filter(sender=account)
+        received = transactions.filter(recipient=account)
+        if cursor:
+            created, pk = cursor
+            older = Q(created__lte=created) & ~Q(created=created, pk__gte=pk)
+            sent = sent.filter(older)
+            received = received.filter(older)
+        return sent.union(received).order_by("-created", "-id")
+
+
+class Transactions(TransferHistory, models.Model):
+    # The composite indexes below start with the foreign keys, so the
+    # single-column foreign key indexes would only add write cost.
     sender = models.ForeignKey(
-        Account, related_name="sent_transactions", on_delete=models.CASCADE
+        Account,
+        related_name="sent_transactions",
+        on_delete=models.CASCADE,
+        db_index=False,
     )
     recipient = models.ForeignKey(
-        Account, related_name="received_transactions", on_delete=models.CASCADE
+        Account,
+        related_name="received_transactions",
+        on_delete=models.CASCADE,
+        db_index=False,
     )
     amount = models.DecimalField(max_digits=100, decimal_places=2)
     created = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["sender", "-created", "-id"], name="txn_sender_created_idx"
+            ),
+            models.Index(
+                fields=["recipient", "-created", "-id"], name="txn_recipient_created_idx"
+            ),
+            models.Index(fields=["created"], name="txn_created_idx"),
+        ]
+
     @classmethod
-    def transfer(cls, sender_ref, transaction_amount, recipient_ref):
+    def transfer(cls, sender_ref, transaction_amount, recipient_ref, idempotency_key=None):
 
         transaction_amount = Decimal(str(transaction_amount))
-        sender = Account._get_account_by_ref(sender_ref)
-        recepient = Account._get_account_by_ref(recipient_ref)
 
-        if sender.can_transfer(transaction_amount):
+        def _transfer():
+            # No explicit row locks: _apply_transfer's conditional updates
+            # lock the rows it changes, and a hot recipient's account row is
+            # not changed at all.
+            accounts = Account._get_accounts_by_ref([sender_ref, recipient_ref])
+            sender = accounts.get(sender_ref)
+            recepient = accounts.get(recipient_ref)
+            if sender is None or recepient is None:
+                raise ValidationError("Account does not exist.")
+            return cls._apply_transfer(sender, recepient, transaction_amount)
 
-            with transaction.atomic():
-                sender.balance -= transaction_amount
-                recepient.balance += transaction_amount
-                sender.save()
-                recepient.save()
+        return cls._run_transfer(
+            _transfer, idempotency_key, sender_ref, recipient_ref, transaction_amount
+        )
 
-                cls.objects.create(
-                    sender=sender,
-                    recipient=recepient,
-                    amount=transaction_amount,
+    @classmethod
+    def transfer_between(cls, sender, recipient, transaction_amount, idempotency_key=None):
+        # Takes already resolved accounts, so the transfer itself only runs
+        # the conditional balance updates and the ledger insert.
+        transaction_amount = Decimal(str(transaction_amount))
+        return cls._run_transfer(
+            lambda: cls._apply_transfer(sender, recipient, transaction_amount),
+            idempotency_key,
+            sender.ref,
+            recipient.ref,
+            transaction_amount,
+        )
+
+    @classmethod
+    def _run_transfer(cls, apply, idempotency_key, sender_ref, recipient_ref, amount):
+        # With an idempotency key the first successful outcome is stored in
+        # the same atomic block as the transfer, and retries get that stored
+        # ledger row back without touching balances. Failed attempts store
+        # nothing, so they can be retried with the same key.
+        def _transfer():
+            with atomic_immediate():
+                return cls._apply_once(
+                    apply, idempotency_key, sender_ref, recipient_ref, amount
                 )
-        else:
-            raise ValidationError("Insufficient funds.")
+
+        try:
+            return run_with_retry(_transfer)
+        except IntegrityError:
+            # A concurrent request with the same key committed first.
+            stored = idempotency_key and TransferIdempotencyKey.replay(
+                idempotency_key, sender_ref, recipient_ref, amount
+            )
+            if not stored:
+                raise
+            return stored
+
+    @classmethod
+    def _apply_once(cls, apply, idempotency_key, sender_ref, recipient_ref, amount):
+        # Must run inside an atomic block; see _run_transfer.
+        if idempotency_key:
+            stored = TransferIdempotencyKey.replay(
+                idempotency_key, sender_ref, recipient_ref, amount
+            )
+            if stored:
+                return stored
+        ledger_row = apply()
+        if idempotency_key:
+            TransferIdempotencyKey.objects.create(key=idempotency_key, result=ledger_row)
+        return ledger_row
+
+    @classmethod
+    def _apply_transfer(cls, sender, recipient, amount):
+        # Must run inside an atomic block. The funds check and the debit are
+        # one conditional UPDATE, and rows are written in primary key order
+        # so concurrent transfers lock them in the same order.
+        if sender.pk == recipient.pk:
+            raise ValidationError("Sender and recipient cannot be the same.")
+        created = timezone.now()
+        sharded = []
+
+        def debit():
+            if sender.is_hot:
+                debited = cls._debit_hot_account(sender.pk, amount)
+            else:
+                debited = Account.objects.filter(
+                    pk=sender.pk, balance__gte=amount
+                ).update(balance=F("balance") - amount)
+            if not debited:
+                raise ValidationError("Insufficient funds.")
+
+        def credit():
+            if recipient.is_hot and AccountBalanceShard.credit(
+                recipient.pk, amount, created
+            ):
+                sharded.append(recipient)
+                return
+            credited = Account.objects.filter(pk=recipient.pk).update(
+                balance=F("balance") + amount
+            )
+            if not credited:
+                raise ValidationError("Account does not exist.")
+
+        for apply in (debit, credit) if sender.pk < recipient.pk else (credit, debit):
+            apply()
+
+        # A sharded credit leaves the recipient's row, and so its cached
+        # lookup, unchanged; only the pages showing its balance go stale.
+        invalidate_accounts([sender] if sharded else [sender, recipient])
+        if sharded:
+            invalidate_accounts(sharded, lookups=False)
+        ledger_row = cls.objects.create(
+            sender=sender, recipient=recipient, amount=amount, created=created
+        )
+        LedgerEntry.post_transfers([ledger_row])
+        AccountLedgerSummary.record(sender.pk, sent=amount, when=created)
+        if not sharded:
+            AccountLedgerSummary.record(recipient.pk, received=amount, when=created)
+        return ledger_row
+
+    @staticmethod
+    def _debit_hot_account(account_id, amount):
+        # Shards only ever grow between compactions, and compaction takes
+        # this same row lock, so the shard total read under it cannot
+        # shrink before the debit commits.
+        balance = (
+            Account.objects.select_for_update()
+            .filter(pk=account_id)
+            .values_list("balance", flat=True)
+            .first()
+        )
+        if balance is None:
+            return False
+        if balance + AccountBalanceShard.total(account_id) < amount:
+            return False
+        return Account.objects.filter(pk=account_id).update(
+            balance=F("balance") - amount
+        )
+
+    @classmethod
+    def bulk_transfer(cls, transfers, batch_size=500):
+        # Settles (sender_ref, recipient_ref, amount) tuples in order against
+        # in-memory balances, so a transfer may spend funds received earlier
+        # in the batch. Returns one result dict per transfer.
+        refs = set()
+        for sender_ref, recipient_ref, amount in transfers:
+            refs.update((sender_ref, recipient_ref))
+
+        return run_with_retry(lambda: cls._settle_batch(transfers, refs, batch_size))
+
+    @classmethod
+    def _settle_batch(cls, transfers, refs, batch_size):
+        results = []
+        with atomic_immediate():
+            accounts = Account._lock_accounts_by_ref(refs)
+            # The batch holds the hot accounts' row locks anyway, so it folds
+            # their shards into the rows first and then works on the rows
+            # alone, which never go below zero.
+            from .shards import fold_and_record_shards
+
+            hot_ids = [account.pk for account in accounts.values() if account.is_hot]
+            folded = fold_and_record_shards(hot_ids)
+            for account in accounts.values():
+                account.balance += folded.get(account.pk, 0)
+            changed_accounts = {}
+            ledger = []
+
+            for index, (sender_ref, recipient_ref, amount) in enumerate(transfers):
+                result = {
+                    "index": index,
+                    "sender": sender_ref,
+                    "recipient": recipient_ref,
+                    "amount": amount,
+                    "status": "completed",
+                    "error": None,
+                }
+                results.append(result)
+                sender = accounts.get(sender_ref)
+                recipient = accounts.get(recipient_ref)
+                amount = cls._parse_amount(amount)
+
+                if sender is None:
+                    error = f"Sender with reference '{sender_ref}' does not exist."
+                elif recipient is None:
+                    error = f"Recipient with reference '{recipient_ref}' does not exist."
+                elif sender.pk == recipient.pk:
+                    error = "Sender and recipient cannot be the same."
+                elif amount is None:
+                    error = f"Amount must be at least {MIN_TRANSFER_AMOUNT} with no more than 2 decimal places."
+                elif sender.balance < amount:
+                    error = "Insufficient funds."
+                else:
+                    error = None
+
+                if error:
+                    result["status"] = "rejected"
+                    result["error"] = error
+                    continue
+
+                result["amount"] = amount
+                sender.balance -= amount
+                recipient.balance += amount
+                changed_accounts[sender.pk] = sender
+                changed_accounts[recipient.pk] = recipient
+                ledger.append(cls(sender=sender, recipient=recipient, amount=amount))
+
+            Account.objects.bulk_update(
+                changed_accounts.values(), ["balance"], batch_size=batch_size
+            )
+            invalidate_accounts(changed_accounts.values())
+            cls.objects.bulk_create(ledger, batch_size=batch_size)
+            LedgerEntry.post_transfers(ledger, batch_size=batch_size)
+            AccountLedgerSummary.record_many(ledger, batch_size=batch_size)
+
+        return results
+
+    @staticmethod
+    def _parse_amount(amount):
+        try:
+            amount = Decimal(str(amount).strip())
+        except (InvalidOperation, ValueError):
+            return None
+        if not amount.is_finite() or amount.as_tuple().exponent < -2:
+            return None
+        if amount < MIN_TRANSFER_AMOUNT:
+            return None
+        return amount
 
     def __str__(self):
         return f"{self.sender.ref} ---> {self.recipient.ref} : {self.amount} "
+
+
+class LedgerTotals(models.Model):
+    total_sent = models.DecimalField(max_digits=100, decimal_places=2, default=0)
+    total_received = models.DecimalField(max_digits=100, decimal_places=2, default=0)
+    transaction_count = models.PositiveBigIntegerField(default=0)
+    last_activity = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def record_many(cls, ledger, batch_size=500):
+        deltas = {}
+        for row in ledger:
+            for account_id, sent, received in (
+                (row.sender_id, row.amount, 0),
+                (row.recipient_id, 0, row.amount),
+            ):
+                summary = deltas.setdefault(
+                    account_id, cls(account_id=account_id, last_activity=row.created)
+                )
+                summary.total_sent += sent
+                summary.total_received += received
+                summary.transaction_count += 1
+                summary.last_activity = max(summary.last_activity, row.created)
+
+        existing = cls.objects.in_bulk(list(deltas))
+        for account_id, summary in existing.items():
+            delta = deltas.pop(account_id)
+            summary.total_sent += delta.total_sent
+            summary.total_received += delta.total_received
+            summary.transaction_count += delta.transaction_count
+            summary.last_activity = max(
+                filter(None, (summary.last_activity, delta.last_activity))
+            )
+        cls.objects.bulk_update(
+            existing.values(),
+            ["total_sent", "total_received", "transaction_count", "last_activity"],
+            batch_size=batch_size,
+        )
+        cls.objects.bulk_create(deltas.values(), batch_size=batch_size)
+
+
+class AccountLedgerSummary(LedgerTotals):
+    account = models.OneToOneField(
+        Account,
+        related_name="ledger_summary",
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+
+    # Summaries are maintained inside the transfer's atomic block, after the
+    # account rows were updated, so the account row lock already serializes
+    # concurrent writers to the same summary row.
+
+    @classmethod
+    def record(cls, account_id, sent=0, received=0, when=None, count=1):
+        when = when or timezone.now()
+        when_value = Value(when, output_field=models.DateTimeField())
+        updated = cls.objects.filter(account_id=account_id).update(
+            total_sent=F("total_sent") + sent,
+            total_received=F("total_received") + received,
+            transaction_count=F("transaction_count") + count,
+            # Compaction can fold older shard activity in after newer
+            # transfers, so last_activity only ever moves forward.
+            last_activity=Greatest(Coalesce("last_activity", when_value), when_value),
+        )
+        if not updated:
+            cls.objects.create(
+                account_id=account_id,
+                total_sent=sent,
+                total_received=received,
+                transaction_count=count,
+                last_activity=when,
+            )
+
+    def __str__(self):
+        return f"{self.account_id} : sent {self.total_sent} / received {self.total_received}"
+
+
+class ArchivedTransaction(TransferHistory, models.Model):
+    # Transactions moved out of the hot table by archive_transactions, with
+    # their original ids. Rows are moved oldest first, so every archived row
+    # is older than every row left in Transactions.
+    id = models.BigIntegerField(primary_key=True)
+    sender = models.ForeignKey(
+        Account,
+        related_name="archived_sent_transactions",
+        on_delete=models.CASCADE,
+        db_index=False,
+    )
+    recipient = models.ForeignKey(
+        Account,
+        related_name="archived_received_transactions",
+        on_delete=models.CASCADE,
+        db_index=False,
+    )
+    amount = models.DecimalField(max_digits=100, decimal_places=2)
+    created = models.DateTimeField()
+    archived = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["sender", "-created", "-id"], name="archive_sender_created_idx"
+            ),
+            models.Index(
+                fields=["recipient", "-created", "-id"],
+                name="archive_recipient_created_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.sender_id} ---> {self.recipient_id} : {self.amount} "
+
+
+class AccountArchiveSummary(LedgerTotals):
+    # Carry-forward of each account's archived transactions, so summaries
+    # can be rebuilt and checked from it plus the hot table alone.
+    account = models.OneToOneField(
+        Account,
+        related_name="archive_summary",
+        on_delete=models.CASCADE,
+        primary_key=True,
+    )
+
+    def __str__(self):
+        return f"{self.account_id} : archived {self.transaction_count} transactions"
+
+
+class TransferIdempotencyKey(models.Model):
+    key = models.CharField(max_length=255, unique=True)
+    result = models.ForeignKey(
+        Transactions, related_name="idempotency_keys", on_delete=models.CASCADE
+    )
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+
+    @classmethod
+    def replay(cls, key, sender_ref, recipient_ref, amount):
+        stored = (
+            cls.objects.select_related("result__sender", "result__recipient")
+            .filter(key=key)
+            .first()
+        )
+        if stored is None:
+            return None
+        ledger_row = stored.result
+        if (ledger_row.sender.ref, ledger_row.recipient.ref, ledger_row.amount) != (
+            sender_ref,
+            recipient_ref,
+            amount,
+        ):
+            raise ValidationError(
+                "Idempotency key was already used for a different transfer."
+            )
+        ledger_row.replayed = True
+        return ledger_row
+
+    @classmethod
+    def purge(cls, older_than, batch_size=1000):
+        # Deletes in small primary key batches so the purge never holds a
+        # long write lock on the table.
+        purged = 0
+        while True:
+            batch = list(
+                cls.objects.filter(created__lt=older_than)
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not batch:
+                return purged
+            purged += cls.objects.filter(id__in=batch).delete()[0]
+
+    def __str__(self):
+        return self.key
+
+
+class LedgerEntryQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        raise ValueError("Ledger entries are append-only.")
+
+    def delete(self):
+        raise ValueError("Ledger entries are append-only.")
+
+
+class LedgerEntry(models.Model):
+    TRANSFER = "transfer"
+    IMPORT = "import"
+    OPENING = "opening"
+    ADJUSTMENT = "adjustment"
+    KIND_CHOICES = [
+        (TRANSFER, "Transfer"),
+        (IMPORT, "Import"),
+        (OPENING, "Opening balance"),
+        (ADJUSTMENT, "Manual adjustment"),
+    ]
+
+    # Every posting writes entries that sum to zero. Money entering or
+    # leaving the bank (imports, opening balances) is balanced by an entry
+    # with no account, the external side of the books. An account with
+    # entries cannot be deleted, since that would take its history with it.
+    account = models.ForeignKey(
+        Account,
+        related_name="ledger_entries",
+        on_delete=models.PROTECT,
+        null=True,
+        db_index=False,
+    )
+    amount = models.DecimalField(max_digits=100, decimal_places=2)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # Entries are the audit trail, so they keep the transfer id even if the
+    # Transactions row is deleted later.
+    transfer = models.ForeignKey(
+        Transactions,
+        related_name="ledger_entries",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        db_index=False,
+        null=True,
+        blank=True,
+    )
+    created = models.DateTimeField(default=timezone.now)
+
+    objects = LedgerEntryQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["account", "id"], name="ledger_account_entry_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Ledger entries are append-only.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Ledger entries are append-only.")
+
+    # Entries are posted inside the same atomic block that changed the
+    # account's balance, so for any one account they are written in id order
+    # under its row lock, or under one of its shard row locks for a sharded
+    # credit. Snapshots take both and rely on that ordering.
+
+    @classmethod
+    def post_transfers(cls, ledger_rows, batch_size=500):
+        entries = []
+        for row in ledger_rows:
+            entries.append(
+                cls(
+                    account_id=row.sender_id,
+                    amount=-row.amount,
+                    kind=cls.TRANSFER,
+                    transfer_id=row.pk,
+                    created=row.created,
+                )
+            )
+            entries.append(
+                cls(
+                    account_id=row.recipient_id,
+                    amount=row.amount,
+                    kind=cls.TRANSFER,
+                    transfer_id=row.pk,
+                    created=row.created,
+                )
+            )
+        cls.objects.bulk_create(entries, batch_size=batch_size)
+
+    @classmethod
+    def post_adjustments(cls, deltas, kind, when=None, batch_size=500):
+        # deltas maps account ids to signed balance changes coming from
+        # outside the ledger.
+        when = when or timezone.now()
+        entries = []
+        for account_id, amount in deltas.items():
+            if not amount:
+                continue
+            entries.append(
+                cls(account_id=account_id, amount=amount, kind=kind, created=when)
+            )
+            entries.append(cls(account_id=None, amount=-amount, kind=kind, created=when))
+        cls.objects.bulk_create(entries, batch_size=batch_size)
+
+    def __str__(self):
+        return f"{self.account_id} : {self.amount} ({self.kind})"
+
+
+class BalanceSnapshot(models.Model):
+    account = models.ForeignKey(
+        Account,
+        related_name="balance_snapshots",
+        on_delete=models.CASCADE,
+        db_index=False,
+    )
+    balance = models.DecimalField(max_digits=100, decimal_places=2)
+    # The snapshot covers this account's entries up to and including
+    # last_entry_id; as_of is the time of that entry.
+    last_entry_id = models.PositiveBigIntegerField()
+    as_of = models.DateTimeField()
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["account", "-as_of", "-last_entry_id"],
+                name="snapshot_account_as_of_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id} : {self.balance} as of {self.as_of}"
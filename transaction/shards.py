@@ -0,0 +1,83 @@
+from django.db.models import F
+
+from account.cache import invalidate_accounts
+from account.models import Account, AccountBalanceShard
+from account_transfer.db import atomic_immediate
+
+from .models import AccountLedgerSummary, run_with_retry
+
+
+def fold_shards(account_ids):
+    # Moves shard balances into their account rows and zeroes the shards.
+    # Callers hold the accounts' row locks, which keeps hot debits out;
+    # locking the shards waits out credits already in flight. Returns
+    # {account_id: (received, count, last_activity)} for what was folded.
+    shards = list(
+        AccountBalanceShard.objects.select_for_update()
+        .filter(account_id__in=account_ids, received_count__gt=0)
+        .order_by("pk")
+    )
+    folded = {}
+    for shard in shards:
+        received, count, last_activity = folded.get(shard.account_id, (0, 0, None))
+        folded[shard.account_id] = (
+            received + shard.balance,
+            count + shard.received_count,
+            max(filter(None, (last_activity, shard.last_activity))),
+        )
+    if not folded:
+        return folded
+
+    for account_id, (received, count, last_activity) in folded.items():
+        Account.objects.filter(pk=account_id).update(balance=F("balance") + received)
+    AccountBalanceShard.objects.filter(pk__in=[shard.pk for shard in shards]).update(
+        balance=0, received_count=0, last_activity=None
+    )
+    invalidate_accounts(Account.objects.filter(pk__in=list(folded)).only("pk", "ref"))
+    return folded
+
+
+def compact_shards(batch_size=500):
+    # Folds every account with pending shard credits, hot or not, since an
+    # account may have been unmarked after credits landed on its shards.
+    compacted = 0
+    while True:
+        account_ids = list(
+            AccountBalanceShard.objects.filter(received_count__gt=0)
+            .values_list("account_id", flat=True)
+            .distinct()
+            .order_by("account_id")[:batch_size]
+        )
+        if not account_ids:
+            return compacted
+        for account_id in account_ids:
+            compacted += run_with_retry(lambda: _compact_account(account_id))
+
+
+def _compact_account(account_id):
+    with atomic_immediate():
+        list(
+            Account.objects.select_for_update()
+            .filter(pk=account_id)
+            .values_list("pk", flat=True)
+        )
+        return len(fold_and_record_shards([account_id]))
+
+
+def fold_and_record_shards(account_ids):
+    # fold_shards plus the ledger summary update for the folded credits.
+    # Returns {account_id: folded amount}.
+    folded = fold_shards(account_ids) if account_ids else {}
+    for account_id, (received, count, when) in folded.items():
+        AccountLedgerSummary.record(account_id, received=received, when=when, count=count)
+    return {account_id: received for account_id, (received, *_) in folded.items()}
+
+
+def mark_hot(refs, hot=True):
+    accounts = list(Account.objects.filter(ref__in=refs))
+    for account in accounts:
+        if hot:
+            AccountBalanceShard.create_for(account.pk)
+        account.is_hot = hot
+        account.save(update_fields=["is_hot"])
+    return accounts
@@ -0,0 +1,43 @@
+from decimal import Decimal
+
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from account.models import Account
+
+from .models import LedgerEntry
+
+
+@receiver(pre_save, sender=Account)
+def remember_stored_balance(sender, instance, raw=False, update_fields=None, **kwargs):
+    # The balance about to be overwritten, read from the row rather than
+    # the instance, which may have been loaded before later transfers.
+    instance._stored_balance = None
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and "balance" not in update_fields:
+        return
+    instance._stored_balance = (
+        Account.objects.filter(pk=instance.pk).values_list("balance", flat=True).first()
+    )
+
+
+# Accounts created one at a time (admin, shell, fixtures) open with their
+# initial balance, and saving a changed balance the same way posts the
+# difference as an adjustment. Imports post their own entries since bulk
+# writes send no signals.
+@receiver(post_save, sender=Account)
+def post_balance_change(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        if instance.balance:
+            LedgerEntry.post_adjustments(
+                {instance.pk: instance.balance}, LedgerEntry.OPENING
+            )
+        return
+    stored = getattr(instance, "_stored_balance", None)
+    if stored is not None:
+        delta = Decimal(str(instance.balance)) - stored
+        if delta:
+            LedgerEntry.post_adjustments({instance.pk: delta}, LedgerEntry.ADJUSTMENT)
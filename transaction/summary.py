@@ -0,0 +1,123 @@
+from decimal import Decimal
+
+from django.db.models import Count, Max, Sum
+
+from account.models import Account, AccountBalanceShard
+from account_transfer.db import atomic_immediate
+
+from .models import (
+    AccountArchiveSummary,
+    AccountLedgerSummary,
+    Transactions,
+    run_with_retry,
+)
+from .shards import fold_shards
+
+
+def iter_account_id_batches(batch_size):
+    last_id = 0
+    while True:
+        batch = list(
+            Account.objects.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1]
+
+
+def ledger_totals(account_ids):
+    # Aggregates the raw ledger for a batch of accounts, on top of the
+    # carry-forward of their archived transactions. Each side is one GROUP
+    # BY over the (account, -created) indexes.
+    archived = AccountArchiveSummary.objects.in_bulk(account_ids)
+    totals = {}
+    for account_id in account_ids:
+        carried = archived.get(account_id) or AccountArchiveSummary()
+        totals[account_id] = AccountLedgerSummary(
+            account_id=account_id,
+            total_sent=carried.total_sent,
+            total_received=carried.total_received,
+            transaction_count=carried.transaction_count,
+            last_activity=carried.last_activity,
+        )
+    for field, total_field in (
+        ("sender_id", "total_sent"),
+        ("recipient_id", "total_received"),
+    ):
+        rows = (
+            Transactions.objects.filter(**{f"{field}__in": account_ids})
+            .values(field)
+            .annotate(total=Sum("amount"), count=Count("id"), last=Max("created"))
+            .order_by()
+        )
+        for row in rows:
+            summary = totals[row[field]]
+            setattr(summary, total_field, getattr(summary, total_field) + row["total"])
+            summary.transaction_count += row["count"]
+            summary.last_activity = max(
+                filter(None, (summary.last_activity, row["last"]))
+            )
+    return totals
+
+
+def pending_shard_credits(account_ids):
+    return {
+        row["account_id"]: (row["received"], row["count"])
+        for row in AccountBalanceShard.objects.filter(
+            account_id__in=account_ids, received_count__gt=0
+        )
+        .values("account_id")
+        .annotate(received=Sum("balance"), count=Sum("received_count"))
+        .order_by()
+    }
+
+
+def rebuild_summaries(batch_size=500):
+    rebuilt = 0
+    for account_ids in iter_account_id_batches(batch_size):
+        run_with_retry(lambda: _rebuild_batch(account_ids))
+        rebuilt += len(account_ids)
+    return rebuilt
+
+
+def _rebuild_batch(account_ids):
+    with atomic_immediate():
+        # Locking the accounts blocks transfers touching this batch until
+        # its summaries are rewritten, so no increment is lost.
+        list(
+            Account.objects.select_for_update()
+            .filter(id__in=account_ids)
+            .values_list("id", flat=True)
+        )
+        # Pending shard credits are counted in the ledger totals below,
+        # so they are folded first instead of being added twice later.
+        fold_shards(account_ids)
+        totals = ledger_totals(account_ids)
+        AccountLedgerSummary.objects.filter(account_id__in=account_ids).delete()
+        AccountLedgerSummary.objects.bulk_create(
+            [summary for summary in totals.values() if summary.transaction_count]
+        )
+
+
+def find_summary_mismatches(batch_size=500):
+    fields = ("total_sent", "total_received", "transaction_count")
+    for account_ids in iter_account_id_batches(batch_size):
+        expected = ledger_totals(account_ids)
+        actual = AccountLedgerSummary.objects.in_bulk(account_ids)
+        pending = pending_shard_credits(account_ids)
+        for account_id in account_ids:
+            stored = actual.get(account_id) or AccountLedgerSummary(account_id=account_id)
+            if account_id in pending:
+                received, count = pending[account_id]
+                stored.total_received += received
+                stored.transaction_count += count
+            differences = {
+                field: (getattr(stored, field), getattr(expected[account_id], field))
+                for field in fields
+                if Decimal(getattr(stored, field)) != Decimal(getattr(expected[account_id], field))
+            }
+            if differences:
+                yield account_id, differences
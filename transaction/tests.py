@@ -1,7 +1,45 @@
-from django.test import TestCase
+import random
+import threading
+from concurrent.futures import Future
+from datetime import timedelta
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.core.exceptions import ValidationError
+from django.db import connection, connections
+from django.db.models import ProtectedError, Sum
+from django.test import (
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from django.urls import reverse
 from django.contrib.messages import get_messages
-from .models import Account
+from account.csv_import import AccountColumns
+from account.views import AccountListView
+from .archive import archive_transactions
+from .group_commit import TransferQueue, close_transfer_queue, submit_transfer
+from .ledger import balance_at
+from .models import (
+    Account,
+    AccountArchiveSummary,
+    AccountBalanceShard,
+    AccountLedgerSummary,
+    ArchivedTransaction,
+    BalanceSnapshot,
+    LedgerEntry,
+    Transactions,
+    TransferIdempotencyKey,
+)
 
 class BalanceTransferViewTests(TestCase):
 
@@ -115,10 +153,860 @@ class BalanceTransferViewTests(TestCase):
         }
         response = self.post_data(data)
         self.assertEqual(response.status_code, 200)
-        messages = list(get_messages(response.wsgi_request))
-        self.assertEqual(len(messages), 1)
-        self.assertIn("Sender and recipient cannot be the same.", str(messages[0]))
+        form = response.context["form"]
+        self.assertIn("Sender and recipient cannot be the same.", form.non_field_errors())
+        self.assertContains(response, "Sender and recipient cannot be the same.")
         self.sender.refresh_from_db()
         self.recipient.refresh_from_db()
         self.assertEqual(self.sender.balance, 1000.0)
-        self.assertEqual(self.recipient.balance, 500.0)
\ No newline at end of file
+        self.assertEqual(self.recipient.balance, 500.0)
+
+    def test_valid_transaction_reads_accounts_once(self):
+        data = {
+            "sender": self.sender.ref,
+            "recipient": self.recipient.ref,
+            "amount": 100.0,
+        }
+        with CaptureQueriesContext(connection) as queries:
+            self.post_data(data)
+        reads = [q["sql"] for q in queries if q["sql"].startswith("SELECT")]
+        self.assertEqual(len(reads), 1)
+        self.assertIn(" IN (", reads[0])
+
+    def test_non_existent_sender_and_recipient_accounts(self):
+        data = {"sender": "998", "recipient": "999", "amount": 100.0}
+        response = self.post_data(data)
+        form = response.context["form"]
+        self.assertIn("Sender with reference '998' does not exist.", form.errors["sender"])
+        self.assertIn("Recipient with reference '999' does not exist.", form.errors["recipient"])
+
+
+class AsyncBalanceTransferViewTests(TestCase):
+
+    def setUp(self):
+        self.url = reverse("balance-transaction-async")
+        self.sender = Account.objects.create(ref="1", name="John", balance=1000.0)
+        self.recipient = Account.objects.create(ref="2", name="Jane", balance=500.0)
+
+    async def test_async_valid_transaction(self):
+        response = await self.async_client.post(
+            self.url, {"sender": "1", "recipient": "2", "amount": 100.0}
+        )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, self.url)
+        sender = await Account.objects.aget(pk=self.sender.pk)
+        self.assertEqual(sender.balance, 900)
+
+    async def test_async_refs_are_stripped_like_the_sync_view(self):
+        response = await self.async_client.post(
+            self.url, {"sender": " 1 ", "recipient": "2 ", "amount": 100.0}
+        )
+        self.assertEqual(response.status_code, 302)
+        sender = await Account.objects.aget(pk=self.sender.pk)
+        self.assertEqual(sender.balance, 900)
+
+    async def test_async_non_existent_recipient(self):
+        response = await self.async_client.post(
+            self.url, {"sender": "1", "recipient": "999", "amount": 100.0}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            "Recipient with reference '999' does not exist.",
+            response.context["form"].errors["recipient"],
+        )
+
+    async def test_async_insufficient_funds(self):
+        response = await self.async_client.post(
+            self.url, {"sender": "1", "recipient": "2", "amount": 5000.0}
+        )
+        self.assertIn("Insufficient funds.", response.context["form"].non_field_errors())
+        self.assertEqual(await Transactions.objects.acount(), 0)
+
+
+class IdempotentTransferTests(TestCase):
+
+    def setUp(self):
+        self.url = reverse("balance-transaction")
+        self.sender = Account.objects.create(ref="1", name="John", balance=1000.0)
+        self.recipient = Account.objects.create(ref="2", name="Jane", balance=500.0)
+        self.data = {"sender": "1", "recipient": "2", "amount": 100.0}
+
+    def assertBalances(self, sender_balance, recipient_balance):
+        self.sender.refresh_from_db()
+        self.recipient.refresh_from_db()
+        self.assertEqual(self.sender.balance, sender_balance)
+        self.assertEqual(self.recipient.balance, recipient_balance)
+
+    def test_form_carries_idempotency_key(self):
+        response = self.client.get(self.url)
+        key = response.context["form"]["idempotency_key"].value()
+        self.assertTrue(key)
+        self.assertContains(response, f'name="idempotency_key" value="{key}"')
+
+    def test_double_submitted_form_transfers_once(self):
+        data = {**self.data, "idempotency_key": "form-key"}
+        for _ in range(2):
+            response = self.client.post(self.url, data)
+            self.assertRedirects(response, self.url)
+        self.assertEqual(Transactions.objects.count(), 1)
+        self.assertBalances(900, 600)
+
+    def test_retried_request_with_header_transfers_once(self):
+        for _ in range(2):
+            self.client.post(self.url, self.data, HTTP_IDEMPOTENCY_KEY="header-key")
+        self.assertEqual(Transactions.objects.count(), 1)
+        self.assertBalances(900, 600)
+
+    def test_bad_header_keys_are_rejected(self):
+        for key, error in (
+            ("k" * 256, "The Idempotency-Key header must be at most 255 characters."),
+            ("  ", "The Idempotency-Key header cannot be blank."),
+        ):
+            response = self.client.post(self.url, self.data, HTTP_IDEMPOTENCY_KEY=key)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(error, response.context["form"].errors["idempotency_key"])
+        self.assertFalse(Transactions.objects.exists())
+        self.assertBalances(1000, 500)
+
+    def test_replay_returns_stored_transaction(self):
+        first = Transactions.transfer("1", "10.00", "2", idempotency_key="key")
+        with self.assertNumQueries(3):
+            replayed = Transactions.transfer_between(
+                self.sender, self.recipient, "10.00", idempotency_key="key"
+            )
+        self.assertEqual(replayed, first)
+        self.assertTrue(replayed.replayed)
+        self.assertBalances(990, 510)
+
+    def test_key_reused_for_different_transfer(self):
+        Transactions.transfer("1", "10.00", "2", idempotency_key="key")
+        with self.assertRaisesMessage(
+            ValidationError, "Idempotency key was already used for a different transfer."
+        ):
+            Transactions.transfer("1", "20.00", "2", idempotency_key="key")
+        self.assertBalances(990, 510)
+
+    def test_failed_transfer_does_not_store_key(self):
+        with self.assertRaises(ValidationError):
+            Transactions.transfer("1", "5000.00", "2", idempotency_key="key")
+        self.assertFalse(TransferIdempotencyKey.objects.exists())
+        Transactions.transfer("1", "10.00", "2", idempotency_key="key")
+        self.assertBalances(990, 510)
+
+    def test_purge_command_deletes_expired_keys(self):
+        Transactions.transfer("1", "10.00", "2", idempotency_key="old")
+        Transactions.transfer("1", "10.00", "2", idempotency_key="new")
+        TransferIdempotencyKey.objects.filter(key="old").update(
+            created=timezone.now() - timedelta(hours=25)
+        )
+        out = StringIO()
+        call_command("purge_idempotency_keys", batch_size=1, stdout=out)
+        self.assertIn("Purged 1 idempotency keys.", out.getvalue())
+        self.assertEqual(
+            list(TransferIdempotencyKey.objects.values_list("key", flat=True)), ["new"]
+        )
+
+
+class BulkTransferTests(TestCase):
+
+    def setUp(self):
+        self.url = reverse("bulk-transfer")
+        self.alice = Account.objects.create(ref="1", name="Alice", balance=100.0)
+        self.bob = Account.objects.create(ref="2", name="Bob", balance=50.0)
+        self.carol = Account.objects.create(ref="3", name="Carol", balance=0.0)
+
+    def test_bulk_transfer_applies_transfers_in_order(self):
+        results = Transactions.bulk_transfer(
+            [
+                ("1", "2", "60.00"),
+                ("2", "3", "100.00"),
+                ("3", "1", "500.00"),
+                ("1", "999", "10.00"),
+                ("1", "1", "10.00"),
+                ("1", "2", "1.00"),
+            ]
+        )
+        self.assertEqual(
+            [result["status"] for result in results],
+            ["completed", "completed", "rejected", "rejected", "rejected", "rejected"],
+        )
+        self.assertEqual(results[2]["error"], "Insufficient funds.")
+        self.assertEqual(
+            results[3]["error"], "Recipient with reference '999' does not exist."
+        )
+        self.assertEqual(results[4]["error"], "Sender and recipient cannot be the same.")
+        self.alice.refresh_from_db()
+        self.bob.refresh_from_db()
+        self.carol.refresh_from_db()
+        self.assertEqual(self.alice.balance, Decimal("40.00"))
+        self.assertEqual(self.bob.balance, Decimal("10.00"))
+        self.assertEqual(self.carol.balance, Decimal("100.00"))
+        self.assertEqual(Transactions.objects.count(), 2)
+
+    def test_bulk_transfer_query_count_is_independent_of_batch_size(self):
+        transfers = [("1", "2", "5.00")] * 10
+        # Savepoint, lock read, bulk_update, bulk_create, ledger entries,
+        # summary read and write, savepoint release.
+        with self.assertNumQueries(8):
+            Transactions.bulk_transfer(transfers)
+        self.assertEqual(Transactions.objects.count(), 10)
+
+    def test_bulk_transfer_view_reports_rejected_rows(self):
+        csv_file = SimpleUploadedFile(
+            "transfers.csv",
+            b"Sender,Recipient,Amount\n1,2,10.00\n3,1,20.00\n",
+        )
+        response = self.client.post(self.url, {"data_file": csv_file})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["completed_count"], 1)
+        self.assertEqual(len(response.context["rejected"]), 1)
+        self.assertContains(response, "1 of 2 transfers completed.")
+        self.assertContains(response, "Insufficient funds.")
+
+    def test_bulk_transfer_view_missing_headers(self):
+        csv_file = SimpleUploadedFile("transfers.csv", b"Sender,Amount\n1,10.00\n")
+        response = self.client.post(self.url, {"data_file": csv_file})
+        self.assertContains(response, "Missing required headers in CSV: Recipient")
+        self.assertEqual(Transactions.objects.count(), 0)
+
+
+
+# The in-memory test database reports lock conflicts immediately instead of
+# waiting on a busy timeout, so the stress test allows more retries.
+@mock.patch("transaction.models.TRANSFER_MAX_ATTEMPTS", 50)
+class ConcurrentTransferTests(TransactionTestCase):
+    threads = 8
+    transfers_per_thread = 25
+
+    def setUp(self):
+        self.accounts = [
+            Account.objects.create(ref=str(i), name=f"Account {i}", balance=100.0)
+            for i in range(5)
+        ]
+
+    def run_random_transfers(self):
+        refs = [account.ref for account in self.accounts]
+        completed = []
+        errors = []
+
+        def worker(seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(self.transfers_per_thread):
+                    sender_ref, recipient_ref = rng.sample(refs, 2)
+                    try:
+                        Transactions.transfer(
+                            sender_ref=sender_ref,
+                            transaction_amount=rng.choice(["5.00", "25.00", "60.00"]),
+                            recipient_ref=recipient_ref,
+                        )
+                        completed.append(sender_ref)
+                    except ValidationError:
+                        pass
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        workers = [
+            threading.Thread(target=worker, args=(seed,)) for seed in range(self.threads)
+        ]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        return completed
+
+    def test_concurrent_transfers_preserve_total_balance(self):
+        total_before = Account.objects.aggregate(total=Sum("balance"))["total"]
+        completed = self.run_random_transfers()
+        self.assertEqual(
+            Account.objects.aggregate(total=Sum("balance"))["total"], total_before
+        )
+        self.assertFalse(Account.objects.filter(balance__lt=0).exists())
+        self.assertEqual(Transactions.objects.count(), len(completed))
+
+    @skipUnless(hasattr(connection, "begin_immediate"), "needs the tuned SQLite profile")
+    def test_transfers_begin_immediate_transactions(self):
+        with CaptureQueriesContext(connection) as queries:
+            Transactions.transfer("0", "5.00", "1")
+            Transactions.bulk_transfer([("1", "0", "5.00")])
+        begins = [q["sql"] for q in queries if q["sql"].startswith("BEGIN")]
+        self.assertEqual(begins, ["BEGIN IMMEDIATE", "BEGIN IMMEDIATE"])
+
+    @skipUnless(hasattr(connection, "begin_immediate"), "needs the tuned SQLite profile")
+    def test_maintenance_writes_begin_immediate_transactions(self):
+        Transactions.transfer("0", "5.00", "1")
+        with CaptureQueriesContext(connection) as queries:
+            Account.import_batch(
+                AccountColumns([1], ["0"], ["Account 0"], [Decimal("7.00")], [], [])
+            )
+            for command in (
+                "compact_balance_shards",
+                "snapshot_balances",
+                "rebuild_ledger_summary",
+            ):
+                call_command(command, stdout=StringIO())
+        begins = {q["sql"] for q in queries if q["sql"].startswith("BEGIN")}
+        self.assertEqual(begins, {"BEGIN IMMEDIATE"})
+
+    def test_imports_run_alongside_transfers(self):
+        errors = []
+
+        def importer():
+            try:
+                for n in range(20):
+                    Account.import_batch(
+                        AccountColumns(
+                            [1, 2],
+                            [f"imported-{n}", "0"],
+                            [f"Imported {n}", "Account 0"],
+                            [Decimal("1.00"), Decimal("100.00")],
+                            [],
+                            [],
+                        )
+                    )
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        thread = threading.Thread(target=importer)
+        thread.start()
+        self.run_random_transfers()
+        thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(Account.objects.filter(ref__startswith="imported-").count(), 20)
+        call_command("check_ledger_balances", stdout=StringIO())
+
+    @skipUnless(connection.settings_dict.get("PRAGMAS"), "needs the tuned SQLite profile")
+    def test_connections_apply_configured_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_concurrent_transfers_with_hot_account(self):
+        total_before = Account.objects.aggregate(total=Sum("balance"))["total"]
+        call_command("mark_hot_accounts", "0", stdout=StringIO())
+        completed = self.run_random_transfers()
+        sharded = AccountBalanceShard.objects.aggregate(total=Sum("balance"))["total"]
+        self.assertEqual(
+            Account.objects.aggregate(total=Sum("balance"))["total"] + sharded,
+            total_before,
+        )
+        self.assertEqual(Transactions.objects.count(), len(completed))
+
+        call_command("compact_balance_shards", stdout=StringIO())
+        self.assertEqual(
+            Account.objects.aggregate(total=Sum("balance"))["total"], total_before
+        )
+        self.assertFalse(Account.objects.filter(balance__lt=0).exists())
+        call_command("check_ledger_balances", stdout=StringIO())
+        call_command("check_ledger_summary", stdout=StringIO())
+
+
+class GroupCommitTests(TransactionTestCase):
+
+    def setUp(self):
+        self.sender = Account.objects.create(ref="1", name="John", balance=100)
+        self.recipient = Account.objects.create(ref="2", name="Jane", balance=0)
+        # max_batch ends the batch once every transfer is queued, well
+        # before max_delay.
+        self.queue = TransferQueue(max_batch=3, max_delay=5)
+        self.addCleanup(self.queue.close)
+
+    def submit_all(self, *transfers):
+        with mock.patch.object(self.queue, "_apply", wraps=self.queue._apply) as apply:
+            futures = [self.queue.submit(*transfer) for transfer in transfers]
+            for future in futures:
+                future.exception()
+        self.assertEqual(apply.call_count, 1)
+        return futures
+
+    def test_queued_transfers_commit_in_one_transaction(self):
+        first, rejected, second = self.submit_all(
+            (self.sender, self.recipient, Decimal("60")),
+            (self.sender, self.recipient, Decimal("60")),
+            (self.recipient, self.sender, Decimal("10")),
+        )
+        self.assertEqual(first.result().amount, Decimal("60"))
+        self.assertEqual(second.result().amount, Decimal("10"))
+        with self.assertRaisesMessage(ValidationError, "Insufficient funds."):
+            rejected.result()
+
+        self.sender.refresh_from_db()
+        self.recipient.refresh_from_db()
+        self.assertEqual((self.sender.balance, self.recipient.balance), (50, 50))
+        self.assertEqual(Transactions.objects.count(), 2)
+        call_command("check_ledger_balances", stdout=StringIO())
+        call_command("check_ledger_summary", stdout=StringIO())
+
+    def test_repeated_idempotency_key_in_one_batch_transfers_once(self):
+        transfer = (self.sender, self.recipient, Decimal("10"), "key-1")
+        first, retried, other = self.submit_all(
+            transfer, transfer, (self.sender, self.recipient, Decimal("20"), "key-1")
+        )
+        self.assertEqual(retried.result().pk, first.result().pk)
+        with self.assertRaisesMessage(ValidationError, "different transfer"):
+            other.result()
+        self.sender.refresh_from_db()
+        self.assertEqual(self.sender.balance, 90)
+        self.assertEqual(TransferIdempotencyKey.objects.count(), 1)
+
+    def test_committer_survives_errors_and_is_replaced_if_it_dies(self):
+        transfer_queue = TransferQueue(max_batch=1, max_delay=0)
+        self.addCleanup(transfer_queue.close)
+        transfer = (self.sender, self.recipient, Decimal("10"))
+        with mock.patch(
+            "transaction.group_commit.close_old_connections",
+            side_effect=[RuntimeError("connection lost"), None],
+        ):
+            failed = transfer_queue.submit(*transfer)
+            with self.assertRaisesMessage(RuntimeError, "connection lost"):
+                failed.result(timeout=10)
+            committed = transfer_queue.submit(*transfer)
+            self.assertEqual(committed.result(timeout=10).amount, Decimal("10"))
+
+        with mock.patch.object(transfer_queue, "_next_batch", side_effect=SystemExit):
+            stranded = transfer_queue.submit(self.sender, self.recipient, Decimal("5"))
+            transfer_queue._thread.join()
+        future = transfer_queue.submit(self.sender, self.recipient, Decimal("5"))
+        self.assertEqual(stranded.result(timeout=10).amount, Decimal("5"))
+        self.assertEqual(future.result(timeout=10).amount, Decimal("5"))
+
+    @override_settings(
+        TRANSFER_GROUP_COMMIT=True, TRANSFER_GROUP_COMMIT_TIMEOUT_SECONDS=0.01
+    )
+    def test_waiting_for_the_committer_times_out(self):
+        with mock.patch.object(TransferQueue, "submit", return_value=Future()):
+            with self.assertRaisesMessage(TimeoutError, "may still complete"):
+                submit_transfer(self.sender, self.recipient, "10.00")
+
+    @override_settings(TRANSFER_GROUP_COMMIT=True)
+    def test_transfer_view_uses_queue_when_enabled(self):
+        self.addCleanup(close_transfer_queue)
+        with mock.patch.object(
+            TransferQueue, "submit", autospec=True, side_effect=TransferQueue.submit
+        ) as submit:
+            response = self.client.post(
+                reverse("balance-transaction"),
+                {"sender": "1", "recipient": "2", "amount": "25.00"},
+            )
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(submit.call_count, 1)
+        self.sender.refresh_from_db()
+        self.assertEqual(self.sender.balance, 75)
+
+
+class AccountLedgerSummaryTests(TestCase):
+
+    def setUp(self):
+        self.alice = Account.objects.create(ref="1", name="Alice", balance=100.0)
+        self.bob = Account.objects.create(ref="2", name="Bob", balance=100.0)
+
+    def test_transfer_updates_summaries(self):
+        Transactions.transfer("1", "10.00", "2")
+        Transactions.transfer_between(self.bob, self.alice, "5.00")
+        alice = AccountLedgerSummary.objects.get(account=self.alice)
+        bob = AccountLedgerSummary.objects.get(account=self.bob)
+        self.assertEqual(alice.total_sent, Decimal("10.00"))
+        self.assertEqual(alice.total_received, Decimal("5.00"))
+        self.assertEqual(alice.transaction_count, 2)
+        self.assertEqual(bob.total_sent, Decimal("5.00"))
+        self.assertEqual(bob.total_received, Decimal("10.00"))
+        self.assertEqual(bob.last_activity, Transactions.objects.latest("id").created)
+
+    def test_rejected_transfer_leaves_summaries_untouched(self):
+        with self.assertRaises(ValidationError):
+            Transactions.transfer("1", "500.00", "2")
+        self.assertFalse(AccountLedgerSummary.objects.exists())
+
+    def test_bulk_transfer_updates_summaries(self):
+        Transactions.transfer("1", "10.00", "2")
+        Transactions.bulk_transfer([("1", "2", "5.00"), ("2", "1", "20.00")])
+        alice = AccountLedgerSummary.objects.get(account=self.alice)
+        self.assertEqual(alice.total_sent, Decimal("15.00"))
+        self.assertEqual(alice.total_received, Decimal("20.00"))
+        self.assertEqual(alice.transaction_count, 3)
+
+    def test_rebuild_and_check_commands(self):
+        Transactions.transfer("1", "10.00", "2")
+        Transactions.objects.create(sender=self.bob, recipient=self.alice, amount=7)
+        with self.assertRaises(CommandError):
+            call_command("check_ledger_summary", stdout=StringIO())
+
+        call_command("rebuild_ledger_summary", batch_size=1, stdout=StringIO())
+        out = StringIO()
+        call_command("check_ledger_summary", stdout=out)
+        self.assertIn("All account summaries match the ledger.", out.getvalue())
+        alice = AccountLedgerSummary.objects.get(account=self.alice)
+        self.assertEqual(alice.total_received, Decimal("7.00"))
+        self.assertEqual(alice.transaction_count, 2)
+
+    def test_migration_backfills_summaries(self):
+        backfill = import_module(
+            "transaction.migrations.0010_backfill_ledger_summaries"
+        ).backfill_ledger_summaries
+        carol = Account.objects.create(ref="3", name="Carol", balance=0)
+        call_command("mark_hot_accounts", "3", stdout=StringIO())
+        Transactions.transfer("1", "10.00", "2")
+        archive_transactions(timezone.now() + timedelta(seconds=1))
+        Transactions.transfer("2", "4.00", "1")
+        Transactions.transfer("1", "6.00", "3")
+        # Summaries from before they were maintained, and a stale one.
+        AccountLedgerSummary.objects.exclude(account=self.alice).delete()
+        AccountLedgerSummary.objects.filter(account=self.alice).update(total_sent=1)
+
+        backfill(apps, None)
+        call_command("check_ledger_summary", stdout=StringIO())
+        bob = AccountLedgerSummary.objects.get(account=self.bob)
+        self.assertEqual((bob.total_received, bob.transaction_count), (10, 2))
+        self.assertFalse(AccountLedgerSummary.objects.filter(account=carol).exists())
+        call_command("compact_balance_shards", stdout=StringIO())
+        call_command("check_ledger_summary", stdout=StringIO())
+
+    def test_account_pages_read_summaries(self):
+        Transactions.transfer("1", "10.00", "2")
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse("account-list"))
+        self.assertContains(response, "<td>1</td>", count=2)
+        response = self.client.get(reverse("account-details", args=[self.alice.pk]))
+        self.assertContains(response, "<td>10.00</td>")
+
+
+class HotAccountTests(TestCase):
+
+    def setUp(self):
+        self.alice = Account.objects.create(ref="1", name="Alice", balance=100.0)
+        self.merchant = Account.objects.create(ref="2", name="Merchant", balance=0)
+        call_command("mark_hot_accounts", "2", stdout=StringIO())
+        self.merchant.refresh_from_db()
+
+    def test_credits_to_hot_account_go_to_shards(self):
+        Transactions.transfer("1", "10.00", "2")
+        Transactions.transfer("1", "15.00", "2")
+        self.merchant.refresh_from_db()
+        self.assertEqual(self.merchant.balance, Decimal("0.00"))
+        self.assertEqual(self.merchant.available_balance(), Decimal("25.00"))
+        self.assertEqual(self.merchant.balance_shards.count(), settings.ACCOUNT_BALANCE_SHARDS)
+        self.assertFalse(AccountLedgerSummary.objects.filter(account=self.merchant).exists())
+        call_command("check_ledger_balances", stdout=StringIO())
+        call_command("check_ledger_summary", stdout=StringIO())
+
+    def test_hot_account_spends_sharded_balance(self):
+        Transactions.transfer("1", "30.00", "2")
+        with self.assertRaises(ValidationError):
+            Transactions.transfer("2", "31.00", "1")
+        Transactions.transfer("2", "20.00", "1")
+        self.merchant.refresh_from_db()
+        self.assertEqual(self.merchant.balance, Decimal("-20.00"))
+        self.assertTrue(self.merchant.can_transfer(Decimal("10.00")))
+        self.assertFalse(self.merchant.can_transfer(Decimal("10.01")))
+
+        results = Transactions.bulk_transfer([("2", "1", "10.00"), ("2", "1", "5.00")])
+        self.assertEqual([r["status"] for r in results], ["completed", "rejected"])
+
+    def test_compaction_folds_shards_into_balance_and_summary(self):
+        Transactions.transfer("1", "10.00", "2")
+        Transactions.transfer("1", "15.00", "2")
+        call_command("compact_balance_shards", stdout=StringIO())
+        self.merchant.refresh_from_db()
+        self.assertEqual(self.merchant.balance, Decimal("25.00"))
+        self.assertEqual(self.merchant.available_balance(), Decimal("25.00"))
+        summary = AccountLedgerSummary.objects.get(account=self.merchant)
+        self.assertEqual(summary.total_received, Decimal("25.00"))
+        self.assertEqual(summary.transaction_count, 2)
+        self.assertEqual(summary.last_activity, Transactions.objects.latest("id").created)
+        call_command("check_ledger_summary", stdout=StringIO())
+
+    def test_rebuild_folds_pending_shards(self):
+        Transactions.transfer("1", "10.00", "2")
+        call_command("rebuild_ledger_summary", stdout=StringIO())
+        self.merchant.refresh_from_db()
+        self.assertEqual(self.merchant.balance, Decimal("10.00"))
+        self.assertFalse(self.merchant.balance_shards.filter(received_count__gt=0).exists())
+        call_command("check_ledger_summary", stdout=StringIO())
+
+    def test_views_show_balance_including_shards(self):
+        # A page showing only the merchant, cached before the transfer, so
+        # the sharded credit itself must drop it.
+        merchant_page = {"q": "Merchant"}
+        self.client.get(reverse("account-list"), merchant_page)
+        Transactions.transfer("1", "50.00", "2")
+
+        shown = "<td>50.00</td>"
+        self.assertContains(self.client.get(reverse("account-list"), merchant_page), shown)
+        self.assertContains(
+            self.client.get(reverse("account-details", args=[self.merchant.pk])), shown
+        )
+        results = self.client.get(reverse("api-account-list")).json()["results"]
+        balances = {row["ref"]: row["balance"] for row in results}
+        self.assertEqual(balances, {"1": "50.00", "2": "50.00"})
+        for name in ("api-account-details", "api-account-balance"):
+            response = self.client.get(reverse(name, args=[self.merchant.pk]))
+            self.assertEqual(response.json()["balance"], "50.00")
+
+    def test_bulk_transfer_folds_shards_before_debiting(self):
+        Transactions.transfer("1", "30.00", "2")
+        results = Transactions.bulk_transfer([("2", "1", "20.00")])
+        self.assertEqual(results[0]["status"], "completed")
+        self.merchant.refresh_from_db()
+        self.assertEqual(self.merchant.balance, Decimal("10.00"))
+        self.assertFalse(self.merchant.balance_shards.filter(received_count__gt=0).exists())
+        call_command("check_ledger_balances", stdout=StringIO())
+        call_command("check_ledger_summary", stdout=StringIO())
+
+    def test_unmarked_account_credits_its_row(self):
+        call_command("mark_hot_accounts", "2", unmark=True, stdout=StringIO())
+        Transactions.transfer("1", "10.00", "2")
+        self.merchant.refresh_from_db()
+        self.assertEqual(self.merchant.balance, Decimal("10.00"))
+        with self.assertRaises(CommandError):
+            call_command("mark_hot_accounts", "404", stdout=StringIO())
+
+
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        self.sender = Account.objects.create(ref="1", name="John", balance=1000)
+        self.recipient = Account.objects.create(ref="2", name="Jane", balance=0)
+        self.ids = [
+            Transactions.transfer("1", amount, "2").pk
+            for amount in ("5.00", "10.00", "15.00", "20.00", "25.00")
+        ]
+        # The first three are a year and more old, one day apart.
+        for days, pk in enumerate(self.ids[:3]):
+            Transactions.objects.filter(pk=pk).update(
+                created=timezone.now() - timedelta(days=400 - days)
+            )
+
+    def archive(self, *args):
+        call_command("archive_transactions", *args, stdout=StringIO())
+
+    def test_archive_moves_old_transactions_with_carry_forward(self):
+        self.archive("--batch-size", "2")
+        archived = ArchivedTransaction.objects.order_by("id")
+        self.assertEqual(list(archived.values_list("id", flat=True)), self.ids[:3])
+        self.assertEqual(
+            list(Transactions.objects.order_by("id").values_list("id", flat=True)),
+            self.ids[3:],
+        )
+        carried = AccountArchiveSummary.objects.get(account=self.sender)
+        self.assertEqual((carried.total_sent, carried.transaction_count), (30, 3))
+        call_command("check_ledger_summary", stdout=StringIO())
+        call_command("rebuild_ledger_summary", stdout=StringIO())
+        summary = AccountLedgerSummary.objects.get(account=self.recipient)
+        self.assertEqual((summary.total_received, summary.transaction_count), (75, 5))
+        call_command("check_ledger_balances", stdout=StringIO())
+
+    def test_interrupted_archive_resumes(self):
+        cutoff = timezone.now() - timedelta(days=365)
+
+        def interrupt(archived):
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            archive_transactions(cutoff, batch_size=2, on_batch=interrupt)
+        self.assertEqual(ArchivedTransaction.objects.count(), 2)
+        call_command("check_ledger_summary", stdout=StringIO())
+
+        self.assertEqual(archive_transactions(cutoff, batch_size=2), 1)
+        carried = AccountArchiveSummary.objects.get(account=self.sender)
+        self.assertEqual(carried.transaction_count, 3)
+        self.assertEqual(archive_transactions(cutoff, batch_size=2), 0)
+
+    def test_history_falls_through_to_archive(self):
+        self.archive()
+        url = reverse("account-details", args=[self.sender.pk])
+        response = self.client.get(url, {"page_size": 2})
+        pages = [[row.pk for row in response.context["transactions"]]]
+        while response.context["next_url"]:
+            response = self.client.get(url + response.context["next_url"])
+            pages.append([row.pk for row in response.context["transactions"]])
+        newest_first = self.ids[::-1]
+        self.assertEqual(pages, [newest_first[:2], newest_first[2:4], newest_first[4:]])
+
+        response = self.client.get(
+            reverse("api-account-transactions", args=[self.sender.pk]),
+            {"page_size": 4},
+        )
+        results = response.json()["results"]
+        self.assertEqual([row["id"] for row in results], newest_first[:4])
+
+        export = self.client.get(
+            reverse("account-transactions-export", args=[self.sender.pk])
+        )
+        rows = b"".join(export.streaming_content).decode().splitlines()[1:]
+        self.assertEqual([int(row.split(",")[0]) for row in rows], self.ids)
+
+    def test_archive_must_keep_idempotency_keys(self):
+        with self.assertRaisesMessage(CommandError, "TRANSFER_IDEMPOTENCY_KEY_TTL"):
+            self.archive("--older-than-days", "0")
+        self.assertFalse(ArchivedTransaction.objects.exists())
+
+
+class LedgerTests(TestCase):
+
+    def setUp(self):
+        self.alice = Account.objects.create(ref="1", name="Alice", balance=100.0)
+        self.bob = Account.objects.create(ref="2", name="Bob", balance=100.0)
+
+    def test_every_posting_sums_to_zero(self):
+        Transactions.transfer("1", "10.00", "2")
+        Transactions.bulk_transfer([("2", "1", "5.00"), ("1", "2", "500.00")])
+        self.assertEqual(LedgerEntry.objects.count(), 8)
+        self.assertEqual(LedgerEntry.objects.aggregate(total=Sum("amount"))["total"], 0)
+        transfer = Transactions.objects.earliest("id")
+        self.assertEqual(
+            sorted(transfer.ledger_entries.values_list("account_id", "amount")),
+            [(self.alice.pk, Decimal("-10.00")), (self.bob.pk, Decimal("10.00"))],
+        )
+
+    def test_entries_are_append_only(self):
+        entry = LedgerEntry.objects.filter(account=self.alice).get()
+        entry.amount = 0
+        with self.assertRaises(ValueError):
+            entry.save()
+        with self.assertRaises(ValueError):
+            entry.delete()
+        with self.assertRaises(ValueError):
+            LedgerEntry.objects.update(amount=0)
+        with self.assertRaises(ValueError):
+            LedgerEntry.objects.all().delete()
+
+    def test_balance_at_uses_snapshot_and_tail(self):
+        Transactions.transfer("1", "10.00", "2")
+        checkpoint = timezone.now()
+        Transactions.transfer("1", "20.00", "2")
+        call_command("snapshot_balances", min_entries=2, stdout=StringIO())
+        self.assertEqual(BalanceSnapshot.objects.count(), 2)
+        snapshot = BalanceSnapshot.objects.get(account=self.alice)
+        self.assertEqual(snapshot.balance, Decimal("70.00"))
+
+        Transactions.transfer("1", "5.00", "2")
+        with self.assertNumQueries(2):
+            self.assertEqual(balance_at(self.alice.pk), Decimal("65.00"))
+        self.assertEqual(balance_at(self.alice.pk, checkpoint), Decimal("90.00"))
+        self.assertEqual(
+            balance_at(self.bob.pk, snapshot.as_of - timedelta(days=1)), Decimal("0")
+        )
+
+    def test_snapshots_skip_accounts_with_short_tails(self):
+        Transactions.transfer("1", "10.00", "2")
+        call_command("snapshot_balances", min_entries=2, stdout=StringIO())
+        call_command("snapshot_balances", min_entries=2, stdout=StringIO())
+        self.assertEqual(BalanceSnapshot.objects.count(), 2)
+        Transactions.transfer("1", "10.00", "2")
+        call_command("snapshot_balances", min_entries=2, stdout=StringIO())
+        self.assertEqual(BalanceSnapshot.objects.count(), 2)
+
+    def test_snapshots_lock_the_shards_of_hot_accounts(self):
+        call_command("mark_hot_accounts", "2", stdout=StringIO())
+        Transactions.transfer("1", "10.00", "2")
+        self.assertTrue(AccountBalanceShard.objects.filter(balance__gt=0).exists())
+        with CaptureQueriesContext(connection) as queries:
+            call_command("snapshot_balances", min_entries=1, stdout=StringIO())
+        shard_table = AccountBalanceShard._meta.db_table
+        self.assertTrue(
+            any(shard_table in query["sql"] for query in queries.captured_queries)
+        )
+        self.assertEqual(
+            BalanceSnapshot.objects.get(account=self.bob).balance, Decimal("110.00")
+        )
+
+    def test_check_command_finds_unrecorded_balance_changes(self):
+        Transactions.transfer("1", "10.00", "2")
+        call_command("snapshot_balances", min_entries=1, stdout=StringIO())
+        out = StringIO()
+        call_command("check_ledger_balances", batch_size=1, stdout=out)
+        self.assertIn("All account balances match the ledger.", out.getvalue())
+
+        Account.objects.filter(pk=self.bob.pk).update(balance=1)
+        with self.assertRaises(CommandError):
+            call_command("check_ledger_balances", stdout=StringIO())
+
+    def test_saving_a_changed_balance_posts_an_adjustment(self):
+        # Loaded before the transfer, as an admin change form would be.
+        alice = Account.objects.get(pk=self.alice.pk)
+        Transactions.transfer("1", "10.00", "2")
+        alice.balance = Decimal("150.00")
+        alice.save()
+        entry = LedgerEntry.objects.get(account=alice, kind=LedgerEntry.ADJUSTMENT)
+        self.assertEqual(entry.amount, Decimal("60.00"))
+        self.assertEqual(balance_at(alice.pk), Decimal("150.00"))
+
+        alice.name = "Alice B."
+        alice.save()
+        alice.save(update_fields=["name"])
+        self.assertEqual(LedgerEntry.objects.filter(kind=LedgerEntry.ADJUSTMENT).count(), 2)
+        self.assertEqual(LedgerEntry.objects.aggregate(total=Sum("amount"))["total"], 0)
+
+    def test_accounts_with_entries_cannot_be_deleted(self):
+        with self.assertRaises(ProtectedError):
+            self.alice.delete()
+        self.assertEqual(LedgerEntry.objects.filter(account=self.alice).count(), 1)
+
+
+# Runs EXPLAIN QUERY PLAN on the app's key queries and fails when one of them
+# falls back to a full table scan or sorts rows an index should return in order.
+class QueryPlanTests(TestCase):
+
+    def setUp(self):
+        self.account = Account.objects.create(ref="1", name="John", balance=100.0)
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertUsesIndexes(self, queryset, allow_sort=False):
+        plan = self.query_plan(queryset)
+        full_scans = [
+            step for step in plan if step.startswith("SCAN") and "INDEX" not in step
+        ]
+        self.assertEqual(full_scans, [], plan)
+        if not allow_sort:
+            sorts = [step for step in plan if "TEMP B-TREE" in step]
+            self.assertEqual(sorts, [], plan)
+
+    def list_view_queryset(self, **params):
+        view = AccountListView()
+        view.setup(RequestFactory().get("/", params))
+        return view.get_queryset()[:51]
+
+    def test_account_list_next_page(self):
+        self.assertUsesIndexes(self.list_view_queryset(after=1000))
+
+    def test_account_list_previous_page(self):
+        self.assertUsesIndexes(self.list_view_queryset(before=1000))
+
+    def test_account_list_prefix_search(self):
+        self.assertUsesIndexes(self.list_view_queryset(q="Jo"), allow_sort=True)
+
+    def test_account_lookup_by_ref(self):
+        self.assertUsesIndexes(Account.objects.filter(ref="1"))
+
+    def test_transfer_account_lock(self):
+        self.assertUsesIndexes(
+            Account.objects.select_for_update().filter(ref__in=["1", "2"]),
+        )
+
+    def test_account_history_first_page(self):
+        self.assertUsesIndexes(Transactions.history(self.account)[:51])
+
+    def test_account_history_cursor_page(self):
+        cursor = (timezone.now(), 1000)
+        self.assertUsesIndexes(Transactions.history(self.account, cursor)[:51])
+
+    def test_transactions_date_range(self):
+        now = timezone.now()
+        self.assertUsesIndexes(
+            Transactions.objects.filter(
+                created__gte=now - timedelta(days=1), created__lt=now
+            ).order_by("created")
+        )
@@ -3,4 +3,6 @@ from .views import *
 
 urlpatterns = [
     path("balance-transfer/", BalanceTransferView.as_view(),name="balance-transaction"),
+    path("async/balance-transfer/", AsyncBalanceTransferView.as_view(),name="balance-transaction-async"),
+    path("bulk-transfer/", BulkTransferView.as_view(),name="bulk-transfer"),
     ]
@@ -1,14 +1,16 @@
 from django.core.exceptions import ValidationError
 from account.models import Account
 
-def check_sender_exists(sender_ref):
-    try:
-        Account.objects.get(ref=sender_ref)
-    except Account.DoesNotExist:
-        raise ValidationError(f"Sender with reference '{sender_ref}' does not exist.")
-
-def check_recipient_exists(recipient_ref):
-    try:
-        Account.objects.get(ref=recipient_ref)
-    except Account.DoesNotExist:
-        raise ValidationError(f"Recipient with reference '{recipient_ref}' does not exist.")
\ No newline at end of file
+def check_accounts_exist(sender_ref, recipient_ref, accounts=None):
+    # accounts lets async callers pass in refs they already loaded.
+    if accounts is None:
+        refs = {ref for ref in (sender_ref, recipient_ref) if ref}
+        accounts = Account._get_accounts_by_ref(refs)
+    errors = {}
+    if sender_ref and sender_ref not in accounts:
+        errors["sender"] = ValidationError(f"Sender with reference '{sender_ref}' does not exist.")
+    if recipient_ref and recipient_ref not in accounts:
+        errors["recipient"] = ValidationError(f"Recipient with reference '{recipient_ref}' does not exist.")
+    if errors:
+        raise ValidationError(errors)
+    return accounts.get(sender_ref), accounts.get(recipient_ref)
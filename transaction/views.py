@@ -1,43 +1,152 @@
+from asgiref.sync import sync_to_async
 from django.shortcuts import redirect, render
 from django.views import View
 from django.contrib import messages
 from django.core.exceptions import ValidationError
 
-from .forms import TransactionForm
+import csv
+import io
+import uuid
+
+from .forms import BulkTransferForm, TransactionForm
+from .group_commit import submit_transfer
+from account.models import Account
 from .models import Transactions
 
 
 class BalanceTransferView(View):
 
     def get(self, request):
-        form = TransactionForm()
+        form = TransactionForm(initial={"idempotency_key": uuid.uuid4().hex})
         return render(request, "transaction/balance_transaction.html", {"form": form})
 
     def post(self, request):
-        form = TransactionForm(data=request.POST)
+        form = TransactionForm(
+            data=request.POST,
+            idempotency_header=request.headers.get("Idempotency-Key"),
+        )
 
         if form.is_valid():
-            cleaned_data = form.cleaned_data
-            sender_ref, recipient_ref, amount = (
-                cleaned_data.get("sender"),
-                cleaned_data.get("recipient"),
-                cleaned_data.get("amount"),
+            response = self._transfer(request, form)
+            if response:
+                return response
+
+        return self._render_form(request, form)
+
+    def _render_form(self, request, form):
+        # A bad idempotency key comes from the client, not from what the
+        # user typed, so it is answered with a 400.
+        status = 400 if "idempotency_key" in form.errors else 200
+        return render(
+            request,
+            "transaction/balance_transaction.html",
+            {"form": form},
+            status=status,
+        )
+
+    def _transfer(self, request, form):
+        cleaned_data = form.cleaned_data
+        try:
+            submit_transfer(
+                sender=cleaned_data["sender_account"],
+                recipient=cleaned_data["recipient_account"],
+                transaction_amount=cleaned_data["amount"],
+                idempotency_key=cleaned_data["idempotency_key"],
             )
-            if sender_ref == recipient_ref:
-                messages.error(request, "Sender and recipient cannot be the same.")
-            else:
-                try:
-                    Transactions.transfer(
-                        sender_ref=sender_ref,
-                        transaction_amount=amount,
-                        recipient_ref=recipient_ref,
-                    )
-                    
-                    messages.success(request, "Transaction Completed Successfully")
-                    return redirect("balance-transaction")
-                except ValidationError as e:
-                    form.add_error(None, str(e))
-                except Exception as e:
-                    messages.error(request, f"Error making transaction: {e}")
-                    
-        return render(request, "transaction/balance_transaction.html", {"form": form})
+
+            messages.success(request, "Transaction Completed Successfully")
+            return redirect(request.path)
+        except ValidationError as e:
+            form.add_error(None, e)
+        except Exception as e:
+            messages.error(request, f"Error making transaction: {e}")
+
+
+class AsyncBalanceTransferView(BalanceTransferView):
+
+    async def get(self, request):
+        return super().get(request)
+
+    async def post(self, request):
+        # Accounts are loaded through the async ORM; only the atomic transfer
+        # itself runs in a worker thread, in a single sync_to_async call.
+        # Stripped as the form's fields strip them.
+        refs = {
+            (request.POST.get(field) or "").strip() for field in ("sender", "recipient")
+        } - {""}
+        accounts = {
+            account.ref: account
+            async for account in Account.objects.filter(ref__in=refs)
+        }
+        form = TransactionForm(
+            data=request.POST,
+            accounts=accounts,
+            idempotency_header=request.headers.get("Idempotency-Key"),
+        )
+
+        if form.is_valid():
+            response = await sync_to_async(self._transfer)(request, form)
+            if response:
+                return response
+
+        return self._render_form(request, form)
+
+
+class BulkTransferView(View):
+    template_name = "transaction/bulk_transfer.html"
+    required_fields = ["Sender", "Recipient", "Amount"]
+
+    def get(self, request):
+        form = BulkTransferForm()
+        return render(request, self.template_name, {"form": form})
+
+    def post(self, request):
+        form = BulkTransferForm(request.POST, request.FILES)
+        context = {"form": form}
+
+        if form.is_valid():
+            try:
+                transfers = self._read_transfers(request.FILES["data_file"])
+                results = Transactions.bulk_transfer(transfers)
+                rejected = [result for result in results if result["error"]]
+                context.update(
+                    {
+                        "completed_count": len(results) - len(rejected),
+                        "rejected": rejected,
+                    }
+                )
+                messages.success(
+                    request,
+                    f"{len(results) - len(rejected)} of {len(results)} transfers completed.",
+                )
+            except ValidationError as e:
+                messages.error(request, " ".join(e.messages))
+            except Exception as e:
+                messages.error(request, f"Error making transactions: {e}")
+
+        return render(request, self.template_name, context)
+
+    def _read_transfers(self, csv_file):
+        decoded_file = io.TextIOWrapper(csv_file.file, encoding="utf-8", newline="")
+        try:
+            reader = csv.DictReader(decoded_file)
+            missing_headers = [
+                field
+                for field in self.required_fields
+                if field not in (reader.fieldnames or [])
+            ]
+            if missing_headers:
+                raise ValidationError(
+                    f"Missing required headers in CSV: {', '.join(missing_headers)}"
+                )
+            transfers = [
+                (row["Sender"], row["Recipient"], row["Amount"]) for row in reader
+            ]
+        except (csv.Error, UnicodeDecodeError) as e:
+            raise ValidationError(f"Error reading CSV file: {e}")
+        finally:
+            decoded_file.detach()
+
+        if not transfers:
+            raise ValidationError("The CSV file contains only headers and no data rows.")
+        return transfers